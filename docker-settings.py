@@ -46,7 +46,17 @@ CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.redis.RedisCache',
         'LOCATION': config('REDIS_URL', default='redis://redis:6379/1'),
-    }
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': config('REDIS_URL', default='redis://redis:6379/1'),
+        'KEY_PREFIX': 'shared',
+        'TIMEOUT': None,
+    },
+    'local': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ecom-local',
+    },
 } if config('USE_REDIS', default=False, cast=bool) else {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
@@ -55,7 +65,18 @@ CACHES = {
         'OPTIONS': {
             'MAX_ENTRIES': 1000,
         }
-    }
+    },
+    # Catalog version stamp and summary must be seen by every worker
+    # (python manage.py createcachetable)
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'ecom_shared_cache',
+        'TIMEOUT': None,
+    },
+    'local': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ecom-local',
+    },
 }
 
 # Logging configuration for Docker
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Customer, Product, Orders, Feedback, OrderItem, Address, ChatSession, ChatMessage, ChatbotKnowledge
+from .models import Customer, Product, ProductVariant, Orders, Feedback, OrderItem, Address, ChatSession, ChatMessage, ChatbotKnowledge
 @admin.register(Address)
 class AddressAdmin(admin.ModelAdmin):
     list_display = ['region', 'province', 'city_municipality', 'barangay', 'street', 'postal_code']
@@ -8,34 +8,24 @@ class AddressAdmin(admin.ModelAdmin):
 @admin.register(Customer)
 class CustomerAdmin(admin.ModelAdmin):
     list_display = ['user', 'mobile', 'region_name', 'province_name', 'citymun_name', 'barangay_name']
-    list_filter = ['region', 'province', 'citymun', 'barangay']
-    search_fields = ['user__first_name', 'user__last_name', 'region', 'province', 'citymun', 'barangay', 'street_address']
+    list_filter = ['region_name', 'province_name', 'citymun_name']
+    search_fields = ['user__first_name', 'user__last_name', 'region', 'province', 'citymun', 'barangay', 'street_address', 'formatted_address']
+    list_select_related = ['user']
 
-    def region_name(self, obj):
-        from ecom.utils import get_region_name
-        return get_region_name(obj.region) if obj.region else ''
-    region_name.short_description = 'Region'
-
-    def province_name(self, obj):
-        from ecom.utils import get_province_name
-        return get_province_name(obj.province) if obj.province else ''
-    province_name.short_description = 'Province'
-
-    def citymun_name(self, obj):
-        from ecom.utils import get_citymun_name
-        return get_citymun_name(obj.citymun) if obj.citymun else ''
-    citymun_name.short_description = 'City/Municipality'
-
-    def barangay_name(self, obj):
-        from ecom.utils import get_barangay_name
-        return get_barangay_name(obj.barangay) if obj.barangay else ''
-    barangay_name.short_description = 'Barangay'
+class ProductVariantInline(admin.TabularInline):
+    model = ProductVariant
+    extra = 0
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
     list_display = ['name', 'price', 'size']
     list_filter = ['size']
     search_fields = ['name', 'description']
+    inlines = [ProductVariantInline]
+
+    def save_model(self, request, obj, form, change):
+        # The counters are kept up to date elsewhere; write back only the form's fields
+        obj.save(update_fields=form._meta.fields if change else None)
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
@@ -46,8 +36,8 @@ class OrderAdmin(admin.ModelAdmin):
         'order_ref', 'customer', 'status', 'payment_method', 'address', 
         'mobile', 'email', 'order_date', 'created_at', 'estimated_delivery_date'
     )
-    list_filter = ('status', 'created_at', 'payment_method')
-    search_fields = ('order_ref', 'customer__user__first_name', 'customer__user__last_name', 'mobile', 'email', 'address')
+    list_filter = ('status', 'created_at', 'payment_method', 'province_name', 'citymun_name')
+    search_fields = ('order_ref', 'customer__user__first_name', 'customer__user__last_name', 'mobile', 'email', 'address', 'formatted_address')
     inlines = [OrderItemInline]
 
 admin.site.register(Orders, OrderAdmin)
@@ -1,105 +1,134 @@
+import hashlib
 import requests
 import json
 import os
-from django.http import JsonResponse
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response
 from django.views.decorators.http import require_GET, require_POST
 from django.views.decorators.csrf import csrf_exempt, csrf_protect
 
-PSGC_BASE_URL = "https://psgc.gitlab.io/api"
+from . import gazetteer, utils
+from .upstream import CircuitOpenError, psgc_get
+
+
+# The bundled PSGC data only changes with a deploy, so browsers may keep it
+PSGC_CACHE_MAX_AGE = 60 * 60 * 24 * 7
+# Lists fetched from the upstream API for levels missing from the bundled data
+PSGC_UPSTREAM_CACHE_TIMEOUT = 60 * 60 * 24
+
+def psgc_json_response(request, body, etag):
+    """Serve precomputed JSON bytes with a strong ETag, answering revalidations with 304"""
+    response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    response['Cache-Control'] = f'public, max-age={PSGC_CACHE_MAX_AGE}'
+    return get_conditional_response(request, etag=etag, response=response)
+
+def upstream_psgc_response(request, path, error):
+    """Proxy a list from the upstream API, caching successful answers only"""
+    cache_key = f"psgc_upstream_{path}"
+    payload = cache.get(cache_key)
+    if payload is None:
+        try:
+            response = psgc_get(path)
+            if response.status_code == 404:
+                return JsonResponse({"error": error}, status=404)
+            response.raise_for_status()
+            body = json.dumps(response.json(), separators=(',', ':')).encode('utf-8')
+        except (CircuitOpenError, requests.RequestException, ValueError):
+            return JsonResponse({"error": error}, status=500)
+        payload = (body, '"%s"' % hashlib.sha1(body).hexdigest())
+        cache.set(cache_key, payload, PSGC_UPSTREAM_CACHE_TIMEOUT)
+    return psgc_json_response(request, *payload)
+
+def psgc_places_response(request, level, parent_level, parent_code, upstream_path, error):
+    """
+    Children of a place: from the bundled index for every level it covers,
+    from the upstream API for the rest (barangays) and for parents the
+    index does not know
+    """
+    index = gazetteer.get_index()
+    payload = index.payload(level, parent_level, parent_code) if index.has_level(level) else None
+    if payload is None:
+        return upstream_psgc_response(request, upstream_path, error)
+    return psgc_json_response(request, *payload)
 
 @require_GET
 def get_regions(request):
-    try:
-        response = requests.get(f"{PSGC_BASE_URL}/regions/")
-        response.raise_for_status()
-        data = response.json()
-        return JsonResponse(data, safe=False)
-    except requests.RequestException:
-        return JsonResponse({"error": "Failed to fetch regions"}, status=500)
+    return psgc_places_response(request, 'region', None, None, 'regions/', "Failed to fetch regions")
 
 @require_GET
 def get_provinces(request):
     region_id = request.GET.get('region_id')
     if not region_id:
         return JsonResponse({"error": "region_id parameter is required"}, status=400)
-    try:
-        response = requests.get(f"{PSGC_BASE_URL}/regions/{region_id}/provinces/")
-        response.raise_for_status()
-        data = response.json()
-        return JsonResponse(data, safe=False)
-    except requests.RequestException:
-        return JsonResponse({"error": "Failed to fetch provinces"}, status=500)
+    return psgc_places_response(
+        request, 'province', 'region', region_id,
+        f"regions/{region_id}/provinces/", "Failed to fetch provinces"
+    )
 
 @require_GET
 def get_cities(request):
     province_id = request.GET.get('province_id')
     region_id = request.GET.get('region_id')
-    try:
-        if province_id:
-            response = requests.get(f"{PSGC_BASE_URL}/provinces/{province_id}/cities-municipalities/")
-            response.raise_for_status()
-            data = response.json()
-            return JsonResponse(data, safe=False)
-        elif region_id:
-            # For NCR and similar regions without provinces
-            response = requests.get(f"{PSGC_BASE_URL}/regions/{region_id}/cities-municipalities/")
-            response.raise_for_status()
-            data = response.json()
-            return JsonResponse(data, safe=False)
-        else:
-            return JsonResponse({"error": "province_id or region_id parameter is required"}, status=400)
-    except requests.RequestException:
-        return JsonResponse({"error": "Failed to fetch cities"}, status=500)
+    if province_id:
+        return psgc_places_response(
+            request, 'citymun', 'province', province_id,
+            f"provinces/{province_id}/cities-municipalities/", "Failed to fetch cities"
+        )
+    elif region_id:
+        # For NCR and similar regions without provinces
+        return psgc_places_response(
+            request, 'citymun', 'region', region_id,
+            f"regions/{region_id}/cities-municipalities/", "Failed to fetch cities"
+        )
+    else:
+        return JsonResponse({"error": "province_id or region_id parameter is required"}, status=400)
 
 @require_GET
 def get_barangays(request):
     city_id = request.GET.get('city_id')
     if not city_id:
         return JsonResponse({"error": "city_id parameter is required"}, status=400)
+    return psgc_places_response(
+        request, 'barangay', 'citymun', city_id,
+        f"cities-municipalities/{city_id}/barangays/", "Failed to fetch barangays"
+    )
+
+# Most suggestions a client may ask for at once
+PLACE_SUGGEST_MAX_LIMIT = 25
+
+@require_GET
+def suggest_places(request):
+    """
+    Type-ahead over city, barangay and province names, each with its full
+    region/province/city path. API only: the address forms still use the
+    region/province/city/barangay dropdowns.
+    """
+    query = request.GET.get('q', '').strip()
     try:
-        response = requests.get(f"{PSGC_BASE_URL}/cities-municipalities/{city_id}/barangays/")
-        response.raise_for_status()
-        data = response.json()
-        return JsonResponse(data, safe=False)
-    except requests.RequestException:
-        return JsonResponse({"error": "Failed to fetch barangays"}, status=500)
+        limit = min(max(int(request.GET.get('limit', 10)), 1), PLACE_SUGGEST_MAX_LIMIT)
+    except ValueError:
+        return JsonResponse({"error": "limit must be a number"}, status=400)
+    if len(query) < 2:
+        return JsonResponse([], safe=False)
+    response = JsonResponse(gazetteer.get_index().suggest(query, limit), safe=False)
+    response['Cache-Control'] = f'public, max-age={PSGC_CACHE_MAX_AGE}'
+    return response
 
-# Utility functions for backend name resolution
+# Utility functions for backend name resolution; these go through the shared
+# resolver (bundled data, cache, then the circuit-guarded API)
 def get_region_name(region_id):
-    try:
-        response = requests.get(f"{PSGC_BASE_URL}/regions/{region_id}/")
-        response.raise_for_status()
-        region = response.json()
-        return region.get('name', region_id)
-    except Exception:
-        return region_id
+    return utils.get_region_name(region_id)
 
 def get_province_name(province_id):
-    try:
-        response = requests.get(f"{PSGC_BASE_URL}/provinces/{province_id}/")
-        response.raise_for_status()
-        province = response.json()
-        return province.get('name', province_id)
-    except Exception:
-        return province_id
+    return utils.get_province_name(province_id)
 
 def get_citymun_name(citymun_id):
-    try:
-        response = requests.get(f"{PSGC_BASE_URL}/cities-municipalities/{citymun_id}/")
-        response.raise_for_status()
-        city = response.json()
-        return city.get('name', citymun_id)
-    except Exception:
-        return citymun_id
+    return utils.get_citymun_name(citymun_id)
 
 def get_barangay_name(barangay_id):
-    try:
-        response = requests.get(f"{PSGC_BASE_URL}/barangays/{barangay_id}/")
-        response.raise_for_status()
-        barangay = response.json()
-        return barangay.get('name', barangay_id)
-    except Exception:
-        return barangay_id
+    return utils.get_barangay_name(barangay_id)
 
 @csrf_protect
 @require_POST
@@ -2,8 +2,12 @@ from django.apps import AppConfig
 
 
 class EcomConfig(AppConfig):
+    default = True
     name = 'ecom'
 
+    def ready(self):
+        from . import signals  # noqa: F401
+
 
 class JerseyCustomizerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
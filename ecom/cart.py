@@ -0,0 +1,259 @@
+"""
+Shopping cart storage.
+
+Customers keep their cart in ``CartItem`` rows; everyone else keeps it in one
+signed, compressed cookie of ``(product_id, size, quantity)`` triples, written
+back by ``CartMiddleware``. Views get the cart for a request with
+:func:`get_cart` and load every line with its product in one query through
+:meth:`Cart.lines`. At login the cookie cart is added to the customer's
+(:func:`merge_anonymous_cart`).
+"""
+import secrets
+from collections import namedtuple
+
+from django.core import signing
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from . import models, reservations
+
+CART_COOKIE = 'cart'
+CART_COOKIE_SALT = 'ecom.cart'
+CART_COOKIE_MAX_AGE = 60 * 60 * 24 * 30
+
+# Session key of the token an anonymous cart holds stock under
+HOLDER_SESSION_KEY = 'cart_holder'
+
+# Cookies that held the cart before it moved server-side
+LEGACY_COOKIE = 'product_ids'
+
+CartLine = namedtuple('CartLine', 'product size quantity')
+
+
+def encode_cart_cookie(items):
+    """Cookie value for ``{(product_id, size): quantity}``"""
+    triples = [[product_id, size, quantity] for (product_id, size), quantity in items.items()]
+    return signing.dumps(triples, salt=CART_COOKIE_SALT, compress=True)
+
+
+def decode_cart_cookie(value):
+    """``{(product_id, size): quantity}`` from a cookie value; empty if missing or tampered with"""
+    if not value:
+        return {}
+    try:
+        triples = signing.loads(value, salt=CART_COOKIE_SALT, max_age=CART_COOKIE_MAX_AGE)
+        return {(int(product_id), str(size)): int(quantity) for product_id, size, quantity in triples}
+    except (signing.BadSignature, TypeError, ValueError):
+        return {}
+
+
+class Cart:
+    """The cart of one request; ``customer`` is None for anonymous visitors"""
+
+    def __init__(self, request, customer=None):
+        self.request = request
+        self.customer = customer
+        self._items = None
+
+    # -- reading ---------------------------------------------------------
+
+    def quantities(self):
+        """``{(product_id, size): quantity}`` without loading products"""
+        if self.customer is not None:
+            rows = models.CartItem.objects.filter(customer=self.customer).values_list('product_id', 'size', 'quantity')
+            return {(product_id, size): quantity for product_id, size, quantity in rows}
+        return dict(self._cookie_items())
+
+    def lines(self):
+        """Every line with its product, loaded in one query, in the order added"""
+        if self.customer is not None:
+            items = (
+                models.CartItem.objects.filter(customer=self.customer)
+                .select_related('product')
+                .order_by('created_at', 'id')
+            )
+            # Lines of the same product share one instance, like the cookie path
+            products = {}
+            return [
+                CartLine(products.setdefault(item.product_id, item.product), item.size, item.quantity)
+                for item in items
+            ]
+
+        items = list(self._cookie_items().items())
+        products = models.Product.objects.in_bulk({product_id for (product_id, _), _ in items})
+        return [
+            CartLine(products[product_id], size, quantity)
+            for (product_id, size), quantity in items
+            if product_id in products
+        ]
+
+    def count(self):
+        """Number of distinct product/size lines, as shown on the cart badge"""
+        if self.customer is not None:
+            return models.CartItem.objects.filter(customer=self.customer).count()
+        return len(self._cookie_items())
+
+    def quantity(self, product_id, size):
+        return self.quantities().get((int(product_id), size), 0)
+
+    def holder(self, create=True):
+        """
+        Owner of this cart's stock holds: the customer, or a token kept in
+        the visitor's session (created here if ``create``; otherwise None
+        without one). Unlike the session key, the token survives login.
+        """
+        if self.customer is not None:
+            return f'customer:{self.customer.id}'
+        token = self.request.session.get(HOLDER_SESSION_KEY)
+        if token is None:
+            if not create:
+                return None
+            token = secrets.token_urlsafe(16)
+            self.request.session[HOLDER_SESSION_KEY] = token
+        return f'session:{token}'
+
+    # -- writing ---------------------------------------------------------
+
+    def add(self, product_id, size, quantity=1):
+        """Add ``quantity`` to a line, creating it if needed"""
+        product_id = int(product_id)
+        if self.customer is not None:
+            lines = models.CartItem.objects.filter(customer=self.customer, product_id=product_id, size=size)
+            if not lines.update(quantity=F('quantity') + quantity):
+                try:
+                    with transaction.atomic():
+                        models.CartItem.objects.create(
+                            customer=self.customer, product_id=product_id, size=size, quantity=quantity
+                        )
+                except IntegrityError:
+                    # Another request created the line first
+                    lines.update(quantity=F('quantity') + quantity)
+            return
+
+        items = self._cookie_items()
+        items[(product_id, size)] = items.get((product_id, size), 0) + quantity
+        self._save_cookie_items(items)
+
+    def set(self, product_id, size, quantity):
+        """Set a line's quantity; zero or less removes it"""
+        product_id = int(product_id)
+        if quantity <= 0:
+            self.remove(product_id, size)
+            return
+        if self.customer is not None:
+            models.CartItem.objects.update_or_create(
+                customer=self.customer, product_id=product_id, size=size,
+                defaults={'quantity': quantity},
+            )
+            return
+
+        items = self._cookie_items()
+        items[(product_id, size)] = quantity
+        self._save_cookie_items(items)
+
+    def remove(self, product_id, size):
+        product_id = int(product_id)
+        holder = self.holder(create=False)
+        if holder:
+            reservations.release(holder, product_id, size)
+        if self.customer is not None:
+            models.CartItem.objects.filter(customer=self.customer, product_id=product_id, size=size).delete()
+            return
+
+        items = self._cookie_items()
+        if items.pop((product_id, size), None) is not None:
+            self._save_cookie_items(items)
+
+    def clear(self):
+        holder = self.holder(create=False)
+        if holder:
+            reservations.release(holder)
+        if self.customer is not None:
+            models.CartItem.objects.filter(customer=self.customer).delete()
+            return
+        self._save_cookie_items({})
+
+    # -- cookie storage --------------------------------------------------
+
+    def _cookie_items(self):
+        if self._items is None:
+            self._items = decode_cart_cookie(self.request.COOKIES.get(CART_COOKIE))
+        return self._items
+
+    def _save_cookie_items(self, items):
+        self._items = items
+        # Picked up by CartMiddleware; '' deletes the cookie
+        self.request._cart_cookie = encode_cart_cookie(items) if items else ''
+
+
+def get_cart(request):
+    """The :class:`Cart` for ``request``, created once per request"""
+    cart = getattr(request, '_cart', None)
+    if cart is None:
+        customer = None
+        if request.user.is_authenticated:
+            customer = models.Customer.objects.filter(user=request.user).first()
+        cart = Cart(request, customer)
+        request._cart = cart
+    return cart
+
+
+def merge_anonymous_cart(request, customer):
+    """
+    Add the visitor's cookie cart to ``customer``'s when they log in, move
+    the stock it holds over with it, and drop the cookie
+    """
+    anonymous = Cart(request)
+    items = anonymous.quantities()
+    holder = anonymous.holder(create=False)
+    cart = Cart(request, customer)
+    for (product_id, size), quantity in items.items():
+        cart.add(product_id, size, quantity)
+    if holder:
+        reservations.transfer(holder, cart.holder())
+        del request.session[HOLDER_SESSION_KEY]
+    clear_anonymous_cart(request)
+
+
+def clear_anonymous_cart(request):
+    """Drop the cookie cart, e.g. when a visitor logs in to their own account"""
+    if CART_COOKIE in request.COOKIES:
+        request._cart_cookie = ''
+    if hasattr(request, '_cart'):
+        del request._cart
+
+
+def save_cart_cookie(request, response):
+    """Write the cookie cart changed during ``request`` onto ``response``"""
+    value = getattr(request, '_cart_cookie', None)
+    if value is None:
+        return
+    if value:
+        response.set_cookie(CART_COOKIE, value, max_age=CART_COOKIE_MAX_AGE, httponly=True, samesite='Lax')
+    else:
+        response.delete_cookie(CART_COOKIE, samesite='Lax')
+
+
+def parse_legacy_cookies(cookies):
+    """
+    ``[(product_id, size, quantity)]`` from the old ``product_ids`` /
+    ``product_{id}_{size}_details`` cookies, or None if they are absent.
+    """
+    if LEGACY_COOKIE not in cookies:
+        return None
+    lines = []
+    for key in cookies[LEGACY_COOKIE].split('|'):
+        parts = key.split('_')
+        if len(parts) < 3 or not parts[1].isdigit():
+            continue
+        details = cookies.get(f'{key}_details', '').split(':')
+        if len(details) == 2 and details[1].isdigit() and int(details[1]) > 0:
+            lines.append((int(parts[1]), details[0], int(details[1])))
+    return lines
+
+
+def legacy_cookie_names(cookies):
+    return [
+        key for key in cookies
+        if key == LEGACY_COOKIE or (key.startswith('product_') and key.endswith('_details'))
+    ]
@@ -0,0 +1,80 @@
+# JSON cart endpoints: each call returns only the changed line and the new totals
+import json
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_protect
+from django.views.decorators.http import require_POST, require_http_methods
+from . import models, pricing, reservations
+from .cart import get_cart
+
+def cart_summary(cart, product_id, size):
+    """The changed line (None once removed), line count and totals, as compact JSON"""
+    customer = cart.customer
+    quote = pricing.price_cart(cart.lines(), destination=customer.region if customer else None)
+    line = next(
+        (line for line in quote.lines if line.product.id == product_id and line.size == size),
+        None,
+    )
+    return JsonResponse({
+        'line': line and {
+            'product_id': product_id,
+            'size': size,
+            'quantity': line.quantity,
+            'unit_price': str(line.unit_price),
+            'line_total': str(line.line_total),
+        },
+        'count': len(quote.lines),
+        'item_count': sum(line.quantity for line in quote.lines),
+        'totals': {
+            'subtotal': str(quote.subtotal),
+            'vat_amount': str(quote.vat_amount),
+            'net_subtotal': str(quote.net_subtotal),
+            'delivery_fee': str(quote.delivery_fee),
+            'grand_total': str(quote.grand_total),
+        },
+    }, json_dumps_params={'separators': (',', ':')})
+
+@csrf_protect
+@require_POST
+def cart_add_item(request):
+    """Add ``quantity`` of a product in a size; accepts a JSON body or form data"""
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body)
+        except json.JSONDecodeError:
+            return JsonResponse({'error': 'Invalid JSON data'}, status=400)
+    else:
+        data = request.POST
+    try:
+        product_id = int(data.get('product_id'))
+        quantity = int(data.get('quantity', 1))
+    except (TypeError, ValueError):
+        return JsonResponse({'error': 'product_id and quantity must be numbers'}, status=400)
+    size = data.get('size', 'M')
+    if quantity < 1:
+        return JsonResponse({'error': 'quantity must be at least 1'}, status=400)
+
+    product = models.Product.objects.filter(id=product_id).only('name').first()
+    if product is None:
+        return JsonResponse({'error': 'Product not found'}, status=404)
+    # The product's own size or any of its variants, while it has stock
+    if not models.ProductVariant.objects.stock_map([product_id]).get(product_id, {}).get(size):
+        return JsonResponse({'error': f'Sorry, size {size} is not available for this product.'}, status=400)
+
+    # Hold the whole line for this cart; units other carts hold are not available
+    cart = get_cart(request)
+    wanted = cart.quantity(product_id, size) + quantity
+    available = reservations.hold(cart.holder(), product_id, size, wanted)
+    if available < wanted:
+        return JsonResponse(
+            {'error': f'Sorry, only {available} pcs available for {product.name} (Size: {size}).'},
+            status=400,
+        )
+    cart.add(product_id, size, quantity)
+    return cart_summary(cart, product_id, size)
+
+@csrf_protect
+@require_http_methods(['DELETE'])
+def cart_remove_item(request, product_id, size):
+    cart = get_cart(request)
+    cart.remove(product_id, size)
+    return cart_summary(cart, product_id, size)
@@ -0,0 +1,110 @@
+"""
+Cached catalog summary for filter sidebars.
+
+:func:`summary` returns the catalog's price range, a price histogram, how
+many products have stock in each size and how many are in stock at all. It is
+computed in one pass over one query and cached, so catalog pages and
+``/api/catalog-summary/`` read it without touching the product table.
+
+``post_save``/``post_delete`` signals on ``Product`` and ``ProductVariant``
+(see ``ecom.signals``) drop the cached copy once their transaction commits,
+as does placing an order, whose stock decrement is a bulk UPDATE. Writes
+that bypass both still show within ``CATALOG_SUMMARY_TIMEOUT`` seconds.
+The summary is kept in the ``shared`` cache so every worker process sees the
+same copy and the same invalidation. Each process also keeps it in the
+``local`` cache for ``CATALOG_SHARED_REFRESH`` seconds, so other processes see
+a change after at most that long.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from . import models
+
+CACHE_KEY = 'catalog-summary'
+
+CATALOG_SUMMARY_TIMEOUT = getattr(settings, 'CATALOG_SUMMARY_TIMEOUT', 60 * 60)
+# Equal-width price buckets between the cheapest and dearest product
+CATALOG_PRICE_BUCKETS = getattr(settings, 'CATALOG_PRICE_BUCKETS', 5)
+CATALOG_SHARED_REFRESH = getattr(settings, 'CATALOG_SHARED_REFRESH', 5)
+
+
+def _price_buckets(prices, low, high):
+    if not prices:
+        return []
+    count = max(min(CATALOG_PRICE_BUCKETS, high - low + 1), 1)
+    width = -(-(high - low + 1) // count)
+    buckets = [
+        {'min': low + i * width, 'max': min(low + (i + 1) * width - 1, high), 'count': 0}
+        for i in range(count)
+    ]
+    for price in prices:
+        buckets[min((price - low) // width, count - 1)]['count'] += 1
+    return [bucket for bucket in buckets if bucket['min'] <= high]
+
+
+def compute():
+    """Build the summary from one query over products and their variants"""
+    rows = models.Product.objects.values_list(
+        'id', 'price', 'size', 'quantity', 'variants__size', 'variants__quantity'
+    ).order_by('id')
+
+    prices = {}
+    own = {}
+    variants = {}
+    for product_id, price, size, quantity, variant_size, variant_quantity in rows.iterator():
+        prices[product_id] = price
+        own[product_id] = (size, quantity)
+        sizes = variants.setdefault(product_id, {})
+        if variant_size is not None:
+            sizes[variant_size] = variant_quantity
+
+    size_counts = {size: 0 for size, _ in models.Product.SIZE_CHOICES}
+    in_stock = 0
+    for product_id, sizes in variants.items():
+        # Same stock rules as ProductVariant.objects.stock_map and the in_stock filter
+        sizes = models.split_size_stock(*own[product_id], sizes)
+        if any(amount > 0 for amount in sizes.values()):
+            in_stock += 1
+        for size, amount in sizes.items():
+            if amount > 0 and size in size_counts:
+                size_counts[size] += 1
+
+    values = list(prices.values())
+    low, high = (min(values), max(values)) if values else (None, None)
+    return {
+        'total': len(values),
+        'in_stock': in_stock,
+        'out_of_stock': len(values) - in_stock,
+        'price_range': {'min_price': low, 'max_price': high},
+        'price_buckets': _price_buckets(values, low, high),
+        'sizes': [
+            {'size': size, 'label': label, 'count': size_counts[size]}
+            for size, label in models.Product.SIZE_CHOICES
+        ],
+    }
+
+
+def summary():
+    """The cached summary, computed on the first request after a change"""
+    local = caches['local']
+    data = local.get(CACHE_KEY)
+    if data is None:
+        shared = caches['shared']
+        data = shared.get(CACHE_KEY)
+        if data is None:
+            data = compute()
+            shared.set(CACHE_KEY, data, CATALOG_SUMMARY_TIMEOUT)
+        local.set(CACHE_KEY, data, CATALOG_SHARED_REFRESH)
+    return data
+
+
+def _drop():
+    caches['shared'].delete(CACHE_KEY)
+    caches['local'].delete(CACHE_KEY)
+
+
+def invalidate():
+    """Drop the cached summary when the current transaction commits"""
+    # Deleting any earlier would let a concurrent request cache pre-commit data again
+    transaction.on_commit(_drop)
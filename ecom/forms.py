@@ -3,7 +3,7 @@ from django.contrib.auth.models import User
 from django.utils import timezone
 from django.contrib.auth.forms import AuthenticationForm
 from . import models
-from .models import Product, InventoryItem
+from .models import Product, ProductVariant
 
 
 # User registration form
@@ -94,6 +94,15 @@ class ProductForm(forms.ModelForm):
         model = models.Product
         fields = ['name', 'price', 'description', 'product_image', 'quantity', 'size']
 
+    def save(self, commit=True):
+        instance = super().save(commit=False)
+        if commit:
+            # Only the form's fields, so the rating and popularity counters
+            # are never written back from the copy the form loaded
+            instance.save(update_fields=self._meta.fields if instance.pk else None)
+            self._save_m2m()
+        return instance
+
 
 # Address form during checkout or delivery
 class AddressForm(forms.Form):
@@ -157,12 +166,10 @@ class ContactusForm(forms.Form):
 
 # Inventory management form for staff
 class InventoryForm(forms.ModelForm):
+    """Stock of one product in one size; the rows the storefront and checkout read"""
     class Meta:
-        model = InventoryItem
-        fields = ['name', 'quantity', 'description']
-        widgets = {
-            'description': forms.Textarea(attrs={'rows': 2}),
-        }
+        model = ProductVariant
+        fields = ['product', 'size', 'quantity']
 
 
 # Login form for customers
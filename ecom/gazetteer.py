@@ -0,0 +1,284 @@
+"""
+In-process PSGC gazetteer.
+
+The bundled ``staticfiles/ecom/ref*.json`` files are read once per process and
+indexed by code, so translating a region/province/city/barangay code into its
+name is a dictionary lookup instead of a file scan or an HTTP call.
+"""
+import bisect
+import hashlib
+import heapq
+import json
+import logging
+import os
+import re
+import threading
+import unicodedata
+
+from django.conf import settings
+
+LEVELS = ('region', 'province', 'citymun', 'barangay')
+
+# level -> (file name, short code field, name field)
+SOURCES = {
+    'region': ('refregion.json', 'regCode', 'regDesc'),
+    'province': ('refprovince.json', 'provCode', 'provDesc'),
+    'citymun': ('refcitymun.json', 'citymunCode', 'citymunDesc'),
+    'barangay': ('refbrgy.json', 'brgyCode', 'brgyDesc'),
+}
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_index = None
+
+
+def psgc_data_dir():
+    """Directory holding the bundled ref*.json files"""
+    static_dir = getattr(settings, 'STATIC_ROOT', None) or os.path.join(settings.BASE_DIR, 'staticfiles')
+    return os.path.join(static_dir, 'ecom')
+
+
+def read_records(filename):
+    """Return the record list of a bundled PSGC file, or [] if it is missing"""
+    path = os.path.join(psgc_data_dir(), filename)
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error("Error loading local PSGC data from %s: %s", filename, e)
+        return []
+    # The files are exported as {"RECORDS": [...]}; accept a bare list too
+    if isinstance(data, dict):
+        data = data.get('RECORDS', [])
+    return data if isinstance(data, list) else []
+
+
+def code_variants(code):
+    """
+    All spellings of a PSGC code that may be stored on an address.
+
+    The address forms store the code returned by psgc.gitlab.io, which is
+    either the 9-digit PSGC code or its 10-digit form (province part padded
+    with a leading zero); older rows carry the short regCode/provCode/...
+    """
+    code = str(code).strip()
+    variants = [code]
+    if len(code) == 9 and code.isdigit():
+        variants.append(code[:2] + '0' + code[2:])
+    elif len(code) == 10 and code.isdigit() and code[2] == '0':
+        variants.append(code[:2] + code[3:])
+    return variants
+
+
+# level -> (parent level, field holding the parent's short code)
+PARENTS = {
+    'province': ('region', 'regCode'),
+    'citymun': ('province', 'provCode'),
+    'barangay': ('citymun', 'citymunCode'),
+}
+
+# Levels offered by the place autocomplete, in ranking order
+SUGGEST_LEVELS = ('citymun', 'barangay', 'province')
+
+
+def normalize_name(name):
+    """Uppercase ASCII words of a place name: 'Dasmariñas City' -> 'DASMARINAS CITY'"""
+    name = unicodedata.normalize('NFKD', str(name)).encode('ascii', 'ignore').decode('ascii')
+    return ' '.join(re.findall(r'[A-Z0-9]+', name.upper()))
+
+
+class PSGCIndex:
+    """
+    Code -> name maps plus the region -> province -> city -> barangay tree.
+
+    Places are stored under their short code (regCode, provCode, ...);
+    ``short_codes`` maps every accepted spelling of a code to it. Places are
+    published with their 10-digit PSGC code, the form psgc.gitlab.io returns.
+    """
+
+    def __init__(self):
+        self.names = {level: {} for level in LEVELS}
+        self.short_codes = {level: {} for level in LEVELS}
+        self.public_codes = {level: {} for level in LEVELS}
+        self.parents = {level: {} for level in LEVELS}
+        # (level, parent level, parent short code) -> [place, ...]
+        self.children = {}
+        self._payloads = {}
+        # Sorted keys per suggest rank, built on the first suggest()
+        self._prefix = None
+
+    def add(self, level, record):
+        _, code_field, name_field = SOURCES[level]
+        name = record.get(name_field)
+        short_code = str(record.get(code_field) or '')
+        # The files repeat a few codes (e.g. Manila); the first entry wins
+        if not name or not short_code or short_code in self.names[level]:
+            return
+
+        spellings = [short_code]
+        if record.get('psgcCode'):
+            spellings += code_variants(record['psgcCode'])
+        for key in spellings:
+            self.names[level].setdefault(key, name)
+            self.short_codes[level].setdefault(key, short_code)
+        self.public_codes[level][short_code] = spellings[-1]
+
+        place = {'code': spellings[-1], 'name': name}
+        if level in PARENTS:
+            parent_level, parent_field = PARENTS[level]
+            parent_code = str(record.get(parent_field) or '')
+            self.parents[level][short_code] = parent_code
+            place[f"{parent_level}Code"] = self.public_codes[parent_level].get(parent_code, parent_code)
+        self.children.setdefault((level, None, None), []).append(place)
+        for ancestor_level, ancestor_code in self.ancestors(level, short_code):
+            self.children.setdefault((level, ancestor_level, ancestor_code), []).append(place)
+
+    def ancestors(self, level, short_code):
+        """``(level, short code)`` of every enclosing place, innermost first"""
+        while level in PARENTS:
+            short_code = self.parents[level].get(short_code)
+            level = PARENTS[level][0]
+            if not short_code:
+                return
+            yield level, short_code
+
+    def has_level(self, level):
+        return bool(self.names[level])
+
+    def places(self, level, parent_level=None, parent_code=None):
+        """
+        Places at ``level`` inside a parent (all of them when no parent is
+        given), sorted by name. None if the parent is not in the index.
+        """
+        if parent_level is None:
+            return self.children.get((level, None, None), [])
+        short_code = self.short_codes[parent_level].get(str(parent_code).strip())
+        if short_code is None:
+            return None
+        return self.children.get((level, parent_level, short_code), [])
+
+    def payload(self, level, parent_level=None, parent_code=None):
+        """
+        ``(json bytes, strong ETag)`` for :meth:`places`, serialised once per
+        process. None if the parent is not in the index.
+        """
+        short_code = None
+        if parent_level is not None:
+            short_code = self.short_codes[parent_level].get(str(parent_code).strip())
+            if short_code is None:
+                return None
+        key = (level, parent_level, short_code)
+        payload = self._payloads.get(key)
+        if payload is None:
+            body = json.dumps(self.children.get(key, []), separators=(',', ':')).encode('utf-8')
+            payload = (body, '"%s"' % hashlib.sha1(body).hexdigest())
+            self._payloads[key] = payload
+        return payload
+
+    def _build_prefix_index(self):
+        """
+        Sorted normalized names for :meth:`suggest`, one ``(level, keys,
+        short codes)`` list per rank: whole names, then word starts, each by
+        level in ``SUGGEST_LEVELS`` order. Every word start of a name gets its
+        own key, so 'MANILA' finds 'CITY OF MANILA'.
+        """
+        ranks = []
+        for word_starts in (False, True):
+            for level in SUGGEST_LEVELS:
+                rows = []
+                for short_code in self.public_codes[level]:
+                    words = normalize_name(self.names[level][short_code]).split(' ')
+                    starts = range(1, len(words)) if word_starts else (0,)
+                    rows.extend((' '.join(words[start:]), short_code) for start in starts)
+                rows.sort()
+                ranks.append((level, [key for key, _ in rows], [short_code for _, short_code in rows]))
+        return ranks
+
+    def place_path(self, level, short_code):
+        """The place as published by :meth:`suggest`, with its enclosing places"""
+        place = {
+            'level': level,
+            'code': self.public_codes[level][short_code],
+            'name': self.names[level][short_code],
+        }
+        labels = [place['name']]
+        for ancestor_level, ancestor_code in self.ancestors(level, short_code):
+            name = self.names[ancestor_level].get(ancestor_code)
+            if name is None:
+                continue
+            place[ancestor_level] = {
+                'code': self.public_codes[ancestor_level].get(ancestor_code, ancestor_code),
+                'name': name,
+            }
+            labels.append(name)
+        place['label'] = ', '.join(labels)
+        return place
+
+    def suggest(self, query, limit=10):
+        """
+        Places whose name, or a word of it, starts with ``query``; whole-name
+        matches first, then cities before barangays before provinces, then
+        shortest first. Ranks are read in order and only until ``limit``
+        places are found, so a common prefix costs no more than its matches
+        in the ranks it reaches.
+        """
+        prefix = normalize_name(query)
+        if not prefix:
+            return []
+        if self._prefix is None:
+            self._prefix = self._build_prefix_index()
+
+        results = []
+        seen = set()
+        for level, keys, short_codes in self._prefix:
+            # Keys hold only A-Z, 0-9 and spaces, which all sort before '~'
+            start, end = bisect.bisect_left(keys, prefix), bisect.bisect_left(keys, prefix + '~')
+            best = {}
+            for i in range(start, end):
+                if (level, short_codes[i]) not in seen:
+                    rank = (len(keys[i]), keys[i])
+                    best[short_codes[i]] = min(best.get(short_codes[i], rank), rank)
+            for short_code, _ in heapq.nsmallest(limit - len(results), best.items(), key=lambda item: item[1]):
+                seen.add((level, short_code))
+                results.append(self.place_path(level, short_code))
+            if len(results) >= limit:
+                break
+        return results
+
+
+def _build_index():
+    index = PSGCIndex()
+    for level in LEVELS:
+        filename, _, _ = SOURCES[level]
+        for record in read_records(filename):
+            index.add(level, record)
+    for places in index.children.values():
+        places.sort(key=lambda place: place['name'])
+    return index
+
+
+def get_index():
+    """The per-process :class:`PSGCIndex`, built on first use"""
+    global _index
+    if _index is None:
+        with _lock:
+            if _index is None:
+                _index = _build_index()
+    return _index
+
+
+def reset():
+    """Drop the loaded index so the next lookup re-reads the files"""
+    global _index
+    with _lock:
+        _index = None
+
+
+def lookup(level, code):
+    """Name for ``code`` at ``level`` ('region', 'province', 'citymun', 'barangay'), or None"""
+    if not code:
+        return None
+    return get_index().names[level].get(str(code).strip())
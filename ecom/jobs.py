@@ -0,0 +1,156 @@
+"""
+Database-backed background jobs.
+
+Slow side effects (SMTP, batch refreshes) are queued as :class:`~ecom.models.Job`
+rows with :func:`enqueue` and run by ``python manage.py run_worker``, so the
+request that queued them returns without waiting on third-party I/O. A job
+queued inside a transaction only becomes visible to workers when it commits.
+
+Workers claim due jobs with ``SELECT ... FOR UPDATE SKIP LOCKED`` where the
+database supports it. On SQLite, which serializes writes, a job is claimed by
+a conditional UPDATE from queued to running that only one worker can win.
+Failed jobs are retried with exponential backoff until ``max_attempts``.
+
+Tasks are plain functions registered with :func:`task`; their keyword
+arguments are the JSON payload and their return value is stored as the
+job's ``result``. A task registered with ``every=<seconds>`` is periodic:
+workers queue its next run (:func:`schedule_periodic`) whenever none is
+queued or running, ``every`` seconds after its last successful run.
+"""
+import logging
+import random
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+# Seconds before the first retry; doubled after every further failure, up to the cap
+JOB_RETRY_BACKOFF = getattr(settings, 'JOB_RETRY_BACKOFF', 10)
+JOB_RETRY_BACKOFF_MAX = getattr(settings, 'JOB_RETRY_BACKOFF_MAX', 60 * 60)
+# A job running longer than this is assumed to belong to a dead worker and is queued again
+JOB_LOCK_TIMEOUT = getattr(settings, 'JOB_LOCK_TIMEOUT', 10 * 60)
+# Seconds between a worker's checks for periodic tasks that are due
+JOB_SCHEDULE_INTERVAL = getattr(settings, 'JOB_SCHEDULE_INTERVAL', 60)
+
+_tasks = {}
+
+
+def task(name=None, max_attempts=5, every=None):
+    """Register a function as a job task, under its dotted path by default; periodic every ``every`` seconds"""
+    def register(func):
+        func.task_name = name or f"{func.__module__}.{func.__name__}"
+        func.max_attempts = max_attempts
+        func.every = every
+        _tasks[func.task_name] = func
+        return func
+    return register
+
+
+def _load_tasks():
+    # Tasks register when their module is imported
+    from . import tasks  # noqa: F401
+
+
+def get_task(name):
+    if name not in _tasks:
+        _load_tasks()
+    return _tasks[name]
+
+
+def enqueue(func, delay=0, **payload):
+    """Queue a call of the task ``func`` with JSON-serializable keyword arguments"""
+    return models.Job.objects.create(
+        task=func.task_name,
+        payload=payload,
+        run_at=timezone.now() + timedelta(seconds=delay),
+        max_attempts=func.max_attempts,
+    )
+
+
+def backoff(attempts):
+    """Seconds to wait before retrying after ``attempts`` failures, with jitter"""
+    delay = min(JOB_RETRY_BACKOFF * 2 ** (attempts - 1), JOB_RETRY_BACKOFF_MAX)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def schedule_periodic(now=None):
+    """
+    Queue the next run of each periodic task that has none queued or running;
+    returns how many were queued. Workers racing here may queue a run twice,
+    which is harmless for these idempotent tasks and does not repeat.
+    """
+    _load_tasks()
+    now = now or timezone.now()
+    queued = 0
+    for func in [func for func in _tasks.values() if func.every]:
+        runs = models.Job.objects.filter(task=func.task_name)
+        if runs.filter(status__in=(models.Job.QUEUED, models.Job.RUNNING)).exists():
+            continue
+        last_run = runs.filter(status=models.Job.DONE).order_by('-updated_at').values_list('updated_at', flat=True).first()
+        if last_run:
+            # Only the latest finished run is kept, so periodic rows do not pile up
+            runs.filter(status=models.Job.DONE, updated_at__lt=last_run).delete()
+        run_at = max(last_run + timedelta(seconds=func.every), now) if last_run else now
+        models.Job.objects.create(task=func.task_name, payload={}, run_at=run_at, max_attempts=func.max_attempts)
+        queued += 1
+    return queued
+
+
+def requeue_stale(now=None):
+    """Queue again the jobs of workers that died mid-run; returns how many"""
+    now = now or timezone.now()
+    return models.Job.objects.filter(
+        status=models.Job.RUNNING,
+        locked_at__lt=now - timedelta(seconds=JOB_LOCK_TIMEOUT),
+    ).update(status=models.Job.QUEUED, locked_by='', locked_at=None, run_at=now)
+
+
+def claim(worker, limit=1):
+    """Mark up to ``limit`` due jobs as running for ``worker`` and return them"""
+    now = timezone.now()
+    due = models.Job.objects.filter(status=models.Job.QUEUED, run_at__lte=now).order_by('run_at', 'id')
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            # Rows other workers are claiming right now are skipped, not waited on
+            ids = list(due.select_for_update(skip_locked=True).values_list('id', flat=True)[:limit])
+            models.Job.objects.filter(id__in=ids).update(
+                status=models.Job.RUNNING, locked_by=worker, locked_at=now,
+            )
+    else:
+        ids = []
+        for job_id in due.values_list('id', flat=True)[:limit]:
+            # Only one worker's UPDATE still finds the job queued
+            if models.Job.objects.filter(id=job_id, status=models.Job.QUEUED).update(
+                status=models.Job.RUNNING, locked_by=worker, locked_at=now,
+            ):
+                ids.append(job_id)
+    return list(models.Job.objects.filter(id__in=ids).order_by('run_at', 'id'))
+
+
+def run(job):
+    """Run one claimed job and record the outcome; returns the job"""
+    job.attempts += 1
+    try:
+        job.result = get_task(job.task)(**job.payload)
+    except Exception as e:
+        job.last_error = ''.join(traceback.format_exception(type(e), e, e.__traceback__))[-4000:]
+        if job.attempts >= job.max_attempts:
+            job.status = models.Job.FAILED
+            logger.error("Job %s failed for good after %s attempts: %s", job, job.attempts, e)
+        else:
+            job.status = models.Job.QUEUED
+            job.run_at = timezone.now() + timedelta(seconds=backoff(job.attempts))
+            logger.warning("Job %s failed (attempt %s), retrying at %s: %s", job, job.attempts, job.run_at, e)
+    else:
+        job.status = models.Job.DONE
+    job.locked_by = ''
+    job.locked_at = None
+    job.save(update_fields=['status', 'attempts', 'result', 'last_error', 'run_at', 'locked_by', 'locked_at', 'updated_at'])
+    return job
@@ -0,0 +1,91 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from ecom.models import Customer, SavedAddress, Orders
+from ecom.utils import resolve_addresses
+
+ORDER_CODE_FIELDS = ['region', 'province', 'citymun', 'barangay']
+
+class Command(BaseCommand):
+    help = 'Fill the stored address name columns on customers, saved addresses and orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Number of rows resolved and written per batch',
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Recompute rows that already have names instead of only empty ones',
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        only_missing = not options['all']
+
+        # Addresses first: older orders take their codes from the customer or saved address they ship to
+        for model in (Customer, SavedAddress):
+            updated = self.backfill(model, chunk_size, only_missing, resolve_addresses)
+            self.stdout.write(f'{model.__name__}: updated {updated} rows')
+
+        updated = self.backfill(
+            Orders, chunk_size, only_missing, resolve_orders,
+            fields=Orders.ADDRESS_NAME_FIELDS + ORDER_CODE_FIELDS,
+            # Orders placed before they stored codes have names but no codes
+            missing=Q(formatted_address='') | Q(region=''),
+            select_related=['customer'],
+        )
+        self.stdout.write(f'Orders: updated {updated} rows')
+
+        self.stdout.write(self.style.SUCCESS('Address name backfill completed successfully.'))
+
+    def backfill(self, model, chunk_size, only_missing, resolve, fields=None, missing=None, select_related=()):
+        queryset = model.objects.order_by('pk')
+        if only_missing:
+            queryset = queryset.filter(missing if missing is not None else Q(formatted_address=''))
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+
+        updated = 0
+        last_pk = 0
+        while True:
+            # Keyset pagination keeps every batch an indexed range scan
+            chunk = list(queryset.filter(pk__gt=last_pk)[:chunk_size])
+            if not chunk:
+                break
+            resolve(chunk)
+            with transaction.atomic():
+                model.objects.bulk_update(chunk, fields or model.ADDRESS_NAME_FIELDS)
+            updated += len(chunk)
+            last_pk = chunk[-1].pk
+        return updated
+
+
+def resolve_orders(orders):
+    """
+    Give orders without codes those of the address they ship to, matched
+    by its text as the older orders only stored that, then resolve the
+    whole chunk at once
+    """
+    saved = {
+        (address.customer_id, address.formatted_address): address
+        for address in SavedAddress.objects.filter(
+            customer_id__in={order.customer_id for order in orders if order.customer_id},
+            formatted_address__in={order.address for order in orders if order.address},
+        )
+    }
+    for order in orders:
+        if order.region or not order.customer:
+            continue
+        if not order.address or order.address == order.customer.formatted_address:
+            source = order.customer
+        else:
+            source = saved.get((order.customer_id, order.address))
+        if source is not None:
+            for field in ORDER_CODE_FIELDS:
+                setattr(order, field, getattr(source, field) or '')
+            order.formatted_address = source.formatted_address
+    resolve_addresses(orders)
@@ -0,0 +1,50 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from ecom.cart import CartLine
+from ecom.models import Product
+from ecom.pricing import price_cart
+
+class Command(BaseCommand):
+    help = 'Microbenchmark the cart pricing engine: time per quote and queries per quote by cart size'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lines',
+            type=int,
+            nargs='+',
+            default=[1, 10, 50, 200],
+            help='Cart sizes to price',
+        )
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=2000,
+            help='Quotes priced per cart size',
+        )
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        sizes = [size for size, _ in Product.SIZE_CHOICES]
+
+        for line_count in options['lines']:
+            # Unsaved products: this measures the engine, not product loading
+            lines = [
+                CartLine(Product(id=i, name=f'Product {i}', price=100 + i), sizes[i % len(sizes)], 1 + i % 3)
+                for i in range(line_count)
+            ]
+
+            start = time.perf_counter()
+            for _ in range(iterations):
+                price_cart(lines, delivery_fee=50)
+            per_quote = (time.perf_counter() - start) / iterations
+
+            # With a destination the fee comes from the rate table
+            with CaptureQueriesContext(connection) as queries:
+                quote = price_cart(lines, destination='NCR')
+
+            self.stdout.write(
+                f'{line_count:>5} lines: {per_quote * 1e6:8.1f} µs/quote, '
+                f'{len(queries)} queries with fee lookup, grand total {quote.grand_total}'
+            )
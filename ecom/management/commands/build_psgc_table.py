@@ -0,0 +1,21 @@
+import os
+from django.core.management.base import BaseCommand
+from ecom import psgc_table
+
+class Command(BaseCommand):
+    help = 'Compile the bundled PSGC JSON files into the memory-mapped name table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output',
+            help='Where to write the table (defaults to settings.PSGC_TABLE_PATH)',
+        )
+
+    def handle(self, *args, **options):
+        path = options['output'] or psgc_table.table_path()
+        counts = psgc_table.build_table(path)
+        for level, count in counts.items():
+            self.stdout.write(f'{level}: {count} rows')
+        self.stdout.write(
+            self.style.SUCCESS(f'Wrote {path} ({os.path.getsize(path)} bytes)')
+        )
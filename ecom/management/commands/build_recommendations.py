@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from ecom import recommendations
+
+class Command(BaseCommand):
+    help = 'Rebuild the "frequently bought together" table from the order history'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top-k',
+            type=int,
+            default=recommendations.RECOMMENDATIONS_TOP_K,
+            help='Recommendations kept per product',
+        )
+        parser.add_argument(
+            '--min-co-orders',
+            type=int,
+            default=recommendations.RECOMMENDATIONS_MIN_CO_ORDERS,
+            help='Orders two products need in common to be recommended together',
+        )
+
+    def handle(self, *args, **options):
+        rows = recommendations.rebuild(top_k=options['top_k'], min_co_orders=options['min_co_orders'])
+        self.stdout.write(self.style.SUCCESS(f'Stored {rows} product recommendations'))
@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from ecom.reservations import expire_holds
+
+class Command(BaseCommand):
+    help = 'Delete lapsed cart stock holds in bulk so their units are available again'
+
+    def handle(self, *args, **options):
+        deleted = expire_holds()
+        self.stdout.write(self.style.SUCCESS(f'Expired {deleted} stock holds'))
@@ -1,78 +1,74 @@
-import requests
+from itertools import islice
 from django.core.management.base import BaseCommand
+from django.db import transaction
+from ecom import gazetteer
 from ecom.models import Region, Province, CityMunicipality, Barangay
+from ecom.psgc_table import canonical_code
+
+# level -> (model, name of the FK to the parent level)
+LEVEL_MODELS = {
+    'region': (Region, None),
+    'province': (Province, 'region'),
+    'citymun': (CityMunicipality, 'province'),
+    'barangay': (Barangay, 'city_municipality'),
+}
 
 class Command(BaseCommand):
-    help = 'Import PSGC data from https://psgc.rootscratch.com/ into local database'
+    help = 'Import PSGC regions, provinces, cities/municipalities and barangays from the bundled ref*.json files'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Rows per bulk upsert',
+        )
 
-    def handle(self, *args, **kwargs):
+    def handle(self, *args, **options):
         self.stdout.write('Starting import of PSGC data...')
+        chunk_size = options['chunk_size']
 
-        # Import Regions
-        regions_url = 'https://psgc.rootscratch.com/regions'
-        regions_response = requests.get(regions_url)
-        if regions_response.status_code == 200:
-            regions_data = regions_response.json()
-            for region in regions_data:
-                obj, created = Region.objects.update_or_create(
-                    code=region['code'],
-                    defaults={'name': region['name']}
-                )
-                if created:
-                    self.stdout.write(f'Created Region: {obj.name}')
-        else:
-            self.stdout.write('Failed to fetch regions data')
-            return
+        for level in gazetteer.LEVELS:
+            model, parent_field = LEVEL_MODELS[level]
+            rows = self.rows(level, model, parent_field)
+            update_fields = ['short_code', 'name'] + ([f'{parent_field}_id'] if parent_field else [])
 
-        # Import Provinces for each Region
-        for region in Region.objects.all():
-            provinces_url = f'https://psgc.rootscratch.com/regions/{region.code}/provinces'
-            provinces_response = requests.get(provinces_url)
-            if provinces_response.status_code == 200:
-                provinces_data = provinces_response.json()
-                for province in provinces_data:
-                    obj, created = Province.objects.update_or_create(
-                        code=province['code'],
-                        defaults={'name': province['name'], 'region': region}
+            count = 0
+            with transaction.atomic():
+                while True:
+                    chunk = list(islice(rows, chunk_size))
+                    if not chunk:
+                        break
+                    model.objects.bulk_create(
+                        chunk,
+                        update_conflicts=True,
+                        unique_fields=['code'],
+                        update_fields=update_fields,
                     )
-                    if created:
-                        self.stdout.write(f'Created Province: {obj.name} in Region: {region.name}')
-            else:
-                self.stdout.write(f'Failed to fetch provinces for region {region.name}')
-                return
+                    count += len(chunk)
+            self.stdout.write(f'{model._meta.verbose_name_plural.capitalize()}: {count} upserted')
 
-        # Import Cities/Municipalities for each Province
-        for province in Province.objects.all():
-            cities_url = f'https://psgc.rootscratch.com/provinces/{province.code}/cities-municipalities'
-            cities_response = requests.get(cities_url)
-            if cities_response.status_code == 200:
-                cities_data = cities_response.json()
-                for city in cities_data:
-                    obj, created = CityMunicipality.objects.update_or_create(
-                        code=city['code'],
-                        defaults={'name': city['name'], 'province': province}
-                    )
-                    if created:
-                        self.stdout.write(f'Created City/Municipality: {obj.name} in Province: {province.name}')
-            else:
-                self.stdout.write(f'Failed to fetch cities/municipalities for province {province.name}')
-                return
+        self.stdout.write(self.style.SUCCESS('PSGC data import completed successfully.'))
 
-        # Import Barangays for each City/Municipality
-        for city in CityMunicipality.objects.all():
-            barangays_url = f'https://psgc.rootscratch.com/cities-municipalities/{city.code}/barangays'
-            barangays_response = requests.get(barangays_url)
-            if barangays_response.status_code == 200:
-                barangays_data = barangays_response.json()
-                for barangay in barangays_data:
-                    obj, created = Barangay.objects.update_or_create(
-                        code=barangay['code'],
-                        defaults={'name': barangay['name'], 'city_municipality': city}
-                    )
-                    if created:
-                        self.stdout.write(f'Created Barangay: {obj.name} in City/Municipality: {city.name}')
-            else:
-                self.stdout.write(f'Failed to fetch barangays for city/municipality {city.name}')
-                return
+    def rows(self, level, model, parent_field):
+        """Unsaved model instances for one level, skipping repeated codes"""
+        filename, code_field, name_field = gazetteer.SOURCES[level]
+        parent_ids = {}
+        if parent_field:
+            parent_level, parent_code_field = gazetteer.PARENTS[level]
+            parent_model = LEVEL_MODELS[parent_level][0]
+            parent_ids = dict(parent_model.objects.values_list('short_code', 'id'))
 
-        self.stdout.write('PSGC data import completed successfully.')
+        seen = set()
+        for record in gazetteer.read_records(filename):
+            name = record.get(name_field)
+            short_code = str(record.get(code_field) or '')
+            code = canonical_code(record.get('psgcCode') or short_code)
+            # The files repeat a few codes (e.g. Manila); the first entry wins
+            if not name or not code or code in seen:
+                continue
+            seen.add(code)
+            row = model(code=code, short_code=short_code, name=name)
+            if parent_field:
+                setattr(row, f'{parent_field}_id', parent_ids.get(str(record.get(parent_code_field) or '')))
+            yield row
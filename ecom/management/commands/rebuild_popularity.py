@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from ecom import popularity
+
+class Command(BaseCommand):
+    help = "Recompute every product's stored units sold and order count from orders that are not cancelled"
+
+    def handle(self, *args, **options):
+        updated = popularity.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt popularity of {updated} products'))
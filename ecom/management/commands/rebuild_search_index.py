@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from ecom import search
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text product search index from the product table'
+
+    def handle(self, *args, **options):
+        if search.backend() is None:
+            self.stdout.write(self.style.WARNING('This database has no search index; searches use icontains filters'))
+            return
+        count = search.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} products'))
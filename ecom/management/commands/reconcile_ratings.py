@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from ecom import ratings
+
+class Command(BaseCommand):
+    help = "Recompute every product's stored rating sum, count and average from its reviews"
+
+    def handle(self, *args, **options):
+        updated = ratings.reconcile()
+        self.stdout.write(self.style.SUCCESS(f'Reconciled ratings of {updated} products'))
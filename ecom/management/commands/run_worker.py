@@ -0,0 +1,88 @@
+import os
+import signal
+import socket
+import threading
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+from ecom import jobs
+
+class Command(BaseCommand):
+    help = 'Run queued and periodic background jobs (emails, recommendations, stock hold expiry) until stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=1,
+            help='Worker threads claiming and running jobs in parallel',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1,
+            help='Jobs each thread claims at a time',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=1.0,
+            help='Seconds to sleep when no job is due',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Run the jobs due now, then exit',
+        )
+
+    def handle(self, *args, **options):
+        self.stop = threading.Event()
+        self.options = options
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda *_: self.stop.set())
+
+        name = f"{socket.gethostname()}:{os.getpid()}"
+        requeued = jobs.requeue_stale()
+        if requeued:
+            self.stdout.write(f'Requeued {requeued} jobs left running by a stopped worker')
+        jobs.schedule_periodic()
+
+        threads = [
+            threading.Thread(target=self.work, args=(f"{name}:{i}",), daemon=True)
+            for i in range(max(options['concurrency'], 1))
+        ]
+        for thread in threads:
+            thread.start()
+        self.stdout.write(self.style.SUCCESS(f'Worker {name} running with {len(threads)} threads'))
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(timeout=1)
+        except KeyboardInterrupt:
+            self.stop.set()
+            self.stdout.write('Stopping after the running jobs finish...')
+            for thread in threads:
+                thread.join()
+
+    def work(self, worker):
+        last_stale_check = last_schedule = time.monotonic()
+        try:
+            while not self.stop.is_set():
+                close_old_connections()
+                if time.monotonic() - last_stale_check > jobs.JOB_LOCK_TIMEOUT:
+                    jobs.requeue_stale()
+                    last_stale_check = time.monotonic()
+                if time.monotonic() - last_schedule > jobs.JOB_SCHEDULE_INTERVAL:
+                    jobs.schedule_periodic()
+                    last_schedule = time.monotonic()
+
+                claimed = jobs.claim(worker, self.options['batch_size'])
+                for job in claimed:
+                    job = jobs.run(job)
+                    self.stdout.write(f'{job} after {job.attempts} attempt(s)')
+                if not claimed:
+                    if self.options['once']:
+                        break
+                    self.stop.wait(self.options['poll_interval'])
+        finally:
+            connection.close()
@@ -0,0 +1,34 @@
+from . import models
+from .cart import get_cart, legacy_cookie_names, parse_legacy_cookies, save_cart_cookie
+
+
+class CartMiddleware:
+    """
+    Writes the anonymous cart cookie back when a view changed the cart.
+
+    A cart still held in the old per-line cookies is moved into cart storage
+    and those cookies are expired, so browsers stop sending them.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        legacy_cookies = legacy_cookie_names(request.COOKIES)
+        if legacy_cookies:
+            lines = parse_legacy_cookies(request.COOKIES) or []
+            existing = set(
+                models.Product.objects.filter(id__in={product_id for product_id, _, _ in lines})
+                .values_list('id', flat=True)
+            )
+            cart = get_cart(request)
+            for product_id, size, quantity in lines:
+                if product_id in existing:
+                    cart.set(product_id, size, quantity)
+
+        response = self.get_response(request)
+
+        for key in legacy_cookies:
+            response.delete_cookie(key)
+        save_cart_cookie(request, response)
+        return response
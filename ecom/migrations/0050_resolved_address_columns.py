@@ -0,0 +1,88 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecom', '0049_recreate_chat_models'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='barangay_name',
+            field=models.CharField(blank=True, default='', max_length=100, verbose_name='Barangay'),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='citymun_name',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=100, verbose_name='City/Municipality'),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='formatted_address',
+            field=models.CharField(blank=True, default='', max_length=500),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='province_name',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=100, verbose_name='Province'),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='region_name',
+            field=models.CharField(blank=True, default='', max_length=100, verbose_name='Region'),
+        ),
+        migrations.AddField(
+            model_name='orders',
+            name='barangay_name',
+            field=models.CharField(blank=True, default='', max_length=100, verbose_name='Barangay'),
+        ),
+        migrations.AddField(
+            model_name='orders',
+            name='citymun_name',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=100, verbose_name='City/Municipality'),
+        ),
+        migrations.AddField(
+            model_name='orders',
+            name='formatted_address',
+            field=models.CharField(blank=True, default='', max_length=500),
+        ),
+        migrations.AddField(
+            model_name='orders',
+            name='province_name',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=100, verbose_name='Province'),
+        ),
+        migrations.AddField(
+            model_name='orders',
+            name='region_name',
+            field=models.CharField(blank=True, default='', max_length=100, verbose_name='Region'),
+        ),
+        migrations.AddField(
+            model_name='savedaddress',
+            name='barangay_name',
+            field=models.CharField(blank=True, default='', max_length=100, verbose_name='Barangay'),
+        ),
+        migrations.AddField(
+            model_name='savedaddress',
+            name='citymun_name',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=100, verbose_name='City/Municipality'),
+        ),
+        migrations.AddField(
+            model_name='savedaddress',
+            name='formatted_address',
+            field=models.CharField(blank=True, default='', max_length=500),
+        ),
+        migrations.AddField(
+            model_name='savedaddress',
+            name='province_name',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=100, verbose_name='Province'),
+        ),
+        migrations.AddField(
+            model_name='savedaddress',
+            name='region_name',
+            field=models.CharField(blank=True, default='', max_length=100, verbose_name='Region'),
+        ),
+    ]
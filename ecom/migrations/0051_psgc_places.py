@@ -0,0 +1,70 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecom', '0050_resolved_address_columns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Region',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(help_text='10-digit PSGC code', max_length=10, unique=True)),
+                ('short_code', models.CharField(db_index=True, help_text='regCode / provCode / citymunCode / brgyCode', max_length=9)),
+                ('name', models.CharField(db_index=True, max_length=100)),
+            ],
+            options={
+                'ordering': ['name'],
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='Province',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(help_text='10-digit PSGC code', max_length=10, unique=True)),
+                ('short_code', models.CharField(db_index=True, help_text='regCode / provCode / citymunCode / brgyCode', max_length=9)),
+                ('name', models.CharField(db_index=True, max_length=100)),
+                ('region', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='provinces', to='ecom.region')),
+            ],
+            options={
+                'ordering': ['name'],
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='CityMunicipality',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(help_text='10-digit PSGC code', max_length=10, unique=True)),
+                ('short_code', models.CharField(db_index=True, help_text='regCode / provCode / citymunCode / brgyCode', max_length=9)),
+                ('name', models.CharField(db_index=True, max_length=100)),
+                ('province', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='cities', to='ecom.province')),
+            ],
+            options={
+                'verbose_name_plural': 'cities/municipalities',
+                'ordering': ['name'],
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='Barangay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(help_text='10-digit PSGC code', max_length=10, unique=True)),
+                ('short_code', models.CharField(db_index=True, help_text='regCode / provCode / citymunCode / brgyCode', max_length=9)),
+                ('name', models.CharField(db_index=True, max_length=100)),
+                ('city_municipality', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='barangays', to='ecom.citymunicipality')),
+            ],
+            options={
+                'ordering': ['name'],
+                'abstract': False,
+            },
+        ),
+    ]
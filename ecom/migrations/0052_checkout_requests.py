@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecom', '0051_psgc_places'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CheckoutRequest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(help_text='Hash of the customer and checkout token or cart snapshot', max_length=64, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkout_requests', to='ecom.orders')),
+            ],
+        ),
+    ]
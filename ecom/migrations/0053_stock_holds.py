@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecom', '0052_checkout_requests'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockHold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('size', models.CharField(choices=[('S', 'Small'), ('XS', 'Extra Small'), ('M', 'Medium'), ('L', 'Large'), ('XL', 'Extra Large')], max_length=5)),
+                ('holder', models.CharField(max_length=64)),
+                ('quantity', models.PositiveIntegerField()),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='holds', to='ecom.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'size', 'expires_at'], name='ecom_stockh_product_3e499b_idx')],
+                'unique_together': {('holder', 'product', 'size')},
+            },
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_inventory_items(apps, schema_editor):
+    """
+    A variant for every ``"<product name> - <size>"`` inventory item, the rows
+    ``Product.get_size_stock`` used to look up by name. The product's own
+    ``size`` without one keeps what the variants leave of its ``quantity``.
+    """
+    Product = apps.get_model('ecom', 'Product')
+    ProductVariant = apps.get_model('ecom', 'ProductVariant')
+    InventoryItem = apps.get_model('ecom', 'InventoryItem')
+
+    sizes = [size for size, _ in Product._meta.get_field('size').choices]
+    items = {}
+    # Duplicate names: the first row wins, as with the old .first() lookup
+    for name, quantity in InventoryItem.objects.order_by('id').values_list('name', 'quantity'):
+        items.setdefault(name, quantity)
+    variants = []
+    for product_id, name in Product.objects.values_list('id', 'name'):
+        for size in sizes:
+            quantity = items.get(f"{name} - {size}")
+            if quantity is not None:
+                variants.append(ProductVariant(product_id=product_id, size=size, quantity=quantity))
+    ProductVariant.objects.bulk_create(variants, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecom', '0053_stock_holds'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductVariant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('size', models.CharField(choices=[('S', 'Small'), ('XS', 'Extra Small'), ('M', 'Medium'), ('L', 'Large'), ('XL', 'Extra Large')], max_length=5)),
+                ('quantity', models.PositiveIntegerField(db_index=True, default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='variants', to='ecom.product')),
+            ],
+            options={
+                'unique_together': {('product', 'size')},
+            },
+        ),
+        migrations.RunPython(copy_inventory_items, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Full-text index over product names and descriptions; see ecom/search.py
+
+from django.db import migrations
+
+
+def create_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE ecom_product_fts USING fts5("
+            "name, description, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        schema_editor.execute(
+            "INSERT INTO ecom_product_fts (rowid, name, description) SELECT id, name, description FROM ecom_product"
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE TABLE ecom_product_search ("
+            "product_id bigint PRIMARY KEY REFERENCES ecom_product (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+            "document tsvector NOT NULL)"
+        )
+        schema_editor.execute("CREATE INDEX ecom_product_search_document ON ecom_product_search USING GIN (document)")
+        schema_editor.execute(
+            "INSERT INTO ecom_product_search (product_id, document) SELECT id, "
+            "setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+            "setweight(to_tsvector('simple', coalesce(description, '')), 'B') FROM ecom_product"
+        )
+
+
+def drop_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS ecom_product_fts")
+    elif vendor == 'postgresql':
+        schema_editor.execute("DROP TABLE IF EXISTS ecom_product_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecom', '0055_jobs'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:50
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, FloatField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_rating_aggregates(apps, schema_editor):
+    Product = apps.get_model('ecom', 'Product')
+    ProductReview = apps.get_model('ecom', 'ProductReview')
+    reviews = ProductReview.objects.filter(product=OuterRef('pk')).values('product')
+
+    def total(aggregate, default):
+        return Coalesce(Subquery(reviews.annotate(value=aggregate).values('value')), default)
+
+    Product.objects.update(
+        rating_sum=total(Sum('rating'), 0),
+        rating_count=total(Count('id'), 0),
+        average_rating=total(Avg('rating', output_field=FloatField()), 0.0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecom', '0056_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='average_rating',
+            field=models.FloatField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_rating_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:53
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_popularity(apps, schema_editor):
+    Product = apps.get_model('ecom', 'Product')
+    OrderItem = apps.get_model('ecom', 'OrderItem')
+    items = OrderItem.objects.filter(product=OuterRef('pk')).exclude(order__status='Cancelled').values('product')
+
+    def total(aggregate):
+        return Coalesce(Subquery(items.annotate(value=aggregate).values('value')), 0)
+
+    Product.objects.update(units_sold=total(Sum('quantity')), order_count=total(Count('id')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecom', '0057_product_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='order_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='units_sold',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(fill_popularity, migrations.RunPython.noop),
+    ]
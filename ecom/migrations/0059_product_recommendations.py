@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecom', '0058_product_popularity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductRecommendation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.FloatField(help_text='Orders with both, over the geometric mean of orders with each')),
+                ('co_orders', models.PositiveIntegerField(help_text='Orders containing both products')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to='ecom.product')),
+                ('recommended', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommended_with', to='ecom.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'rank'], name='ecom_produc_product_a07f63_idx')],
+                'unique_together': {('product', 'recommended')},
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-18 13:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecom', '0059_product_recommendations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orders',
+            name='barangay',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='orders',
+            name='citymun',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='orders',
+            name='province',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='orders',
+            name='region',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+    ]
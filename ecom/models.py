@@ -1,7 +1,83 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 # Create your models here.
-class Customer(models.Model):
+class ResolvedAddress(models.Model):
+    """
+    Human-readable address columns stored next to the PSGC codes.
+
+    They are filled when the row is saved, so pages read plain columns and
+    orders can be filtered and sorted by place in SQL.
+    """
+    region_name = models.CharField('Region', max_length=100, blank=True, default='')
+    province_name = models.CharField('Province', max_length=100, blank=True, default='', db_index=True)
+    citymun_name = models.CharField('City/Municipality', max_length=100, blank=True, default='', db_index=True)
+    barangay_name = models.CharField('Barangay', max_length=100, blank=True, default='')
+    formatted_address = models.CharField(max_length=500, blank=True, default='')
+
+    ADDRESS_NAME_FIELDS = ['region_name', 'province_name', 'citymun_name', 'barangay_name', 'formatted_address']
+
+    class Meta:
+        abstract = True
+
+    def resolve_place_names(self, names=None):
+        """
+        Fill the place name columns from the row's PSGC code fields.
+
+        ``names`` is a ``{(level, code): name}`` map from
+        ``utils.resolve_psgc_names``; codes missing from it are resolved here.
+        """
+        from .utils import PSGC_LEVELS, resolve_psgc_names
+        if names is None:
+            names = {}
+        pairs = [(level, getattr(self, level)) for level in PSGC_LEVELS if getattr(self, level)]
+        missing = [pair for pair in pairs if pair not in names]
+        if missing:
+            names = {**names, **resolve_psgc_names(missing)}
+        for level, code in pairs:
+            setattr(self, f"{level}_name", names[(level, code)])
+        for level in PSGC_LEVELS:
+            if not getattr(self, level):
+                setattr(self, f"{level}_name", '')
+
+
+class PSGCAddressMixin(ResolvedAddress):
+    """
+    An address stored as PSGC codes, with its names resolved when it is
+    created or its codes change
+    """
+    ADDRESS_CODE_FIELDS = ['region', 'province', 'citymun', 'barangay', 'street_address', 'postal_code']
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # What the row held when loaded, so a save only resolves changed codes
+        instance._stored_codes = instance.address_codes()
+        return instance
+
+    def address_codes(self):
+        # Deferred fields are left out rather than loaded
+        return tuple(self.__dict__.get(field) for field in self.ADDRESS_CODE_FIELDS)
+
+    def resolve_address_names(self, names=None):
+        """Fill the name columns from the codes; ``names`` as for :meth:`resolve_place_names`"""
+        self.resolve_place_names(names)
+        self.formatted_address = f"{self.street_address}, {self.barangay_name}, {self.citymun_name}, {self.province_name}, {self.region_name}, {self.postal_code}"
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        changed = self._state.adding or self.address_codes() != getattr(self, '_stored_codes', None)
+        if changed and (update_fields is None or set(update_fields) & set(self.ADDRESS_CODE_FIELDS)):
+            self.resolve_address_names()
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | set(self.ADDRESS_NAME_FIELDS)
+        super().save(*args, **kwargs)
+        self._stored_codes = self.address_codes()
+
+
+class Customer(PSGCAddressMixin):
     REGION_CHOICES = [
         ('NCR', 'National Capital Region'),
         ('CAR', 'Cordillera Administrative Region'),
@@ -35,38 +111,10 @@ class Customer(models.Model):
     @property
     def get_full_address(self):
         # Return formatted address with actual names
-        from .utils import get_region_name, get_province_name, get_citymun_name, get_barangay_name
-        
-        region_name = get_region_name(self.region) if self.region else self.region
-        province_name = get_province_name(self.province) if self.province else self.province
-        citymun_name = get_citymun_name(self.citymun) if self.citymun else self.citymun
-        barangay_name = get_barangay_name(self.barangay) if self.barangay else self.barangay
-        
-        return f"{self.street_address}, {barangay_name}, {citymun_name}, {province_name}, {region_name}, {self.postal_code}"
-
-    @property
-    def region_name(self):
-        """Get the readable region name"""
-        from .utils import get_region_name
-        return get_region_name(self.region) if self.region else self.region
-
-    @property
-    def province_name(self):
-        """Get the readable province name"""
-        from .utils import get_province_name
-        return get_province_name(self.province) if self.province else self.province
-
-    @property
-    def citymun_name(self):
-        """Get the readable city/municipality name"""
-        from .utils import get_citymun_name
-        return get_citymun_name(self.citymun) if self.citymun else self.citymun
-
-    @property
-    def barangay_name(self):
-        """Get the readable barangay name"""
-        from .utils import get_barangay_name
-        return get_barangay_name(self.barangay) if self.barangay else self.barangay
+        if not self.formatted_address:
+            # Row saved before the name columns existed and not yet backfilled
+            self.resolve_address_names()
+        return self.formatted_address
 
     def __str__(self):
         return self.user.first_name
@@ -104,24 +152,139 @@ class Product(models.Model):
         ('XL', 'Extra Large'),
     )
     size = models.CharField(max_length=2, choices=SIZE_CHOICES, default='M')
+    # Kept in step with ProductReview rows (ecom.signals); python manage.py reconcile_ratings rebuilds them
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    average_rating = models.FloatField(default=0, db_index=True, editable=False)
+    # Lines and units on orders that are not cancelled (ecom.popularity); python manage.py rebuild_popularity rebuilds them
+    units_sold = models.PositiveIntegerField(default=0, db_index=True, editable=False)
+    order_count = models.PositiveIntegerField(default=0, db_index=True, editable=False)
+
+    # Maintained with UPDATEs of their own: edits save with update_fields
+    # leaving these out, so a stale instance cannot overwrite them
+    DERIVED_FIELDS = ('rating_sum', 'rating_count', 'average_rating', 'units_sold', 'order_count')
     
     def __str__(self):
         return self.name
 
+    @property
+    def review_count(self):
+        return self.rating_count
+
     def get_size_stock(self):
-        stock = {size: 0 for size, _ in self.SIZE_CHOICES}
-        for size, _ in self.SIZE_CHOICES:
-            item = InventoryItem.objects.filter(name=f"{self.name} - {size}").first()
-            if item:
-                stock[size] = item.quantity
-            elif self.size == size:
-                stock[size] = self.quantity
+        """``{size: quantity}``; pages load it for all their products with ``ProductVariant.objects.attach_stock``"""
+        stock = getattr(self, '_size_stock', None)
+        if stock is None:
+            stock = ProductVariant.objects.stock_map([self.id]).get(self.id, {})
+            self._size_stock = stock
         return stock
 
     def get_size_stock_json(self):
         import json
         return json.dumps(self.get_size_stock())
 
+def split_size_stock(own_size, total, variants):
+    """
+    ``{size: units}`` of a product with ``total`` units over all its sizes
+    (``Product.quantity``) and ``{size: quantity}`` variant rows. A size with a
+    variant row has that row's units, never more than the total; the
+    product's own size without one has what the variants leave over. Other
+    sizes are not stocked.
+    """
+    stock = {size: min(quantity, total) for size, quantity in variants.items()}
+    if own_size not in variants:
+        stock[own_size] = max(total - sum(variants.values()), 0)
+    return stock
+
+
+class ProductVariantQuerySet(models.QuerySet):
+    def stock_map(self, product_ids):
+        """
+        ``{product_id: {size: quantity}}`` for every size, in one query; see
+        :func:`split_size_stock`
+        """
+        rows = Product.objects.filter(id__in=product_ids).values_list(
+            'id', 'size', 'quantity', 'variants__size', 'variants__quantity'
+        )
+        variants, own = {}, {}
+        for product_id, size, quantity, variant_size, variant_quantity in rows:
+            own[product_id] = (size, quantity)
+            sizes = variants.setdefault(product_id, {})
+            if variant_size is not None:
+                sizes[variant_size] = variant_quantity
+        stock = {}
+        for product_id, sizes in variants.items():
+            sizes = split_size_stock(*own[product_id], sizes)
+            stock[product_id] = {size: sizes.get(size, 0) for size, _ in Product.SIZE_CHOICES}
+        return stock
+
+    def in_stock(self, products):
+        """The ``products`` with at least one size in stock; the rule of :func:`split_size_stock` as a filter"""
+        own_size_row = self.filter(product=models.OuterRef('pk'), size=models.OuterRef('size'))
+        stocked_row = self.filter(product=models.OuterRef('pk'), quantity__gt=0)
+        return products.filter(
+            models.Q(quantity__gt=0) & (~models.Exists(own_size_row) | models.Exists(stocked_row))
+        )
+
+    def attach_stock(self, products):
+        """Load ``get_size_stock`` for a page of products at once"""
+        products = list(products)
+        stock = self.stock_map([product.id for product in products])
+        for product in products:
+            product._size_stock = stock.get(product.id, {})
+        return products
+
+class ProductVariant(models.Model):
+    """Stock of one product in one size"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='variants')
+    size = models.CharField(max_length=5, choices=Product.SIZE_CHOICES)
+    quantity = models.PositiveIntegerField(default=0, db_index=True)
+
+    objects = ProductVariantQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ('product', 'size')
+
+    def __str__(self):
+        return f"{self.product.name} - {self.size}"
+
+class StockHold(models.Model):
+    """
+    Stock set aside for one cart line until ``expires_at``; see ecom.reservations.
+    ``holder`` is ``customer:<id>``, or ``session:<token>`` for anonymous carts (see
+    ecom.cart.Cart.holder).
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='holds')
+    size = models.CharField(max_length=5, choices=Product.SIZE_CHOICES)
+    holder = models.CharField(max_length=64)
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = ('holder', 'product', 'size')
+        indexes = [models.Index(fields=['product', 'size', 'expires_at'])]
+
+    def __str__(self):
+        return f"{self.holder} holds {self.quantity} x {self.product_id} ({self.size})"
+
+class ProductRecommendation(models.Model):
+    """
+    ``recommended`` is often bought together with ``product``; the top few per
+    product, best first by ``rank``. Built from order history by ecom.recommendations.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommended_with')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField(help_text='Orders with both, over the geometric mean of orders with each')
+    co_orders = models.PositiveIntegerField(help_text='Orders containing both products')
+
+    class Meta:
+        unique_together = ('product', 'recommended')
+        indexes = [models.Index(fields=['product', 'rank'])]
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.recommended_id} (#{self.rank})"
+
 class CartItem(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
@@ -138,7 +301,7 @@ class CartItem(models.Model):
 
 
 
-class Orders(models.Model):
+class Orders(ResolvedAddress):
     STATUS = (
         ('Pending', 'Pending - Awaiting Payment'),
         ('Processing', 'Processing - Payment Confirmed'),
@@ -165,10 +328,40 @@ class Orders(models.Model):
     payment_method = models.CharField(max_length=10, choices=PAYMENT_METHODS, default='cod', help_text='Payment method for the order')
     order_ref = models.CharField(max_length=12, unique=True, null=True, blank=True, help_text='Unique short order reference ID')
     delivery_fee = models.DecimalField(max_digits=10, decimal_places=2, default=0.00, help_text='Delivery fee for this order')
+    # PSGC codes of the profile address the order ships to; blank for an address typed in at checkout
+    region = models.CharField(max_length=100, blank=True, default='')
+    province = models.CharField(max_length=100, blank=True, default='')
+    citymun = models.CharField(max_length=100, blank=True, default='')
+    barangay = models.CharField(max_length=100, blank=True, default='')
     
     def __str__(self):
         return f"Order {self.order_ref or self.id} - {self.customer.user.username if self.customer else 'No Customer'}"
     
+    def ship_to(self, address):
+        """
+        Ship to a Customer or SavedAddress: copy its codes and the names
+        already resolved for them, so placing the order looks nothing up
+        """
+        for level in ('region', 'province', 'citymun', 'barangay'):
+            setattr(self, level, getattr(address, level) or '')
+            setattr(self, f"{level}_name", getattr(address, f"{level}_name"))
+        self.formatted_address = address.formatted_address
+
+    def resolve_address_names(self, names=None):
+        """
+        Snapshot the place names of the order's codes; they stay blank for an
+        address typed in at checkout. ``names`` as for :meth:`resolve_place_names`.
+        """
+        self.resolve_place_names(names)
+        self.formatted_address = self.address or self.formatted_address
+
+    def save(self, *args, **kwargs):
+        if not self.formatted_address and kwargs.get('update_fields') is None:
+            self.resolve_address_names()
+        # Product popularity follows status changes in the post_save signal, in this transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     def get_total_amount(self):
         """Calculate total amount from all order items"""
         return sum(item.price * item.quantity for item in self.orderitem_set.all())
@@ -187,6 +380,18 @@ class OrderItem(models.Model):
         """Calculate total price for this order item"""
         return self.price * self.quantity
 
+class CheckoutRequest(models.Model):
+    """
+    Idempotency key of a checkout and the order it created, so a replayed
+    payment-success request returns that order instead of placing another
+    """
+    key = models.CharField(max_length=64, unique=True, help_text='Hash of the customer and checkout token or cart snapshot')
+    order = models.ForeignKey(Orders, on_delete=models.CASCADE, related_name='checkout_requests')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.key[:12]} -> Order {self.order_id}"
+
 
 class Feedback(models.Model):
     name=models.CharField(max_length=40)
@@ -220,8 +425,37 @@ class ShippingFee(models.Model):
         return f"{self.courier}: {self.origin_region} to {self.destination_region} ({self.weight_kg}kg) - ₱{self.price_php}"
 
 
+# PSGC places, loaded from the bundled data by `manage.py import_psgc_data`
+class PSGCPlace(models.Model):
+    code = models.CharField(max_length=10, unique=True, help_text='10-digit PSGC code')
+    short_code = models.CharField(max_length=9, db_index=True, help_text='regCode / provCode / citymunCode / brgyCode')
+    name = models.CharField(max_length=100, db_index=True)
+
+    class Meta:
+        abstract = True
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+class Region(PSGCPlace):
+    pass
+
+class Province(PSGCPlace):
+    region = models.ForeignKey(Region, on_delete=models.CASCADE, null=True, related_name='provinces')
+
+class CityMunicipality(PSGCPlace):
+    province = models.ForeignKey(Province, on_delete=models.CASCADE, null=True, related_name='cities')
+
+    class Meta(PSGCPlace.Meta):
+        verbose_name_plural = 'cities/municipalities'
+
+class Barangay(PSGCPlace):
+    city_municipality = models.ForeignKey(CityMunicipality, on_delete=models.CASCADE, null=True, related_name='barangays')
+
 
-class SavedAddress(models.Model):
+
+class SavedAddress(PSGCAddressMixin):
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='saved_addresses')
     region = models.CharField(max_length=100, choices=Customer.REGION_CHOICES)
     province = models.CharField(max_length=100)
@@ -279,6 +513,11 @@ class ProductReview(models.Model):
     def __str__(self):
         return f"{self.customer.user.username} - {self.product.name} ({self.rating} stars)"
 
+    def save(self, *args, **kwargs):
+        # The product's rating totals are updated by the post_save signal, in this transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
 class Newsletter(models.Model):
     email = models.EmailField(unique=True)
     is_active = models.BooleanField(default=True)
@@ -360,3 +599,36 @@ class ChatbotKnowledge(models.Model):
         return [keyword.strip().lower() for keyword in self.keywords.split(',')]
 
 
+
+
+class Job(models.Model):
+    """A background task call, run by ``python manage.py run_worker``; see ecom.jobs"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    task = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    run_at = models.DateTimeField(help_text='Not claimed before this time; pushed back after each failure')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    locked_by = models.CharField(max_length=100, blank=True, default='')
+    locked_at = models.DateTimeField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_at'])]
+
+    def __str__(self):
+        return f"{self.task} #{self.id} ({self.status})"
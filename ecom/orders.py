@@ -0,0 +1,250 @@
+"""
+Order placement.
+
+:func:`place_order` turns a priced cart into an order in one transaction and a
+fixed number of queries, whatever the number of lines: lock the products,
+insert the order, bulk-insert its items, then decrement stock with one
+conditional UPDATE per table. Each size is also checked against its share of
+the product's stock (:func:`ecom.models.split_size_stock`), and variant rows
+are locked and decremented too. If any product or size no longer has enough
+stock the whole order rolls back and :class:`InsufficientStock` is raised.
+
+Checkouts are idempotent: each carries a key (see :func:`checkout_key`) stored
+with the order it created, so a refreshed or retried payment-success request
+gets that order back from one indexed lookup instead of placing and charging
+stock for another.
+"""
+import hashlib
+import random
+import string
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, PositiveIntegerField, Q, When
+from django.utils import timezone
+
+from . import catalog, jobs, models, page_cache, popularity, reservations, tasks
+
+# How long (seconds) a cart-snapshot key still marks a replay rather than the
+# same cart bought again; client tokens are single-use and never expire
+SNAPSHOT_REPLAY_WINDOW = getattr(settings, 'CHECKOUT_SNAPSHOT_REPLAY_WINDOW', 600)
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product, available):
+        self.product = product
+        self.available = available
+        super().__init__(f"Only {available} pcs of {product.name} left")
+
+
+class EmptyCart(Exception):
+    pass
+
+
+def generate_order_ref(length=12):
+    """Unique short order reference ID"""
+    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
+
+
+def checkout_key(customer, token=None, quote=None, payment_method='cod'):
+    """
+    Idempotency key for a checkout: the client's ``token`` when it sent one,
+    otherwise a snapshot of the priced cart. Scoped to the customer so tokens
+    never collide across accounts.
+    """
+    if token:
+        source = f"token:{token}"
+    elif quote is not None and quote.lines:
+        source = "cart:{}:{}".format(payment_method, ','.join(
+            f"{line.product.id}/{line.size}/{line.quantity}/{line.unit_price}"
+            for line in sorted(quote.lines, key=lambda line: (line.product.id, line.size))
+        ))
+    else:
+        return None
+    return hashlib.sha256(f"{customer.id}:{source}".encode()).hexdigest()
+
+
+def find_order(key, window=None):
+    """
+    The order already placed under ``key``, or None. With a ``window``
+    (seconds) older keys no longer count: the same cart bought again later is
+    a new order, not a replay.
+    """
+    if not key:
+        return None
+    checkout = models.CheckoutRequest.objects.filter(key=key).select_related('order').first()
+    if checkout is None:
+        return None
+    if window is not None and checkout.created_at < timezone.now() - timedelta(seconds=window):
+        checkout.delete()
+        return None
+    return checkout.order
+
+
+def _decrement(queryset, amounts):
+    """
+    ``quantity -= amount`` for every ``(lookup, amount)`` pair in one UPDATE,
+    only on rows holding at least ``amount``. Returns the number of rows changed.
+    """
+    enough = Q()
+    for lookup, amount in amounts:
+        enough |= Q(quantity__gte=amount, **lookup)
+    return queryset.filter(enough).update(quantity=Case(
+        *[When(Q(**lookup), then=F('quantity') - amount) for lookup, amount in amounts],
+        default=F('quantity'),
+        output_field=PositiveIntegerField(),
+    ))
+
+
+def _increment(queryset, amounts):
+    """``quantity += amount`` for every ``(lookup, amount)`` pair in one UPDATE"""
+    matching = Q()
+    for lookup, amount in amounts:
+        matching |= Q(**lookup)
+    return queryset.filter(matching).update(quantity=Case(
+        *[When(Q(**lookup), then=F('quantity') + amount) for lookup, amount in amounts],
+        default=F('quantity'),
+        output_field=PositiveIntegerField(),
+    ))
+
+
+def restock(order):
+    """
+    Give an order's units back to the product and per-size stock they were
+    taken from, with one UPDATE per table
+    """
+    products, sizes = Counter(), Counter()
+    for product_id, size, quantity in order.orderitem_set.values_list('product_id', 'size', 'quantity'):
+        products[product_id] += quantity
+        sizes[product_id, size] += quantity
+    if not products:
+        return
+    _increment(models.Product.objects.all(), [({'id': product_id}, quantity) for product_id, quantity in products.items()])
+    # Sizes without a variant row match nothing here, as at checkout
+    _increment(models.ProductVariant.objects.all(), [
+        ({'product_id': product_id, 'size': size}, quantity) for (product_id, size), quantity in sizes.items()
+    ])
+    catalog.invalidate()
+    page_cache.bump()
+
+
+def place_order(customer, quote, payment_method='cod', email=None, mobile=None, address=None,
+                idempotency_key=None, replay_window=None, holder=None, ship_to=None):
+    """
+    Create the order for a :class:`~ecom.pricing.Quote` of cart lines and take
+    its stock. Raises :class:`EmptyCart` or :class:`InsufficientStock`; nothing
+    is written in either case.
+
+    With an ``idempotency_key`` the order placed earlier under that key (see
+    :func:`find_order`) is returned as is, and of concurrent requests sharing
+    a key only one commits.
+
+    The ``holder``'s stock holds (see :mod:`ecom.reservations`) count toward
+    the order and are released with it; units other carts hold do not.
+
+    ``ship_to`` is the Customer or SavedAddress the order ships to, when
+    ``address`` is one of them; the order keeps its PSGC codes and names.
+    """
+    replayed = find_order(idempotency_key, replay_window)
+    if replayed is not None:
+        return replayed
+    if not quote.lines:
+        raise EmptyCart()
+
+    wanted = Counter()
+    for line in quote.lines:
+        wanted[line.product.id] += line.quantity
+
+    try:
+        return _create_order(
+            customer, quote, wanted, payment_method, email, mobile, address, idempotency_key, holder, ship_to,
+        )
+    except (IntegrityError, InsufficientStock):
+        # A concurrent request with the same key committed first (and may
+        # have taken the last stock); this one rolled back whole, so hand back
+        # the winner's order
+        replayed = find_order(idempotency_key)
+        if replayed is None:
+            raise
+        return replayed
+
+
+def _create_order(customer, quote, wanted, payment_method, email, mobile, address, idempotency_key, holder, ship_to):
+    with transaction.atomic():
+        # Two queries lock every product and variant row in the order against
+        # concurrent checkouts and count what other carts hold: holds on any
+        # size come out of the product's total, and each size is limited by
+        # its share of the stock as well
+        totals, free, variants = reservations.stock_levels(list(wanted), holder, lock=True)
+        products = {line.product.id: line.product for line in quote.lines}
+        for product_id, quantity in wanted.items():
+            available = totals.get(product_id, 0)
+            if available < quantity:
+                raise InsufficientStock(products[product_id], available)
+
+        sizes = Counter()
+        for line in quote.lines:
+            sizes[line.product.id, line.size] += line.quantity
+        for (product_id, size), quantity in sizes.items():
+            available = free.get((product_id, size), 0)
+            if available < quantity:
+                raise InsufficientStock(products[product_id], available)
+
+        order_ref = generate_order_ref()
+        now = timezone.now()
+        order = models.Orders(
+            customer=customer,
+            status='Processing' if payment_method == 'paypal' else 'Pending',
+            email=email,
+            mobile=mobile,
+            address=address,
+            payment_method=payment_method,
+            order_date=now,
+            status_updated_at=now,
+            notes=f"Order Group ID: {order_ref}",
+            order_ref=order_ref,
+            delivery_fee=quote.delivery_fee,
+        )
+        if ship_to is not None:
+            order.ship_to(ship_to)
+        order.save(force_insert=True)
+        if idempotency_key:
+            # Unique: a second request with this key fails here, before
+            # touching any stock
+            models.CheckoutRequest.objects.create(key=idempotency_key, order=order)
+        models.OrderItem.objects.bulk_create([
+            models.OrderItem(
+                order=order,
+                product_id=line.product.id,
+                quantity=line.quantity,
+                price=line.unit_price,
+                size=line.size,
+            )
+            for line in quote.lines
+        ])
+        popularity.apply([(line.product.id, line.quantity) for line in quote.lines])
+
+        # The rows are locked, but the UPDATE re-checks stock itself so the
+        # order still cannot oversell where the database ignores row locks
+        product_amounts = [({'id': product_id}, quantity) for product_id, quantity in wanted.items()]
+        if _decrement(models.Product.objects.all(), product_amounts) != len(wanted):
+            raise InsufficientStock(quote.lines[0].product, 0)
+
+        variant_amounts = [
+            ({'product_id': product_id, 'size': size}, quantity)
+            for (product_id, size), quantity in sizes.items() if (product_id, size) in variants
+        ]
+        if variant_amounts and _decrement(models.ProductVariant.objects.all(), variant_amounts) != len(variant_amounts):
+            raise InsufficientStock(quote.lines[0].product, 0)
+
+        if holder:
+            reservations.release(holder)
+        # Stock and popularity changed with bulk UPDATEs, which send no signals
+        catalog.invalidate()
+        page_cache.bump()
+        # Runs once the order commits
+        jobs.enqueue(tasks.refresh_recommendations, product_ids=sorted(wanted))
+
+    return order
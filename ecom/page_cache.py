@@ -0,0 +1,155 @@
+"""
+Cache of the anonymous catalog grid.
+
+Logged-out visitors all see the same product grid for the same filters, so
+``home_view`` renders it once per normalized query (:func:`normalize`) and
+keeps the HTML in the cache. Tracking parameters, parameter order, letter
+case and spacing in the search do not make new entries. The page around the
+grid (cart count, messages) is still rendered per request. The grid itself
+must not depend on the user: it is rendered without a request, and only
+anonymous visitors are served from it (``home_view`` redirects the rest).
+
+Entries are stamped with a catalog version that product, stock and review
+writes bump (see ``ecom.signals``) once their transaction commits. The
+version lives in the ``shared`` cache so a bump reaches every worker
+process. Each process keeps a copy of it in the ``local`` cache for
+``CATALOG_SHARED_REFRESH`` seconds, so a hit costs no round trip. The HTML
+may stay in each process's default cache. An entry
+with an old stamp, or older than ``CATALOG_PAGE_TTL``, is still served (for
+at most ``CATALOG_PAGE_STALE`` seconds past its TTL) while one background
+thread renders its replacement (stale-while-revalidate), so a burst of
+visitors to one link causes at most one rebuild. At most
+``CATALOG_PAGE_REFRESH_THREADS`` such rebuilds run at once per process; past
+that the stale copy is served until a thread is free.
+"""
+import hashlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db import close_old_connections, connection, transaction
+from django.utils.http import urlencode
+from django.utils.safestring import mark_safe
+
+from . import search
+
+logger = logging.getLogger(__name__)
+
+# Seconds an entry is fresh, then how much longer it may be served while it is rebuilt
+CATALOG_PAGE_TTL = getattr(settings, 'CATALOG_PAGE_TTL', 5 * 60)
+CATALOG_PAGE_STALE = getattr(settings, 'CATALOG_PAGE_STALE', 60)
+CATALOG_PAGE_REFRESH_THREADS = getattr(settings, 'CATALOG_PAGE_REFRESH_THREADS', 4)
+# Seconds this process trusts its copy of the version before asking the shared cache
+CATALOG_SHARED_REFRESH = getattr(settings, 'CATALOG_SHARED_REFRESH', 5)
+
+VERSION_KEY = 'catalog-page:version'
+
+_refresh_slots = threading.BoundedSemaphore(CATALOG_PAGE_REFRESH_THREADS)
+
+
+def _shared():
+    return caches['shared']
+
+SORTS = ('price_low', 'price_high', 'name', 'newest', 'popular', 'rating')
+
+
+def _price(value):
+    try:
+        return '%g' % float(value)
+    except ValueError:
+        return ''
+
+
+def normalize(params):
+    """The catalog parameters of a query string as sorted ``(name, value)`` pairs; the rest is dropped"""
+    values = {
+        'cursor': params.get('cursor', '').strip(),
+        'in_stock': '1' if params.get('in_stock') else '',
+        'max_price': _price(params.get('max_price', '').strip()),
+        'min_price': _price(params.get('min_price', '').strip()),
+        'search': ' '.join(search.terms(params.get('search'))),
+        'sort': params.get('sort') if params.get('sort') in SORTS else '',
+    }
+    return [(name, value) for name, value in sorted(values.items()) if value]
+
+
+def version():
+    local = caches['local']
+    stamp = local.get(VERSION_KEY)
+    if stamp is None:
+        shared = _shared()
+        stamp = shared.get(VERSION_KEY)
+        if stamp is None:
+            stamp = time.time_ns()
+            shared.add(VERSION_KEY, stamp, None)
+            stamp = shared.get(VERSION_KEY, stamp)
+        local.set(VERSION_KEY, stamp, CATALOG_SHARED_REFRESH)
+    return stamp
+
+
+def _set_version():
+    stamp = time.time_ns()
+    _shared().set(VERSION_KEY, stamp, None)
+    caches['local'].set(VERSION_KEY, stamp, CATALOG_SHARED_REFRESH)
+
+
+def bump():
+    """Mark every cached grid stale once the current transaction commits"""
+    transaction.on_commit(_set_version)
+
+
+def _key(params):
+    return 'catalog-page:' + hashlib.sha1(urlencode(params).encode()).hexdigest()
+
+
+def _store(key, render):
+    stamp = version()
+    html = render()
+    cache.set(key, (stamp, time.time(), str(html)), CATALOG_PAGE_TTL + CATALOG_PAGE_STALE)
+    return html
+
+
+def _revalidate(key, render):
+    try:
+        close_old_connections()
+        _store(key, render)
+    except Exception:
+        logger.exception("Could not refresh catalog page %s", key)
+    finally:
+        cache.delete(key + ':refreshing')
+        _refresh_slots.release()
+        connection.close()
+
+
+def _start_refresh(key, render):
+    """Rebuild ``key`` on a background thread if one of the refresh slots is free"""
+    if not _refresh_slots.acquire(blocking=False):
+        return False
+    try:
+        threading.Thread(target=_revalidate, args=(key, render), daemon=True).start()
+    except RuntimeError:
+        _refresh_slots.release()
+        logger.exception("Could not start a refresh of catalog page %s", key)
+        return False
+    return True
+
+
+def get_or_render(params, render):
+    """Cached grid HTML for normalized ``params``; ``render()`` builds it on a miss"""
+    key = _key(params)
+    entry = cache.get(key)
+    if entry is None:
+        return _store(key, render)
+
+    stamp, stored_at, html = entry
+    age = time.time() - stored_at
+    if stamp != version() or age > CATALOG_PAGE_TTL:
+        if age > CATALOG_PAGE_TTL + CATALOG_PAGE_STALE:
+            return _store(key, render)
+        # Only the request that wins this flag rebuilds; the rest get the stale copy
+        if cache.add(key + ':refreshing', True, CATALOG_PAGE_STALE) and not _start_refresh(key, render):
+            # No thread free: let a later request try again
+            cache.delete(key + ':refreshing')
+    return mark_safe(html)
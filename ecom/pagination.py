@@ -0,0 +1,161 @@
+"""
+Keyset (cursor) pagination for catalog listings.
+
+A page is the ``per_page`` rows after (or before) the last row the client
+saw, found by comparing the sort key and id instead of counting and skipping
+rows with ``OFFSET``. Every page costs one indexed query however deep it is,
+and no ``COUNT(*)`` runs unless a template asks for :attr:`KeysetPage.total`,
+a count cached for ``CATALOG_COUNT_TIMEOUT`` seconds.
+
+Cursors are signed and opaque to clients. A cursor made for another sort
+order, or tampered with, starts from the first page.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils.functional import cached_property
+from django.utils.http import urlencode
+
+CATALOG_COUNT_TIMEOUT = getattr(settings, 'CATALOG_COUNT_TIMEOUT', 5 * 60)
+
+CURSOR_SALT = 'ecom.pagination.cursor'
+
+
+def ordering(queryset):
+    """The queryset's sort keys as field names, always ending in a unique ``id``"""
+    keys = [
+        key.replace('pk', 'id') if key.lstrip('-') == 'pk' else key
+        for key in queryset.query.order_by or queryset.model._meta.ordering
+    ]
+    if not any(key.lstrip('-') == 'id' for key in keys):
+        keys.append('id')
+    return keys
+
+
+def _flip(key):
+    return key[1:] if key.startswith('-') else '-' + key
+
+
+def _json_value(value):
+    return value if value is None or isinstance(value, (bool, int, float, str)) else str(value)
+
+
+def encode_cursor(keys, obj, backwards=False):
+    values = [_json_value(getattr(obj, key.lstrip('-'))) for key in keys]
+    return signing.dumps({'o': keys, 'v': values, 'b': backwards}, salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(cursor, keys):
+    """``(values, backwards)`` from a cursor made for ``keys``, or None"""
+    if not cursor:
+        return None
+    try:
+        data = signing.loads(cursor, salt=CURSOR_SALT)
+    except signing.BadSignature:
+        return None
+    if data.get('o') != keys or len(data.get('v', ())) != len(keys):
+        return None
+    return data['v'], bool(data.get('b'))
+
+
+def after(keys, values):
+    """Rows sorting after ``values`` in ``keys`` order: (a > x) OR (a = x AND b > y) ..."""
+    condition = Q()
+    for i, key in enumerate(keys):
+        field = key.lstrip('-')
+        step = Q(**{f"{field}__{'lt' if key.startswith('-') else 'gt'}": values[i]})
+        for previous, value in zip(keys[:i], values[:i]):
+            step &= Q(**{previous.lstrip('-'): value})
+        condition |= step
+    return condition
+
+
+def estimated_count(queryset):
+    """``queryset.count()``, cached per query; may lag writes by ``CATALOG_COUNT_TIMEOUT``"""
+    queryset = queryset.order_by()
+    key = 'catalog-count:' + hashlib.sha1(str(queryset.query).encode()).hexdigest()
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, CATALOG_COUNT_TIMEOUT)
+    return count
+
+
+class KeysetPage:
+    """One page of rows with cursors to its neighbours; iterates like a ``Page``"""
+
+    def __init__(self, object_list, keys, queryset, has_next, has_previous):
+        self.object_list = object_list
+        self.keys = keys
+        self.queryset = queryset
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @cached_property
+    def next_cursor(self):
+        if not self._has_next or not self.object_list:
+            return None
+        return encode_cursor(self.keys, self.object_list[-1])
+
+    @cached_property
+    def previous_cursor(self):
+        if not self._has_previous or not self.object_list:
+            return None
+        return encode_cursor(self.keys, self.object_list[0], backwards=True)
+
+    @cached_property
+    def total(self):
+        return estimated_count(self.queryset)
+
+
+def paginate(queryset, cursor=None, per_page=12):
+    """The page of ``queryset`` (ordered by non-null keys) that ``cursor`` points at"""
+    keys = ordering(queryset)
+    position = decode_cursor(cursor, keys)
+    page = queryset.order_by(*keys)
+    backwards = False
+    if position:
+        values, backwards = position
+        if backwards:
+            keys_used = [_flip(key) for key in keys]
+            page = queryset.order_by(*keys_used).filter(after(keys_used, values))
+        else:
+            page = page.filter(after(keys, values))
+
+    # One extra row says whether there is a further page
+    rows = list(page[:per_page + 1])
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+        return KeysetPage(rows, keys, queryset, has_next=True, has_previous=more)
+    return KeysetPage(rows, keys, queryset, has_next=more, has_previous=position is not None)
+
+
+def page_query(params):
+    """The request's query string without its cursor, ready to append ``cursor=...``"""
+    query = urlencode([
+        (key, value) for key, values in params.lists() if key not in ('cursor', 'page') for value in values
+    ])
+    return query + '&' if query else ''
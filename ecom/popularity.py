@@ -0,0 +1,84 @@
+"""
+Materialized product popularity.
+
+``Product.order_count`` (order lines) and ``units_sold`` (units on those
+lines) count every order that is not cancelled, so the catalog sorts by
+popularity from indexed columns instead of counting the whole order history
+on every request. Placing an order adds its lines in the same transaction
+(:func:`ecom.orders.place_order`); an order moving into or out of
+``Cancelled`` adds or takes back its lines (``ecom.signals`` for single
+saves, :func:`move_orders` for bulk status updates). :func:`rebuild`
+recomputes everything in bulk.
+"""
+from collections import Counter
+
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest
+
+from . import models
+
+UNCOUNTED_STATUSES = ('Cancelled',)
+
+
+def counted(status):
+    """Whether an order in ``status`` counts towards popularity"""
+    return status not in UNCOUNTED_STATUSES
+
+
+def apply(items, sign=1):
+    """Add (``sign=1``) or take back (``sign=-1``) ``(product_id, quantity)`` order lines, in one UPDATE"""
+    units, lines = Counter(), Counter()
+    for product_id, quantity in items:
+        units[product_id] += quantity
+        lines[product_id] += 1
+    if not lines:
+        return 0
+
+    def change(field, amounts):
+        new_value = Case(
+            *[When(id=product_id, then=F(field) + sign * amount) for product_id, amount in amounts.items()],
+            output_field=IntegerField(),
+        )
+        # Never below zero, even if the counters had drifted
+        return Greatest(new_value, Value(0)) if sign < 0 else new_value
+
+    return models.Product.objects.filter(id__in=list(lines)).update(
+        units_sold=change('units_sold', units),
+        order_count=change('order_count', lines),
+    )
+
+
+def apply_orders(order_ids, sign=1):
+    """Add or take back every line of the given orders"""
+    items = models.OrderItem.objects.filter(order_id__in=order_ids).values_list('product_id', 'quantity')
+    return apply(items, sign)
+
+
+def move_orders(orders, new_status):
+    """
+    Account for a bulk ``orders.update(status=new_status)``; call it in the
+    same transaction, before the update
+    """
+    if counted(new_status):
+        moving = orders.filter(status__in=UNCOUNTED_STATUSES)
+        sign = 1
+    else:
+        moving = orders.exclude(status__in=UNCOUNTED_STATUSES)
+        sign = -1
+    return apply_orders(moving.values('id'), sign)
+
+
+def rebuild(products=None):
+    """Recompute the popularity columns from the order history in one UPDATE; returns rows updated"""
+    items = models.OrderItem.objects.filter(product=OuterRef('pk')).exclude(
+        order__status__in=UNCOUNTED_STATUSES
+    ).values('product')
+
+    def total(aggregate):
+        return Coalesce(Subquery(items.annotate(value=aggregate).values('value')), 0)
+
+    products = models.Product.objects.all() if products is None else products
+    return products.update(
+        units_sold=total(Sum('quantity')),
+        order_count=total(Count('id')),
+    )
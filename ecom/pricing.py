@@ -0,0 +1,98 @@
+"""
+Cart and order pricing.
+
+Every page that shows money (cart, checkout, order lists, invoice) prices
+through :func:`price_cart`, so they all agree on line totals, VAT and fees.
+Prices are VAT-inclusive: the VAT is the 12/112 share of the subtotal.
+"""
+from collections import namedtuple
+from decimal import Decimal
+
+from . import models
+
+VAT_RATE = 12
+CENT = Decimal('0.01')
+
+# Orders ship from the NCR warehouse; parcels are priced at the lightest bracket
+ORIGIN_REGION = 'NCR'
+DEFAULT_WEIGHT_KG = Decimal('0.5')
+# Charged when the rate table has no matching row
+DEFAULT_DELIVERY_FEE = Decimal('50.00')
+
+# Region codes stored on customers -> region names used by ShippingFee
+REGION_MAPPING = {
+    'Region R1': 'Region I',
+    'Region R2': 'Region II',
+    'Region R3': 'Region III',
+    'Region R4A': 'Region IV-A',
+    'Region R4B': 'Region IV-B',
+    'Region R5': 'Region V',
+    'Region R6': 'Region VI',
+    'Region R7': 'Region VII',
+    'Region R8': 'Region VIII',
+    'Region R9': 'Region IX',
+    'Region R10': 'Region X',
+    'Region R11': 'Region XI',
+    'Region R12': 'Region XII',
+    'Region R13': 'Region XIII',
+    'NCR': 'NCR',
+    'CAR': 'CAR',
+    'BARMM': 'BARMM'
+}
+
+# ``item`` is the priced cart line or order item
+QuoteLine = namedtuple('QuoteLine', 'item product size quantity unit_price line_total')
+
+Quote = namedtuple('Quote', 'lines subtotal vat_rate vat_amount net_subtotal delivery_fee grand_total')
+
+
+def shipping_fee(destination_region, weight_kg=DEFAULT_WEIGHT_KG, origin_region=ORIGIN_REGION):
+    """Standard courier fee for a parcel, as a Decimal; one query"""
+    origin = REGION_MAPPING.get(origin_region, origin_region)
+    destination = REGION_MAPPING.get(destination_region, destination_region)
+    try:
+        # The lightest bracket that still fits the parcel
+        fee = models.ShippingFee.objects.filter(
+            courier="Standard",
+            origin_region=origin,
+            destination_region=destination,
+            weight_kg__gte=weight_kg
+        ).order_by('weight_kg').values_list('price_php', flat=True).first()
+    except Exception as e:
+        print(f"Error getting shipping fee: {e}")
+        fee = None
+    return Decimal(fee) if fee is not None else DEFAULT_DELIVERY_FEE
+
+
+def price_cart(lines, destination=None, delivery_fee=None):
+    """
+    Price cart lines or order items and return an immutable :class:`Quote`.
+
+    ``lines`` need ``product``, ``size`` and ``quantity`` (loaded together by
+    the caller); a line's own ``price`` (order items) wins over the product's
+    current price. The fee is looked up for ``destination`` unless an already
+    charged ``delivery_fee`` is given.
+    """
+    quote_lines = []
+    subtotal = Decimal('0.00')
+    for line in lines:
+        price = getattr(line, 'price', None)
+        unit_price = Decimal(line.product.price if price is None else price)
+        line_total = unit_price * line.quantity
+        subtotal += line_total
+        quote_lines.append(QuoteLine(line, line.product, line.size, line.quantity, unit_price, line_total))
+
+    if delivery_fee is None:
+        delivery_fee = shipping_fee(destination or ORIGIN_REGION)
+    delivery_fee = Decimal(delivery_fee)
+
+    vat_amount = (subtotal * VAT_RATE / (100 + VAT_RATE)).quantize(CENT)
+    return Quote(
+        lines=tuple(quote_lines),
+        subtotal=subtotal,
+        vat_rate=VAT_RATE,
+        vat_amount=vat_amount,
+        net_subtotal=subtotal - vat_amount,
+        delivery_fee=delivery_fee,
+        grand_total=subtotal + delivery_fee,
+    )
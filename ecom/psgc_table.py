@@ -0,0 +1,167 @@
+"""
+Compact, memory-mapped PSGC name table.
+
+``manage.py build_psgc_table`` compiles the bundled ref*.json files into one
+binary file. Every worker maps it read-only, so all processes share a single
+page-cached copy instead of each building its own dicts of names.
+
+Layout (little-endian)::
+
+    header   magic, blob offset, then per level: row count,
+             codes offset, name offsets offset (uint32 each)
+    codes    per level, the sorted 10-digit PSGC codes as fixed-width ASCII
+    offsets  per level, row count + 1 uint32 offsets into the blob
+    blob     the UTF-8 names, back to back
+"""
+import bisect
+import logging
+import mmap
+import os
+import struct
+import threading
+
+from django.conf import settings
+
+from . import gazetteer
+
+MAGIC = b'PSGCTBL1'
+CODE_WIDTH = 10
+HEADER = struct.Struct('<8sI' + 'III' * len(gazetteer.LEVELS))
+OFFSET = struct.Struct('<I')
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_table = None
+_loaded = False
+
+
+def table_path():
+    return getattr(settings, 'PSGC_TABLE_PATH', None) or os.path.join(settings.BASE_DIR, 'psgc_table.bin')
+
+
+def canonical_code(code):
+    """10-digit form of a short, 9-digit or 10-digit PSGC code, or None"""
+    code = str(code).strip()
+    if not code.isdigit():
+        return None
+    if len(code) in (2, 4, 6):
+        # regCode / provCode / citymunCode are prefixes of the 9-digit code
+        code = code.ljust(9, '0')
+    if len(code) == 9:
+        code = code[:2] + '0' + code[2:]
+    return code if len(code) == CODE_WIDTH else None
+
+
+def build_table(path=None):
+    """Compile the bundled PSGC files into the binary table; returns the row count per level"""
+    path = path or table_path()
+
+    sections = []
+    for level in gazetteer.LEVELS:
+        filename, code_field, name_field = gazetteer.SOURCES[level]
+        entries = {}
+        for record in gazetteer.read_records(filename):
+            name = record.get(name_field)
+            code = canonical_code(record.get('psgcCode') or record.get(code_field) or '')
+            # The files repeat a few codes (e.g. Manila); the first entry wins
+            if name and code and code not in entries:
+                entries[code] = name
+        sections.append(sorted(entries.items()))
+
+    blob = bytearray()
+    body = bytearray()
+    header_fields = []
+    position = HEADER.size
+    for entries in sections:
+        codes = b''.join(code.encode('ascii') for code, _ in entries)
+        offsets = bytearray()
+        for _, name in entries:
+            offsets += OFFSET.pack(len(blob))
+            blob += name.encode('utf-8')
+        offsets += OFFSET.pack(len(blob))
+
+        header_fields += [len(entries), position, position + len(codes)]
+        body += codes + offsets
+        position += len(codes) + len(offsets)
+
+    header = HEADER.pack(MAGIC, position, *header_fields)
+
+    # Write next to the target and rename, so running workers keep a valid mapping
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(header + bytes(body) + bytes(blob))
+    os.replace(tmp_path, path)
+    return {level: len(entries) for level, entries in zip(gazetteer.LEVELS, sections)}
+
+
+class _Codes:
+    """Sequence view over one level's fixed-width code array, for bisect"""
+
+    def __init__(self, buf, offset, count):
+        self._buf = buf
+        self._offset = offset
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        start = self._offset + i * CODE_WIDTH
+        return self._buf[start:start + CODE_WIDTH]
+
+
+class PSGCTable:
+    """Read-only view of a compiled table"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        fields = HEADER.unpack_from(self._buf, 0)
+        if fields[0] != MAGIC:
+            raise ValueError(f"{path} is not a PSGC table")
+        self._blob = fields[1]
+        self._levels = {}
+        for i, level in enumerate(gazetteer.LEVELS):
+            count, codes_offset, offsets_offset = fields[2 + 3 * i:5 + 3 * i]
+            self._levels[level] = (_Codes(self._buf, codes_offset, count), offsets_offset)
+
+    def count(self, level):
+        return len(self._levels[level][0])
+
+    def lookup(self, level, code):
+        """Name for ``code`` at ``level``, or None"""
+        key = canonical_code(code)
+        if key is None:
+            return None
+        key = key.encode('ascii')
+        codes, offsets_offset = self._levels[level]
+        i = bisect.bisect_left(codes, key)
+        if i == len(codes) or codes[i] != key:
+            return None
+        start, end = struct.unpack_from('<II', self._buf, offsets_offset + i * OFFSET.size)
+        return self._buf[self._blob + start:self._blob + end].decode('utf-8')
+
+
+def get_table():
+    """The mapped table for this process, or None when it has not been built"""
+    global _table, _loaded
+    if not _loaded:
+        with _lock:
+            if not _loaded:
+                path = table_path()
+                if os.path.exists(path):
+                    try:
+                        _table = PSGCTable(path)
+                    except (OSError, ValueError, struct.error) as e:
+                        logger.error("Error loading PSGC table %s: %s", path, e)
+                _loaded = True
+    return _table
+
+
+def reset():
+    """Forget the mapped table so the next lookup maps the file again"""
+    global _table, _loaded
+    with _lock:
+        _table = None
+        _loaded = False
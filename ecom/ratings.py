@@ -0,0 +1,46 @@
+"""
+Materialized product ratings.
+
+``Product.rating_sum``, ``rating_count`` and ``average_rating`` mirror the
+product's reviews, so catalog pages show and sort by rating from plain
+columns instead of aggregating every review on every view. Review writes
+apply their difference with one UPDATE in the same transaction (see
+``ecom.signals``); :func:`reconcile` recomputes everything in bulk.
+"""
+from django.db.models import Avg, Case, Count, F, FloatField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce
+
+from . import models
+
+
+def apply(product_id, sum_delta, count_delta):
+    """Add a rating difference to one product, averaging the new totals"""
+    if not sum_delta and not count_delta:
+        return
+    new_sum = F('rating_sum') + sum_delta
+    new_count = F('rating_count') + count_delta
+    models.Product.objects.filter(id=product_id).update(
+        rating_sum=new_sum,
+        rating_count=new_count,
+        # Computed from the old column values, like every SET expression
+        average_rating=Case(
+            When(rating_count=-count_delta, then=Value(0.0)),
+            default=Cast(new_sum, FloatField()) / new_count,
+            output_field=FloatField(),
+        ),
+    )
+
+
+def reconcile(products=None):
+    """Recompute the rating columns from the reviews in one UPDATE; returns rows updated"""
+    reviews = models.ProductReview.objects.filter(product=OuterRef('pk')).values('product')
+
+    def total(aggregate, default):
+        return Coalesce(Subquery(reviews.annotate(value=aggregate).values('value')), default)
+
+    products = models.Product.objects.all() if products is None else products
+    return products.update(
+        rating_sum=total(Sum('rating'), 0),
+        rating_count=total(Count('id'), 0),
+        average_rating=total(Avg('rating', output_field=FloatField()), 0.0),
+    )
@@ -0,0 +1,143 @@
+"""
+"Frequently bought together" recommendations.
+
+Each product's best ``RECOMMENDATIONS_TOP_K`` partners are stored in
+:class:`~ecom.models.ProductRecommendation`, so a product page reads them
+with one indexed query. A partner's score is the cosine similarity of the two
+products' order vectors: the orders containing both, over the geometric mean
+of the orders containing each. Cancelled orders do not count.
+
+Co-occurrence is counted inside the database: one self-join of order lines
+grouped by product pair, which is the sparse product of the order-by-product
+matrix with itself, and only pairs that actually occur are produced. The
+rows arrive sorted by product and are ranked one product at a time.
+
+``python manage.py build_recommendations`` rebuilds the whole table; the job
+worker does so every ``RECOMMENDATIONS_REBUILD_INTERVAL`` seconds
+(``ecom.tasks.rebuild_recommendations``). Placing an order queues :func:`refresh` for its products on the
+job runner (``ecom.tasks.refresh_recommendations``).
+"""
+import heapq
+import itertools
+import math
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count
+
+from . import models, popularity
+
+RECOMMENDATIONS_TOP_K = getattr(settings, 'RECOMMENDATIONS_TOP_K', 8)
+# Pairs bought together in fewer orders than this are ignored
+RECOMMENDATIONS_MIN_CO_ORDERS = getattr(settings, 'RECOMMENDATIONS_MIN_CO_ORDERS', 1)
+
+
+def _counted_items():
+    return models.OrderItem.objects.exclude(order__status__in=popularity.UNCOUNTED_STATUSES)
+
+
+def order_counts(product_ids=None):
+    """``{product_id: orders containing it}``"""
+    items = _counted_items()
+    if product_ids is not None:
+        items = items.filter(product_id__in=product_ids)
+    rows = items.values('product').annotate(orders=Count('order', distinct=True)).values_list('product', 'orders')
+    return dict(rows)
+
+
+def _pair_rows(product_ids=None, min_co_orders=None):
+    """``(product_id, partner_id, co_orders)`` rows, grouped by product"""
+    item_table = models.OrderItem._meta.db_table
+    order_table = models.Orders._meta.db_table
+    excluded = list(popularity.UNCOUNTED_STATUSES)
+    where = f"(o.status IS NULL OR o.status NOT IN ({', '.join(['%s'] * len(excluded))}))"
+    params = excluded
+    if product_ids is not None:
+        where += f" AND a.product_id IN ({', '.join(['%s'] * len(product_ids))})"
+        params = params + list(product_ids)
+    sql = (
+        f"SELECT a.product_id, b.product_id, COUNT(DISTINCT a.order_id) "
+        f"FROM {item_table} a "
+        f"JOIN {item_table} b ON b.order_id = a.order_id AND b.product_id <> a.product_id "
+        f"JOIN {order_table} o ON o.id = a.order_id "
+        f"WHERE {where} "
+        f"GROUP BY a.product_id, b.product_id "
+        f"HAVING COUNT(DISTINCT a.order_id) >= %s "
+        f"ORDER BY a.product_id"
+    )
+    params.append(min_co_orders or RECOMMENDATIONS_MIN_CO_ORDERS)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(2000)
+            if not rows:
+                break
+            yield from rows
+
+
+def _top(product_id, partners, counts, top_k):
+    """The best ``top_k`` :class:`ProductRecommendation` rows from ``(partner_id, co_orders)``"""
+    def scored():
+        for partner_id, co_orders in partners:
+            score = co_orders / math.sqrt(counts[product_id] * counts[partner_id])
+            # Ties go to the partner bought together more often, then the older product
+            yield (score, co_orders, -partner_id)
+    best = heapq.nlargest(top_k, scored())
+    return [
+        models.ProductRecommendation(
+            product_id=product_id, recommended_id=-negative_id, rank=rank, score=score, co_orders=co_orders,
+        )
+        for rank, (score, co_orders, negative_id) in enumerate(best, start=1)
+    ]
+
+
+def _build(pair_rows, counts, top_k=None):
+    top_k = top_k or RECOMMENDATIONS_TOP_K
+    for product_id, rows in itertools.groupby(pair_rows, key=lambda row: row[0]):
+        yield from _top(product_id, [(partner_id, co_orders) for _, partner_id, co_orders in rows], counts, top_k)
+
+
+def rebuild(top_k=None, min_co_orders=None):
+    """Replace the whole table from the order history; returns how many rows it holds"""
+    with transaction.atomic():
+        models.ProductRecommendation.objects.all().delete()
+        batch, written = [], 0
+        for row in _build(_pair_rows(min_co_orders=min_co_orders), order_counts(), top_k):
+            batch.append(row)
+            if len(batch) >= 1000:
+                models.ProductRecommendation.objects.bulk_create(batch)
+                written += len(batch)
+                batch = []
+        models.ProductRecommendation.objects.bulk_create(batch)
+        return written + len(batch)
+
+
+def refresh(product_ids):
+    """
+    Recompute the recommendations of ``product_ids`` only, e.g. the products of
+    a new order. Their partners' lists pick up changed scores at the next rebuild.
+    """
+    product_ids = sorted(set(product_ids))
+    if not product_ids:
+        return 0
+    pairs = list(_pair_rows(product_ids))
+    # Order counts of just these products and their partners
+    counts = order_counts(set(product_ids) | {partner_id for _, partner_id, _ in pairs})
+    rows = list(_build(pairs, counts))
+    with transaction.atomic():
+        models.ProductRecommendation.objects.filter(product_id__in=product_ids).delete()
+        models.ProductRecommendation.objects.bulk_create(rows)
+    return len(rows)
+
+
+def for_product(product, limit=4):
+    """Products to show with ``product``, best first; best sellers fill in while history is thin"""
+    related = list(
+        models.Product.objects.filter(recommended_with__product=product).order_by('recommended_with__rank')[:limit]
+    )
+    if len(related) < limit:
+        exclude = [product.id] + [item.id for item in related]
+        related += list(
+            models.Product.objects.exclude(id__in=exclude).order_by('-order_count', '-units_sold', 'id')[:limit - len(related)]
+        )
+    return related
@@ -0,0 +1,151 @@
+"""
+Time-boxed stock reservations.
+
+Putting a product in the cart holds that many units for the cart's holder
+until the hold expires (``STOCK_HOLD_TTL`` seconds, renewed on every change to
+the line). Stock a shopper can still take is on-hand minus everybody else's
+active holds, computed in aggregate subqueries, so during a rush the last units
+go to the carts that claimed them first instead of to whoever pays first.
+Holds on any size of a product count against the product's total as well as
+against their size. A visitor's holds follow their cart to the account they
+log in to (see :func:`transfer`).
+Checkout turns the holder's holds into the stock decrement; abandoned holds
+lapse and are deleted in bulk by the job worker every
+``STOCK_HOLD_EXPIRY_INTERVAL`` seconds (``ecom.tasks.expire_stock_holds``),
+or by ``python manage.py expire_stock_holds``.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, F, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import models
+
+STOCK_HOLD_TTL = getattr(settings, 'STOCK_HOLD_TTL', 15 * 60)
+
+
+def active_holds(exclude_holder=None):
+    """Holds that have not expired, optionally leaving out one holder's own"""
+    holds = models.StockHold.objects.filter(expires_at__gt=timezone.now())
+    if exclude_holder:
+        holds = holds.exclude(holder=exclude_holder)
+    return holds
+
+
+def held_quantity(exclude_holder=None, product='pk', any_size=False):
+    """
+    Expression for a Product queryset: units of the product's size held by
+    other carts, 0 when none; with ``any_size``, units held in any of its
+    sizes. For a ProductVariant queryset pass ``product='product'``.
+    """
+    held = active_holds(exclude_holder).filter(product=OuterRef(product))
+    if not any_size:
+        held = held.filter(size=OuterRef('size'))
+    held = held.values('product').annotate(total=Sum('quantity')).values('total')
+    return Coalesce(Subquery(held, output_field=IntegerField()), 0)
+
+
+def stock_levels(product_ids, holder=None, lock=False):
+    """
+    What ``holder`` can still take, in two queries: ``(totals, free,
+    variants)``. ``totals`` is ``{product_id: units}``, the product's stock
+    minus the other holders' active holds on all of its sizes. ``free`` is
+    ``{(product_id, size): units}``, a size's share of the stock (split by
+    :func:`ecom.models.split_size_stock`) minus the holds on that size,
+    and never more than the product's total; sizes the product is not
+    stocked in are left out. ``variants`` is the set of ``(product_id,
+    size)`` pairs that have a variant row. ``lock`` locks the product and
+    variant rows until the end of the transaction.
+    """
+    products = models.Product.objects.filter(id__in=product_ids)
+    variants = models.ProductVariant.objects.filter(product_id__in=product_ids)
+    if lock:
+        products = products.select_for_update()
+        variants = variants.select_for_update()
+    variant_rows = {}
+    for product_id, size, quantity, held in variants.annotate(
+        held=held_quantity(holder, product='product')
+    ).values_list('product_id', 'size', 'quantity', 'held'):
+        variant_rows.setdefault(product_id, {})[size] = (quantity, held)
+
+    totals, free = {}, {}
+    for product_id, own_size, total, own_held, total_held in products.annotate(
+        held=held_quantity(holder), total_held=held_quantity(holder, any_size=True)
+    ).values_list('id', 'size', 'quantity', 'held', 'total_held'):
+        totals[product_id] = max(total - total_held, 0)
+        rows = variant_rows.get(product_id, {})
+        held = {size: size_held for size, (_, size_held) in rows.items()}
+        held.setdefault(own_size, own_held)
+        on_hand = models.split_size_stock(own_size, total, {size: quantity for size, (quantity, _) in rows.items()})
+        for size, units in on_hand.items():
+            free[product_id, size] = max(min(units - held[size], totals[product_id]), 0)
+    variant_keys = {(product_id, size) for product_id, rows in variant_rows.items() for size in rows}
+    return totals, free, variant_keys
+
+
+def available_stock(product_ids, holder=None, lock=False):
+    """``{(product_id, size): units}`` free for ``holder``; see :func:`stock_levels`"""
+    return stock_levels(product_ids, holder, lock)[1]
+
+
+def hold(holder, product_id, size, quantity, ttl=None):
+    """
+    Hold ``quantity`` units of a product in a size for ``holder``, replacing
+    the holder's previous hold on that line, and return the units available
+    to the holder. The hold is only placed if that covers ``quantity``. The
+    holder's holds on the product's other sizes come out of the same total.
+    """
+    product_id = int(product_id)
+    ttl = STOCK_HOLD_TTL if ttl is None else ttl
+    with transaction.atomic():
+        # Locking the product row serializes holders racing for the last units
+        totals, free, _ = stock_levels([product_id], holder, lock=True)
+        other_sizes = (
+            active_holds().filter(holder=holder, product_id=product_id).exclude(size=size)
+            .aggregate(total=Coalesce(Sum('quantity'), 0))['total']
+        )
+        available = max(min(free.get((product_id, size), 0), totals.get(product_id, 0) - other_sizes), 0)
+        if available >= quantity:
+            models.StockHold.objects.update_or_create(
+                holder=holder, product_id=product_id, size=size,
+                defaults={'quantity': quantity, 'expires_at': timezone.now() + timedelta(seconds=ttl)},
+            )
+    return available
+
+
+def transfer(from_holder, to_holder, ttl=None):
+    """
+    Move ``from_holder``'s active holds to ``to_holder``, e.g. a visitor's
+    to their account at login, renewing them. Lines both hold are added
+    together. A fixed number of statements, however many lines there are.
+    """
+    ttl = STOCK_HOLD_TTL if ttl is None else ttl
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=ttl)
+    with transaction.atomic():
+        models.StockHold.objects.filter(holder__in=[from_holder, to_holder], expires_at__lte=now).delete()
+        moving = models.StockHold.objects.filter(holder=from_holder)
+        same_line = moving.filter(product=OuterRef('product'), size=OuterRef('size'))
+        models.StockHold.objects.filter(holder=to_holder).filter(Exists(same_line)).update(
+            quantity=F('quantity') + Subquery(same_line.values('quantity')[:1]), expires_at=expires_at,
+        )
+        held = models.StockHold.objects.filter(holder=to_holder, product=OuterRef('product'), size=OuterRef('size'))
+        moving.filter(Exists(held)).delete()
+        moving.update(holder=to_holder, expires_at=expires_at)
+
+
+def release(holder, product_id=None, size=None):
+    """Drop the holder's hold on one line, or on every line"""
+    holds = models.StockHold.objects.filter(holder=holder)
+    if product_id is not None:
+        holds = holds.filter(product_id=product_id, size=size)
+    holds.delete()
+
+
+def expire_holds(now=None):
+    """Delete every lapsed hold in one statement; returns how many"""
+    deleted, _ = models.StockHold.objects.filter(expires_at__lte=now or timezone.now()).delete()
+    return deleted
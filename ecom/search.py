@@ -0,0 +1,156 @@
+"""
+Full-text product search.
+
+Product names and descriptions are kept in a full-text index next to the
+product table, created by migration 0056: an FTS5 table on SQLite and a table
+of ``tsvector`` documents with a GIN index on PostgreSQL. A ``post_save``
+signal on ``Product`` (see ``ecom.signals``) keeps it current, and
+``python manage.py rebuild_search_index`` rebuilds it after bulk edits.
+
+:func:`search_products` runs one ranked query against the index for the best
+``SEARCH_MAX_RESULTS`` product ids, then narrows any product queryset to them
+and annotates ``search_rank`` (1 is the best match), so a search costs the
+same however large the catalog grows. Every word of the query matches as a
+prefix and any word may match, like the catalog search always did. A
+database without either index falls back to ``icontains`` filters.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import IntegerField, Q
+from django.db.models.expressions import RawSQL
+
+from . import models
+
+FTS_TABLE = 'ecom_product_fts'
+TSVECTOR_TABLE = 'ecom_product_search'
+
+# Name matches weigh more than description matches
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+# Matches beyond this many, by relevance, are not returned
+SEARCH_MAX_RESULTS = getattr(settings, 'SEARCH_MAX_RESULTS', 1000)
+
+_available = {}
+
+_DOCUMENT_SQL = (
+    "setweight(to_tsvector('simple', coalesce(%s, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(%s, '')), 'B')"
+)
+
+
+def terms(text):
+    """Lower-cased words of a search query, without FTS syntax characters"""
+    return re.findall(r'\w+', (text or '').lower())
+
+
+def backend():
+    """``'fts5'``, ``'postgresql'`` or None when this database has no index"""
+    vendor = connection.vendor
+    if vendor not in _available:
+        table = {'sqlite': FTS_TABLE, 'postgresql': TSVECTOR_TABLE}.get(vendor)
+        found = table is not None and table in connection.introspection.table_names()
+        _available[vendor] = found
+    if not _available[vendor]:
+        return None
+    return 'fts5' if vendor == 'sqlite' else 'postgresql'
+
+
+def _fill_sql(vendor):
+    """One statement indexing every product"""
+    product_table = models.Product._meta.db_table
+    if vendor == 'sqlite':
+        return f"INSERT INTO {FTS_TABLE} (rowid, name, description) SELECT id, name, description FROM {product_table}"
+    return (
+        f"INSERT INTO {TSVECTOR_TABLE} (product_id, document) SELECT id, {_DOCUMENT_SQL % ('name', 'description')} "
+        f"FROM {product_table}"
+    )
+
+
+def _write(cursor, rows):
+    """Index ``(id, name, description)`` rows, replacing what was there"""
+    if backend() == 'fts5':
+        cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(row[0],) for row in rows])
+        cursor.executemany(f"INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)", rows)
+    elif backend() == 'postgresql':
+        cursor.executemany(
+            f"INSERT INTO {TSVECTOR_TABLE} (product_id, document) VALUES (%s, {_DOCUMENT_SQL % ('%s', '%s')}) "
+            f"ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document",
+            rows,
+        )
+
+
+def index_product(product):
+    with connection.cursor() as cursor:
+        _write(cursor, [(product.id, product.name, product.description)])
+
+
+def remove_product(product_id):
+    if backend() == 'fts5':
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [product_id])
+    # PostgreSQL rows go with the product (ON DELETE CASCADE)
+
+
+def rebuild():
+    """Re-index every product in one statement; returns how many"""
+    if backend() is None:
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE if backend() == 'fts5' else TSVECTOR_TABLE}")
+        cursor.execute(_fill_sql(connection.vendor))
+        return cursor.rowcount
+
+
+def ranked_ids(text, limit=None):
+    """Ids of the products best matching ``text``, best first, from the index alone"""
+    words = terms(text)
+    kind = backend()
+    if not words or kind is None:
+        return []
+    limit = limit or SEARCH_MAX_RESULTS
+    with connection.cursor() as cursor:
+        if kind == 'fts5':
+            cursor.execute(
+                f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+                f"ORDER BY bm25({FTS_TABLE}, {NAME_WEIGHT}, {DESCRIPTION_WEIGHT}) LIMIT %s",
+                [' OR '.join(f'"{word}"*' for word in words), limit],
+            )
+        else:
+            cursor.execute(
+                f"SELECT product_id FROM {TSVECTOR_TABLE}, to_tsquery('simple', %s) query "
+                f"WHERE document @@ query ORDER BY ts_rank(document, query) DESC LIMIT %s",
+                [' | '.join(f'{word}:*' for word in words), limit],
+            )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search_products(queryset, text):
+    """``queryset`` narrowed to products matching ``text``, annotated with ``search_rank`` and ordered by it"""
+    words = terms(text)
+    if not words:
+        return queryset
+
+    if backend() is None:
+        match = Q()
+        for word in words:
+            match |= Q(name__icontains=word) | Q(description__icontains=word)
+        return queryset.filter(match)
+
+    ids = ranked_ids(text)
+    if not ids:
+        return queryset.none()
+    product_table = models.Product._meta.db_table
+    if connection.vendor == 'sqlite':
+        # Position of ",<id>," in the ranked list; the order is all that matters
+        rank = RawSQL(
+            f"instr(%s, ',' || {product_table}.id || ',')",
+            [',' + ','.join(map(str, ids)) + ','], output_field=IntegerField(),
+        )
+    else:
+        rank = RawSQL(
+            f"array_position(%s::bigint[], {product_table}.id::bigint)", [ids], output_field=IntegerField(),
+        )
+    return queryset.filter(id__in=ids).annotate(search_rank=rank).order_by('search_rank', 'id')
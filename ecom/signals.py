@@ -0,0 +1,119 @@
+"""
+Keeps derived data (the search index, product rating totals, popularity
+counters, the cached catalog summary and catalog pages) in step with the rows
+it is built from, and moves a visitor's cart into their account when they log
+in.
+"""
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from . import cart, catalog, models, page_cache, popularity, ratings, search
+
+SEARCH_FIELDS = {'name', 'description'}
+
+
+@receiver(post_save, sender=models.Product)
+def index_product(sender, instance, update_fields=None, raw=False, **kwargs):
+    if raw or (update_fields is not None and not SEARCH_FIELDS & set(update_fields)):
+        return
+    search.index_product(instance)
+
+
+@receiver(post_delete, sender=models.Product)
+def unindex_product(sender, instance, **kwargs):
+    search.remove_product(instance.id)
+
+
+@receiver([post_save, post_delete], sender=models.Product)
+@receiver([post_save, post_delete], sender=models.ProductVariant)
+def invalidate_catalog(sender, raw=False, **kwargs):
+    if not raw:
+        catalog.invalidate()
+        page_cache.bump()
+
+
+@receiver([post_save, post_delete], sender=models.ProductReview)
+def invalidate_catalog_pages(sender, raw=False, **kwargs):
+    # Ratings order the catalog
+    if not raw:
+        page_cache.bump()
+
+
+@receiver(post_init, sender=models.ProductReview)
+def remember_rating(sender, instance, **kwargs):
+    # What the row held when loaded, so a save only applies the difference
+    instance._stored_rating = (instance.product_id, instance.rating) if instance.pk else None
+
+
+@receiver(post_save, sender=models.ProductReview)
+def update_product_rating(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    stored = None if created else instance._stored_rating
+    if stored and stored[0] != instance.product_id:
+        ratings.apply(stored[0], -stored[1], -1)
+        stored = None
+    if stored:
+        ratings.apply(instance.product_id, instance.rating - stored[1], 0)
+    else:
+        ratings.apply(instance.product_id, instance.rating, 1)
+    instance._stored_rating = (instance.product_id, instance.rating)
+
+
+@receiver(post_delete, sender=models.ProductReview)
+def remove_product_rating(sender, instance, **kwargs):
+    stored = instance._stored_rating or (instance.product_id, instance.rating)
+    ratings.apply(stored[0], -stored[1], -1)
+
+
+@receiver(post_init, sender=models.Orders)
+def remember_status(sender, instance, **kwargs):
+    instance._stored_status = instance.status if instance.pk else None
+
+
+@receiver(post_save, sender=models.Orders)
+def update_popularity_for_status(sender, instance, created, raw=False, **kwargs):
+    if raw or created:
+        return
+    was_counted = popularity.counted(instance._stored_status)
+    if was_counted != popularity.counted(instance.status):
+        popularity.apply_orders([instance.id], 1 if not was_counted else -1)
+    instance._stored_status = instance.status
+
+
+def _order_counted(order_id):
+    status = models.Orders.objects.filter(id=order_id).values_list('status', flat=True).first()
+    return popularity.counted(status)
+
+
+@receiver(post_init, sender=models.OrderItem)
+def remember_line(sender, instance, **kwargs):
+    instance._stored_line = (instance.product_id, instance.quantity) if instance.pk else None
+
+
+@receiver(post_save, sender=models.OrderItem)
+def update_popularity_for_line(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    stored = None if created else instance._stored_line
+    line = (instance.product_id, instance.quantity)
+    if stored != line and _order_counted(instance.order_id):
+        if stored:
+            popularity.apply([stored], -1)
+        popularity.apply([line])
+    instance._stored_line = line
+
+
+@receiver(post_delete, sender=models.OrderItem)
+def remove_popularity_for_line(sender, instance, **kwargs):
+    # Runs before a cascading order delete removes the order itself
+    if _order_counted(instance.order_id):
+        popularity.apply([instance._stored_line or (instance.product_id, instance.quantity)], -1)
+
+
+@receiver(user_logged_in)
+def merge_cart_on_login(sender, request, user, **kwargs):
+    customer = models.Customer.objects.filter(user=user).first() if request is not None else None
+    if customer is not None:
+        cart.merge_anonymous_cart(request, customer)
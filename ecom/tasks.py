@@ -0,0 +1,32 @@
+"""
+Background job tasks; queue them with ``ecom.jobs.enqueue``.
+"""
+from django.conf import settings
+from django.core.mail import send_mail
+
+from . import recommendations, reservations
+from .jobs import task
+
+
+@task(max_attempts=5)
+def send_contact_email(name, email, message):
+    """Forward a contact-us message to the shop's inbox"""
+    send_mail(f"{name} || {email}", message, settings.EMAIL_HOST_USER, settings.EMAIL_RECEIVING_USER, fail_silently=False)
+
+
+@task(max_attempts=3)
+def refresh_recommendations(product_ids):
+    """Recompute the "frequently bought together" rows of products that were just ordered"""
+    return {'rows': recommendations.refresh(product_ids)}
+
+
+@task(max_attempts=1, every=getattr(settings, 'STOCK_HOLD_EXPIRY_INTERVAL', 5 * 60))
+def expire_stock_holds():
+    """Delete lapsed cart stock holds so their units are available again"""
+    return {'deleted': reservations.expire_holds()}
+
+
+@task(max_attempts=3, every=getattr(settings, 'RECOMMENDATIONS_REBUILD_INTERVAL', 24 * 60 * 60))
+def rebuild_recommendations():
+    """Rebuild the whole "frequently bought together" table from the order history"""
+    return {'rows': recommendations.rebuild()}
@@ -10,6 +10,10 @@ def multiply(value, arg):
     except (ValueError, TypeError):
         return ''
 
+# A filter sees one value at a time, so these resolve one code per call
+# (bundled data first, then the cache and the API). No page template uses
+# them: pages read the stored *_name columns, and list views fill rows that
+# lack names for the whole page with utils.resolve_addresses.
 @register.filter
 def region_name(value):
     """Convert region code to readable name"""
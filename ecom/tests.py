@@ -1,3 +1,1179 @@
-from django.test import TestCase
+import importlib
+import json
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.apps import apps as django_apps
+from django.contrib.auth.models import User
+from django.core import signing
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.http import QueryDict
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from . import api_views, catalog, forms, gazetteer, http_client, jobs, models, orders, page_cache, pagination, pricing, recommendations, reservations, search, tasks, upstream, utils
+from .cart import CART_COOKIE, decode_cart_cookie, encode_cart_cookie
+
+
+def cookie_cart(client):
+    """The anonymous test client's cart cookie, decoded"""
+    cookie = client.cookies.get(CART_COOKIE)
+    return decode_cart_cookie(cookie.value if cookie else None)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers from the server's ``script``: a list of ``(status, delay)``, last one repeated"""
+    protocol_version = 'HTTP/1.1'
+
+    def _answer(self):
+        server = self.server
+        with server.lock:
+            server.hits.append((self.command, self.path))
+            server.clients.add(self.client_address)
+            status, delay = server.script[min(len(server.hits), len(server.script)) - 1]
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        if delay:
+            time.sleep(delay)
+        body = f'{{"path": "{self.path}"}}'.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _answer
+    do_POST = _answer
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients that time out hang up before the stub answers
+        pass
+
+
+@override_settings(HTTP_CLIENT_BACKOFF=0, HTTP_CLIENT_RETRIES=2)
+class HttpClientStubServerTests(SimpleTestCase):
+    """ecom.http_client against a local stub server"""
+
+    def setUp(self):
+        self.server = StubServer(('127.0.0.1', 0), StubHandler)
+        self.server.lock = threading.Lock()
+        self.server.hits = []
+        self.server.clients = set()
+        self.server.script = [(200, 0)]
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        http_client.reset()
+
+    def tearDown(self):
+        http_client.reset()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connection_is_kept_alive(self):
+        for i in range(5):
+            self.assertEqual(http_client.get(f'{self.url}/{i}').json(), {'path': f'/{i}'})
+        self.assertEqual(len(self.server.hits), 5)
+        self.assertEqual(len(self.server.clients), 1)
+
+    def test_gateway_errors_are_retried(self):
+        self.server.script = [(503, 0), (502, 0), (200, 0)]
+        self.assertEqual(http_client.get(self.url).status_code, 200)
+        self.assertEqual(len(self.server.hits), 3)
+
+    def test_post_is_not_retried(self):
+        self.server.script = [(503, 0), (200, 0)]
+        self.assertEqual(http_client.post(self.url, json={}).status_code, 503)
+        self.assertEqual(len(self.server.hits), 1)
+
+    def test_read_timeout_is_not_retried(self):
+        self.server.script = [(200, 0.5)]
+        with self.assertRaises(requests.ReadTimeout):
+            http_client.get(self.url, timeout=0.1)
+        time.sleep(0.5)
+        self.assertEqual(len(self.server.hits), 1)
+
+    def test_no_retries_session(self):
+        self.server.script = [(503, 0), (200, 0)]
+        self.assertEqual(http_client.get(self.url, retries=0).status_code, 503)
+        self.assertEqual(len(self.server.hits), 1)
+
+    def test_fan_out_keeps_order_and_errors(self):
+        def fetch(item):
+            if item == 'bad':
+                raise ValueError(item)
+            return http_client.get(f'{self.url}/{item}').json()['path']
+
+        results = http_client.fan_out(fetch, ['a', 'bad', 'c'])
+        self.assertEqual(results[0], '/a')
+        self.assertIsInstance(results[1], ValueError)
+        self.assertEqual(results[2], '/c')
+
+    def test_psgc_breaker_counts_each_call_once(self):
+        self.server.script = [(503, 0)]
+        breaker = upstream.psgc_breaker
+        breaker.reset()
+        self.addCleanup(breaker.reset)
+        with override_settings(PSGC_API_BASE_URL=self.url):
+            for _ in range(breaker.failure_threshold):
+                with self.assertRaises(requests.HTTPError):
+                    upstream.psgc_get('regions/')
+            with self.assertRaises(upstream.CircuitOpenError):
+                upstream.psgc_get('regions/')
+        self.assertEqual(len(self.server.hits), breaker.failure_threshold)
+
+
+class PlaceOrderTests(TestCase):
+    """ecom.orders.place_order: stock checks, rollback and idempotent replays"""
+
+    def setUp(self):
+        user = User.objects.create_user('buyer', password='pw')
+        self.customer = models.Customer.objects.create(
+            user=user, mobile='09170000000', region='NCR', postal_code='1000', street_address='1 Main St',
+        )
+        self.shirt = models.Product.objects.create(
+            name='Shirt', price=100, description='Shirt', quantity=5, size='M', product_image='product_image/shirt.jpg',
+        )
+        self.hoodie = models.Product.objects.create(
+            name='Hoodie', price=250, description='Hoodie', quantity=2, size='L', product_image='product_image/hoodie.jpg',
+        )
+
+    def quote(self, *lines):
+        return pricing.price_cart(
+            [SimpleNamespace(product=product, size=size, quantity=quantity) for product, size, quantity in lines],
+            delivery_fee=0,
+        )
+
+    def place(self, *lines, **kwargs):
+        return orders.place_order(self.customer, self.quote(*lines), **kwargs)
+
+    def stock(self, product):
+        return models.Product.objects.get(id=product.id).quantity
+
+    def test_places_order_and_takes_stock(self):
+        order = self.place((self.shirt, 'M', 3), (self.hoodie, 'L', 2))
+        self.assertEqual(
+            sorted(order.orderitem_set.values_list('product_id', 'quantity')),
+            sorted([(self.shirt.id, 3), (self.hoodie.id, 2)]),
+        )
+        self.assertEqual(self.stock(self.shirt), 2)
+        self.assertEqual(self.stock(self.hoodie), 0)
+
+    def test_oversell_rolls_back_whole_order(self):
+        with self.assertRaises(orders.InsufficientStock) as raised:
+            self.place((self.shirt, 'M', 3), (self.hoodie, 'L', 3), idempotency_key='k' * 64)
+        self.assertEqual(raised.exception.available, 2)
+        self.assertEqual(models.Orders.objects.count(), 0)
+        self.assertEqual(models.OrderItem.objects.count(), 0)
+        self.assertEqual(models.CheckoutRequest.objects.count(), 0)
+        self.assertEqual(self.stock(self.shirt), 5)
+        self.assertEqual(self.stock(self.hoodie), 2)
+
+    def test_lines_of_one_product_are_checked_together(self):
+        with self.assertRaises(orders.InsufficientStock):
+            self.place((self.shirt, 'M', 3), (self.shirt, 'S', 3))
+        self.assertEqual(self.stock(self.shirt), 5)
+
+    def test_variant_stock_limits_its_size(self):
+        models.ProductVariant.objects.create(product=self.shirt, size='S', quantity=1)
+        with self.assertRaises(orders.InsufficientStock):
+            self.place((self.shirt, 'S', 2))
+        self.place((self.shirt, 'S', 1))
+        self.assertEqual(models.ProductVariant.objects.get(product=self.shirt, size='S').quantity, 0)
+        self.assertEqual(self.stock(self.shirt), 4)
+
+    def test_same_key_replays_first_order(self):
+        key = orders.checkout_key(self.customer, token='client-token')
+        first = self.place((self.shirt, 'M', 2), idempotency_key=key)
+        again = self.place((self.shirt, 'M', 2), idempotency_key=key)
+        self.assertEqual(again.id, first.id)
+        self.assertEqual(models.Orders.objects.count(), 1)
+        self.assertEqual(self.stock(self.shirt), 3)
+
+    def test_snapshot_key_depends_on_cart_and_customer(self):
+        quote = self.quote((self.shirt, 'M', 2))
+        key = orders.checkout_key(self.customer, quote=quote)
+        self.assertEqual(key, orders.checkout_key(self.customer, quote=self.quote((self.shirt, 'M', 2))))
+        self.assertNotEqual(key, orders.checkout_key(self.customer, quote=self.quote((self.shirt, 'M', 3))))
+        self.assertIsNone(orders.checkout_key(self.customer))
+
+    def test_concurrent_duplicate_returns_winners_order(self):
+        key = orders.checkout_key(self.customer, token='raced')
+        winner = self.place((self.shirt, 'M', 2), idempotency_key=key)
+        real_find_order = orders.find_order
+        # The losing request looked the key up before the winner committed
+        with mock.patch.object(orders, 'find_order', side_effect=[None, real_find_order(key)]):
+            loser = self.place((self.shirt, 'M', 2), idempotency_key=key)
+        self.assertEqual(loser.id, winner.id)
+        self.assertEqual(models.Orders.objects.count(), 1)
+        self.assertEqual(models.OrderItem.objects.count(), 1)
+        self.assertEqual(self.stock(self.shirt), 3)
+
+    def test_snapshot_key_expires_after_replay_window(self):
+        key = orders.checkout_key(self.customer, quote=self.quote((self.shirt, 'M', 1)))
+        first = self.place((self.shirt, 'M', 1), idempotency_key=key, replay_window=600)
+        self.assertEqual(self.place((self.shirt, 'M', 1), idempotency_key=key, replay_window=600).id, first.id)
+
+        models.CheckoutRequest.objects.filter(key=key).update(created_at=timezone.now() - timedelta(seconds=601))
+        second = self.place((self.shirt, 'M', 1), idempotency_key=key, replay_window=600)
+        self.assertNotEqual(second.id, first.id)
+        self.assertEqual(models.CheckoutRequest.objects.get(key=key).order_id, second.id)
+        self.assertEqual(self.stock(self.shirt), 3)
+
+
+class AddressNameTests(TestCase):
+    """Stored address names: resolved only for changed codes, copied onto orders"""
+
+    def setUp(self):
+        with self.resolving():
+            self.customer = models.Customer.objects.create(
+                user=User.objects.create_user('buyer', password='pw'), mobile='09170000000',
+                region='130000000', province='133900000', citymun='133901000', barangay='133901001',
+                postal_code='1000', street_address='1 Main St',
+            )
+
+    def resolving(self):
+        return mock.patch('ecom.utils.resolve_psgc_names', side_effect=lambda pairs: {
+            (level, code): f'{level} {code}' for level, code in pairs
+        })
+
+    def test_save_resolves_only_changed_codes(self):
+        customer = models.Customer.objects.get(id=self.customer.id)
+        with self.resolving() as resolve:
+            customer.mobile = '09171111111'
+            customer.save()
+            customer.save(update_fields=['mobile'])
+            self.assertFalse(resolve.called)
+
+            customer.barangay = '133901002'
+            customer.save()
+            self.assertEqual(resolve.call_count, 1)
+            customer.save()
+            self.assertEqual(resolve.call_count, 1)
+        self.assertEqual(models.Customer.objects.get(id=customer.id).barangay_name, 'barangay 133901002')
+
+    def test_order_keeps_the_profile_codes_and_names(self):
+        shirt = models.Product.objects.create(
+            name='Shirt', price=100, description='Shirt', quantity=5, size='M', product_image='product_image/shirt.jpg',
+        )
+        quote = pricing.price_cart([SimpleNamespace(product=shirt, size='M', quantity=1)], delivery_fee=0)
+        with self.resolving() as resolve:
+            order = orders.place_order(
+                self.customer, quote, address=self.customer.formatted_address, ship_to=self.customer,
+            )
+            typed = orders.place_order(self.customer, quote, address='Unit 5, Somewhere')
+        self.assertFalse(resolve.called)
+        order.refresh_from_db()
+        self.assertEqual((order.citymun, order.citymun_name), (self.customer.citymun, self.customer.citymun_name))
+        self.assertEqual(order.formatted_address, self.customer.formatted_address)
+        typed.refresh_from_db()
+        self.assertEqual((typed.citymun, typed.citymun_name, typed.formatted_address), ('', '', 'Unit 5, Somewhere'))
+
+    def test_backfill_gives_older_orders_their_codes_in_bulk(self):
+        with self.resolving():
+            saved = models.SavedAddress.objects.create(
+                customer=self.customer, region='130000000', province='133900000', citymun='133902000',
+                barangay='133902001', street_address='2 Side St', postal_code=1001,
+            )
+        older = [
+            models.Orders.objects.create(customer=self.customer, address=address)
+            for address in ('', self.customer.formatted_address, saved.formatted_address, 'Typed in')
+        ]
+        models.Orders.objects.update(formatted_address='')
+        with self.resolving() as resolve:
+            call_command('backfill_address_names', stdout=StringIO())
+        # The addresses already have names; the orders are resolved in one pass
+        self.assertEqual(resolve.call_count, 1)
+        codes = dict(models.Orders.objects.values_list('id', 'citymun'))
+        self.assertEqual([codes[order.id] for order in older], ['133901000', '133901000', '133902000', ''])
+        self.assertEqual(
+            models.Orders.objects.get(id=older[2].id).citymun_name, 'citymun 133902000',
+        )
+
+    def test_list_pages_resolve_only_rows_without_names(self):
+        models.Customer.objects.filter(id=self.customer.id).update(formatted_address='', barangay_name='')
+        with self.resolving():
+            other = models.Customer.objects.create(
+                user=User.objects.create_user('other', password='pw'), mobile='09170000000',
+                region='130000000', province='133900000', citymun='133902000', barangay='133902001',
+                postal_code='1000', street_address='2 Side St',
+            )
+        models.Customer.objects.filter(id=other.id).update(barangay_name='Stored')
+        with self.resolving() as resolve:
+            resolved = utils.resolve_addresses(models.Customer.objects.order_by('id'), missing_only=True)
+        self.assertEqual(resolve.call_count, 1)
+        self.assertEqual([customer.barangay_name for customer in resolved], ['barangay 133901001', 'Stored'])
+
+    def test_api_errors_are_logged(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        with mock.patch.object(utils, 'fetch_psgc_name', side_effect=requests.ConnectionError('down')):
+            with self.assertLogs('ecom.utils', 'WARNING') as logs:
+                names = utils.resolve_psgc_names([('barangay', '133901999')])
+        self.assertEqual(names[('barangay', '133901999')], 'Barangay 133901999')
+        self.assertIn('barangay 133901999', logs.output[0])
+
+
+class CartTests(TestCase):
+    """Cart storage: the signed cookie, CartMiddleware, the JSON endpoints and login"""
+
+    def setUp(self):
+        self.shirt = models.Product.objects.create(
+            name='Shirt', price=100, description='Shirt', quantity=10, size='M', product_image='product_image/shirt.jpg',
+        )
+        self.hoodie = models.Product.objects.create(
+            name='Hoodie', price=250, description='Hoodie', quantity=10, size='L', product_image='product_image/hoodie.jpg',
+        )
+
+    def add(self, product, size, quantity=1):
+        return self.client.post('/api/cart/items', {'product_id': product.id, 'size': size, 'quantity': quantity})
+
+    def test_cookie_round_trip(self):
+        items = {(self.shirt.id, 'M'): 2, (self.hoodie.id, 'L'): 1}
+        self.assertEqual(decode_cart_cookie(encode_cart_cookie(items)), items)
+        # One cookie whatever the number of lines
+        many = {(product_id, 'M'): 1 for product_id in range(1, 41)}
+        self.assertLess(len(encode_cart_cookie(many)), 400)
+
+    def test_tampered_or_foreign_cookie_is_ignored(self):
+        value = encode_cart_cookie({(self.shirt.id, 'M'): 2})
+        self.assertEqual(decode_cart_cookie(value[:-1] + ('A' if value[-1] != 'A' else 'B')), {})
+        self.assertEqual(decode_cart_cookie(signing.dumps([[1, 'M', 2]], salt='other')), {})
+        self.assertEqual(decode_cart_cookie('garbage'), {})
+        self.assertEqual(decode_cart_cookie(None), {})
+
+    def test_json_endpoints_return_the_line_and_totals(self):
+        response = self.add(self.shirt, 'M', 2)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['line'], {
+            'product_id': self.shirt.id, 'size': 'M', 'quantity': 2, 'unit_price': '100', 'line_total': '200',
+        })
+        self.assertEqual((data['count'], data['item_count'], data['totals']['subtotal']), (1, 2, '200.00'))
+
+        data = self.add(self.hoodie, 'L').json()
+        self.assertEqual((data['count'], data['item_count'], data['totals']['subtotal']), (2, 3, '450.00'))
+        self.assertEqual(cookie_cart(self.client), {(self.shirt.id, 'M'): 2, (self.hoodie.id, 'L'): 1})
+
+        data = self.client.delete(f'/api/cart/items/{self.shirt.id}/M').json()
+        self.assertIsNone(data['line'])
+        self.assertEqual((data['count'], data['totals']['subtotal']), (1, '250.00'))
+        self.assertEqual(cookie_cart(self.client), {(self.hoodie.id, 'L'): 1})
+
+    def test_json_endpoint_rejects_bad_input(self):
+        self.assertEqual(self.add(self.shirt, 'M', 0).status_code, 400)
+        self.assertEqual(self.client.post('/api/cart/items', {'product_id': 'x'}).status_code, 400)
+        self.assertEqual(self.client.post('/api/cart/items', 'not json', content_type='application/json').status_code, 400)
+        self.assertEqual(self.client.post('/api/cart/items', {'product_id': 999999}).status_code, 404)
+        self.assertEqual(self.add(self.shirt, 'M', 11).status_code, 400)
+        self.assertEqual(cookie_cart(self.client), {})
+
+    def test_middleware_moves_legacy_cookies_into_the_cart(self):
+        self.client.cookies['product_ids'] = f'product_{self.shirt.id}_M|product_999999_M'
+        self.client.cookies[f'product_{self.shirt.id}_M_details'] = 'M:3'
+        self.client.cookies['product_999999_M_details'] = 'M:1'
+        data = self.client.delete(f'/api/cart/items/{self.hoodie.id}/L').json()
+        self.assertEqual(data['count'], 1)
+        self.assertEqual(cookie_cart(self.client), {(self.shirt.id, 'M'): 3})
+        self.assertEqual(self.client.cookies['product_ids'].value, '')
+        self.assertEqual(self.client.cookies[f'product_{self.shirt.id}_M_details'].value, '')
+
+    def test_customer_cart_is_stored_in_rows(self):
+        user = User.objects.create_user('buyer', password='pw')
+        customer = models.Customer.objects.create(
+            user=user, mobile='09170000000', region='NCR', postal_code='1000', street_address='1 Main St',
+        )
+        self.client.force_login(user)
+        self.add(self.shirt, 'M', 2)
+        self.add(self.shirt, 'M')
+        self.assertEqual(
+            list(models.CartItem.objects.filter(customer=customer).values_list('product_id', 'size', 'quantity')),
+            [(self.shirt.id, 'M', 3)],
+        )
+        self.assertNotIn(CART_COOKIE, self.client.cookies)
+
+    def test_login_merges_the_cookie_cart(self):
+        user = User.objects.create_user('buyer', password='pw')
+        customer = models.Customer.objects.create(
+            user=user, mobile='09170000000', region='NCR', postal_code='1000', street_address='1 Main St',
+        )
+        models.CartItem.objects.create(customer=customer, product=self.hoodie, size='L', quantity=1)
+        self.add(self.shirt, 'M', 2)
+        self.add(self.hoodie, 'L', 1)
+        self.client.post('/customerlogin', {'username': 'buyer', 'password': 'pw'})
+        self.assertEqual(
+            sorted(models.CartItem.objects.filter(customer=customer).values_list('product_id', 'size', 'quantity')),
+            sorted([(self.shirt.id, 'M', 2), (self.hoodie.id, 'L', 2)]),
+        )
+        self.assertEqual(cookie_cart(self.client), {})
+        self.assertEqual(self.client.get('/cart').context['product_count_in_cart'], 2)
+
+
+class PricingTests(TestCase):
+    """ecom.pricing: VAT-inclusive totals, rounding and delivery fees"""
+
+    def setUp(self):
+        self.shirt = models.Product.objects.create(
+            name='Shirt', price=100, description='Shirt', quantity=10, size='M', product_image='product_image/shirt.jpg',
+        )
+        self.cap = models.Product.objects.create(
+            name='Cap', price=12, description='Cap', quantity=10, size='M', product_image='product_image/cap.jpg',
+        )
+
+    def line(self, product, quantity, **kwargs):
+        return SimpleNamespace(product=product, size='M', quantity=quantity, **kwargs)
+
+    def test_vat_is_the_12_112_share_of_the_subtotal(self):
+        quote = pricing.price_cart([self.line(self.shirt, 1), self.line(self.cap, 1)], delivery_fee=0)
+        self.assertEqual(
+            (quote.subtotal, quote.vat_amount, quote.net_subtotal), (Decimal('112'), Decimal('12.00'), Decimal('100.00')),
+        )
+        self.assertEqual(quote.vat_rate, 12)
+
+    def test_vat_is_rounded_to_the_cent_and_net_keeps_the_rest(self):
+        quote = pricing.price_cart([self.line(self.shirt, 1)], delivery_fee=0)
+        self.assertEqual((quote.vat_amount, quote.net_subtotal), (Decimal('10.71'), Decimal('89.29')))
+        for price in ('0.14', '0.99', '1.01', '333.33', '9999.99'):
+            quote = pricing.price_cart([self.line(self.cap, 3, price=Decimal(price))], delivery_fee=0)
+            self.assertEqual(quote.vat_amount, quote.vat_amount.quantize(Decimal('0.01')))
+            self.assertEqual(quote.vat_amount + quote.net_subtotal, quote.subtotal)
+
+    def test_quote_totals_add_up_in_cart_order(self):
+        quote = pricing.price_cart([self.line(self.cap, 3), self.line(self.shirt, 2)], delivery_fee=Decimal('95.00'))
+        self.assertEqual([(line.product, line.unit_price, line.line_total) for line in quote.lines], [
+            (self.cap, Decimal('12'), Decimal('36')), (self.shirt, Decimal('100'), Decimal('200')),
+        ])
+        self.assertEqual(quote.subtotal, Decimal('236.00'))
+        self.assertEqual(quote.grand_total, Decimal('331.00'))
+
+    def test_order_item_price_wins_over_the_current_price(self):
+        # Items keep what was charged, e.g. a sale price, after the product's price changes
+        quote = pricing.price_cart([self.line(self.shirt, 2, price=Decimal('79.50'))], delivery_fee=0)
+        self.assertEqual((quote.lines[0].unit_price, quote.subtotal), (Decimal('79.50'), Decimal('159.00')))
+        self.assertEqual(quote.vat_amount, Decimal('17.04'))
+
+    def test_empty_cart_and_free_delivery(self):
+        quote = pricing.price_cart([], delivery_fee=0)
+        self.assertEqual(quote.lines, ())
+        self.assertEqual((quote.subtotal, quote.vat_amount, quote.net_subtotal, quote.grand_total), (0, 0, 0, 0))
+        quote = pricing.price_cart([self.line(self.shirt, 1, price=Decimal('0'))], delivery_fee=Decimal('50'))
+        self.assertEqual((quote.vat_amount, quote.grand_total), (Decimal('0.00'), Decimal('50.00')))
+
+    def test_delivery_fee_uses_the_lightest_fitting_bracket(self):
+        for weight, price in (('0.25', '40.00'), ('0.50', '85.00'), ('1.00', '120.00')):
+            models.ShippingFee.objects.create(
+                courier='Standard', origin_region='NCR', destination_region='Region III', weight_kg=weight, price_php=price,
+            )
+        self.assertEqual(pricing.shipping_fee('Region R3'), Decimal('85.00'))
+        self.assertEqual(pricing.shipping_fee('Region R3', weight_kg=Decimal('0.2')), Decimal('40.00'))
+        self.assertEqual(pricing.shipping_fee('BARMM'), pricing.DEFAULT_DELIVERY_FEE)
+        quote = pricing.price_cart([self.line(self.cap, 1)], destination='Region R3')
+        self.assertEqual(quote.grand_total, Decimal('97.00'))
+
+
+class RecommendationTests(TestCase):
+    """ecom.recommendations: "frequently bought together" from the order history"""
+
+    def setUp(self):
+        self.a, self.b, self.c, self.d, self.e = [
+            models.Product.objects.create(
+                name=name, price=100, description='Cotton', quantity=50, size='M', product_image='product_image/p.jpg',
+            )
+            for name in 'ABCDE'
+        ]
+        # Orders containing: A 3, B 2, C 2, D 1, not counting the cancelled ones
+        self.order(self.a, self.b)
+        self.order(self.a, self.b)
+        self.order(self.a, self.c)
+        self.order(self.c, self.d)
+        self.order(self.a, self.d, status='Cancelled')
+        self.order(self.a, self.d, status='Cancelled')
+
+    def order(self, *products, status='Pending'):
+        order = models.Orders.objects.create(status=status)
+        for product in products:
+            models.OrderItem.objects.create(order=order, product=product, quantity=1, price=100, size='M')
+        return order
+
+    def stored(self, product):
+        return [
+            (row.recommended, row.co_orders, round(row.score, 3))
+            for row in models.ProductRecommendation.objects.filter(product=product).order_by('rank')
+        ]
+
+    def test_rebuild_ranks_partners_by_cosine_similarity(self):
+        self.assertEqual(recommendations.rebuild(), 6)
+        # 2 / sqrt(3 * 2) and 1 / sqrt(3 * 2); D was only bought with A in cancelled orders
+        self.assertEqual(self.stored(self.a), [(self.b, 2, 0.816), (self.c, 1, 0.408)])
+        self.assertEqual(self.stored(self.b), [(self.a, 2, 0.816)])
+        # D's one order is shared with C, so it outranks A for C
+        self.assertEqual(self.stored(self.c), [(self.d, 1, 0.707), (self.a, 1, 0.408)])
+        self.assertEqual(self.stored(self.d), [(self.c, 1, 0.707)])
+        self.assertEqual(self.stored(self.e), [])
+
+    def test_cancelling_an_order_drops_its_pairs(self):
+        order = self.order(self.b, self.e)
+        recommendations.rebuild()
+        self.assertEqual(self.stored(self.e), [(self.b, 1, 0.577)])
+
+        order.status = 'Cancelled'
+        order.save()
+        recommendations.rebuild()
+        self.assertEqual(self.stored(self.e), [])
+        self.assertEqual(self.stored(self.b), [(self.a, 2, 0.816)])
+
+    def test_top_k_and_min_co_orders(self):
+        self.assertEqual(recommendations.rebuild(top_k=1), 4)
+        self.assertEqual(self.stored(self.a), [(self.b, 2, 0.816)])
+        self.assertEqual(recommendations.rebuild(min_co_orders=2), 2)
+        self.assertEqual(self.stored(self.a), [(self.b, 2, 0.816)])
+        self.assertEqual(self.stored(self.c), [])
+
+    def test_refresh_recomputes_only_the_given_products(self):
+        recommendations.rebuild()
+        self.order(self.d, self.e)
+        self.assertEqual(recommendations.refresh([self.e.id]), 1)
+        self.assertEqual(self.stored(self.e), [(self.d, 1, 0.707)])
+        # D's own list waits for the next rebuild
+        self.assertEqual(self.stored(self.d), [(self.c, 1, 0.707)])
+        self.assertEqual(recommendations.refresh([]), 0)
+
+    def test_for_product_fills_in_with_best_sellers(self):
+        recommendations.rebuild()
+        self.assertEqual(recommendations.for_product(self.a, limit=2), [self.b, self.c])
+        related = recommendations.for_product(self.b, limit=3)
+        self.assertEqual(related[0], self.a)
+        self.assertEqual(len(related), 3)
+        self.assertNotIn(self.b, related)
+        self.assertEqual(len(set(related)), 3)
+
+    def test_worker_runs_the_periodic_rebuild(self):
+        rebuilds = models.Job.objects.filter(task=tasks.rebuild_recommendations.task_name)
+        jobs.schedule_periodic()
+        self.assertEqual(rebuilds.filter(status=models.Job.QUEUED).count(), 1)
+        # Queued again only once the previous run has finished
+        jobs.schedule_periodic()
+        self.assertEqual(rebuilds.count(), 1)
+
+        models.Job.objects.exclude(task=tasks.rebuild_recommendations.task_name).delete()
+        [job] = jobs.claim('test-worker', limit=5)
+        self.assertEqual(job.task, tasks.rebuild_recommendations.task_name)
+        jobs.run(job)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result, job.attempts), (models.Job.DONE, {'rows': 6}, 1))
+        self.assertEqual(self.stored(self.a), [(self.b, 2, 0.816), (self.c, 1, 0.408)])
+
+        # The next run is due RECOMMENDATIONS_REBUILD_INTERVAL after this one
+        jobs.schedule_periodic()
+        queued = rebuilds.get(status=models.Job.QUEUED)
+        self.assertAlmostEqual(
+            (queued.run_at - job.updated_at).total_seconds(), tasks.rebuild_recommendations.every, delta=1,
+        )
+        self.assertGreater(queued.run_at, timezone.now())
+
+
+class PaginationTests(TestCase):
+    """ecom.pagination: keyset pages walked by signed cursors"""
+
+    def setUp(self):
+        # Several products share a price so pages split inside a run of ties
+        self.products = [
+            models.Product.objects.create(
+                name=f'P{i}', price=price, description='Cotton', quantity=5, size='M',
+                product_image='product_image/p.jpg',
+            )
+            for i, price in enumerate([300, 100, 200, 100, 100, 200, 100, 400])
+        ]
+        self.queryset = models.Product.objects.order_by('price')
+        self.expected = list(models.Product.objects.order_by('price', 'id'))
+
+    def walk_forward(self, per_page=3):
+        pages = [pagination.paginate(self.queryset, per_page=per_page)]
+        while pages[-1].has_next():
+            pages.append(pagination.paginate(self.queryset, pages[-1].next_cursor, per_page=per_page))
+        return pages
+
+    def test_forward_pages_cover_every_row_once_in_order(self):
+        pages = self.walk_forward()
+        self.assertEqual([len(page) for page in pages], [3, 3, 2])
+        self.assertEqual([product for page in pages for product in page], self.expected)
+
+    def test_first_and_last_page(self):
+        first, *_, last = self.walk_forward()
+        self.assertFalse(first.has_previous())
+        self.assertIsNone(first.previous_cursor)
+        self.assertTrue(first.has_next())
+        self.assertTrue(last.has_previous())
+        self.assertFalse(last.has_next())
+        self.assertIsNone(last.next_cursor)
+
+        single = pagination.paginate(self.queryset, per_page=len(self.expected))
+        self.assertFalse(single.has_other_pages())
+        self.assertEqual(list(single), self.expected)
+
+        empty = pagination.paginate(models.Product.objects.none().order_by('price'))
+        self.assertEqual((len(empty), empty.has_next(), empty.has_previous()), (0, False, False))
+
+    def test_backward_pages_retrace_the_forward_pages(self):
+        forward = self.walk_forward()
+        page = forward[-1]
+        backward = [page]
+        while page.has_previous():
+            page = pagination.paginate(self.queryset, page.previous_cursor, per_page=3)
+            backward.append(page)
+        self.assertEqual([list(page) for page in reversed(backward)], [list(page) for page in forward])
+        self.assertFalse(backward[-1].has_previous())
+        self.assertTrue(backward[-1].has_next())
+
+    def test_descending_order_with_ties(self):
+        queryset = models.Product.objects.order_by('-price')
+        pages = [pagination.paginate(queryset, per_page=3)]
+        while pages[-1].has_next():
+            pages.append(pagination.paginate(queryset, pages[-1].next_cursor, per_page=3))
+        self.assertEqual(
+            [product for page in pages for product in page], list(models.Product.objects.order_by('-price', 'id')),
+        )
+
+    def test_tampered_or_foreign_cursor_starts_from_the_first_page(self):
+        cursor = pagination.paginate(self.queryset, per_page=3).next_cursor
+        first = self.expected[:3]
+        for bad in [cursor[:-2] + ('A' if cursor[-2] != 'A' else 'B') + cursor[-1], 'garbage', cursor + 'x']:
+            page = pagination.paginate(self.queryset, bad, per_page=3)
+            self.assertEqual(list(page), first)
+            self.assertFalse(page.has_previous())
+
+        # A cursor made for one sort order means nothing in another
+        page = pagination.paginate(models.Product.objects.order_by('-price'), cursor, per_page=3)
+        self.assertEqual(list(page), list(models.Product.objects.order_by('-price', 'id')[:3]))
+
+        # Signed but not made by the paginator
+        forged = signing.dumps({'o': ['price', 'id'], 'v': [100]}, salt=pagination.CURSOR_SALT)
+        self.assertEqual(list(pagination.paginate(self.queryset, forged, per_page=3)), first)
+
+    def test_page_rows_follow_writes_between_requests(self):
+        first = pagination.paginate(self.queryset, per_page=3)
+        # A new cheapest product lands before the cursor and is not repeated or skipped past
+        models.Product.objects.create(
+            name='New', price=50, description='Cotton', quantity=5, size='M', product_image='product_image/p.jpg',
+        )
+        rest = pagination.paginate(self.queryset, first.next_cursor, per_page=10)
+        self.assertEqual(list(first) + list(rest), self.expected)
+
+    def test_search_api_walks_by_next_cursor(self):
+        for i in range(25):
+            models.Product.objects.create(
+                name=f'Extra {i}', price=150, description='Linen', quantity=5, size='M',
+                product_image='product_image/p.jpg',
+            )
+        seen, cursor = [], ''
+        while True:
+            data = self.client.get('/api/search/', {'cursor': cursor}).json()
+            seen += [product['id'] for product in data['products']]
+            if not data['has_more']:
+                self.assertIsNone(data['next_cursor'])
+                break
+            cursor = data['next_cursor']
+        self.assertEqual(seen, list(models.Product.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_page_query_drops_the_cursor(self):
+        params = QueryDict('size=M&size=L&cursor=abc&page=2&sort=price')
+        self.assertEqual(pagination.page_query(params), 'size=M&size=L&sort=price&')
+        self.assertEqual(pagination.page_query(QueryDict('cursor=abc')), '')
+
+
+class SearchTests(TestCase):
+    """ecom.search: the ranked full-text index, kept in step with products"""
+
+    def setUp(self):
+        if search.backend() != 'fts5':
+            self.skipTest('needs the SQLite FTS5 index')
+        self.hoodie = self.product('Zip Hoodie', 'Warm fleece for cold nights')
+        self.shirt = self.product('Team Shirt', 'Goes well under a hoodie')
+        self.cap = self.product('Cap', 'Keeps the sun off')
+
+    def product(self, name, description):
+        return models.Product.objects.create(
+            name=name, price=100, description=description, quantity=5, size='M', product_image='product_image/p.jpg',
+        )
+
+    def found(self, text, queryset=None):
+        return list(search.search_products(models.Product.objects.all() if queryset is None else queryset, text))
+
+    def test_name_matches_rank_above_description_matches(self):
+        self.assertEqual(search.ranked_ids('hoodie'), [self.hoodie.id, self.shirt.id])
+        results = self.found('hoodie')
+        self.assertEqual(results, [self.hoodie, self.shirt])
+        self.assertLess(results[0].search_rank, results[1].search_rank)
+
+    def test_words_match_as_prefixes_and_any_word_matches(self):
+        self.assertEqual(self.found('hood'), [self.hoodie, self.shirt])
+        self.assertEqual(set(self.found('cap fleece')), {self.cap, self.hoodie})
+        self.assertEqual(self.found('"cap" OR *'), [self.cap])
+        self.assertEqual(self.found('nothing'), [])
+
+    def test_narrows_the_given_queryset(self):
+        self.assertEqual(self.found('hoodie', models.Product.objects.exclude(id=self.hoodie.id)), [self.shirt])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.cap.name = 'Bucket Hat'
+        self.cap.save()
+        self.assertEqual(self.found('bucket'), [self.cap])
+        self.assertEqual(self.found('cap'), [])
+
+        self.shirt.delete()
+        self.assertEqual(self.found('hoodie'), [self.hoodie])
+
+        # Saves that leave name and description alone do not touch the index
+        with mock.patch.object(search, 'index_product') as index_product:
+            self.hoodie.save(update_fields=['price'])
+        self.assertFalse(index_product.called)
+
+    def test_rebuild_reindexes_every_product(self):
+        models.Product.objects.filter(id=self.cap.id).update(name='Visor')
+        self.assertEqual(self.found('visor'), [])
+        self.assertEqual(search.rebuild(), 3)
+        self.assertEqual(self.found('visor'), [self.cap])
+
+    def test_falls_back_to_icontains_without_an_index(self):
+        with mock.patch.object(search, 'backend', return_value=None):
+            self.assertEqual(set(self.found('HOODIE')), {self.hoodie, self.shirt})
+            self.assertEqual(search.ranked_ids('hoodie'), [])
+        self.assertEqual(set(self.found('  ')), {self.hoodie, self.shirt, self.cap})
+
+
+class PSGCCascadeTests(TestCase):
+    """The address cascade API: bundled levels served locally, the rest from upstream"""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.index = gazetteer.get_index()
+        if not self.index.has_level('province') or self.index.has_level('barangay'):
+            self.skipTest('expects the bundled data to cover provinces but not barangays')
+
+    def upstream(self, status, data=None):
+        response = requests.Response()
+        response.status_code = status
+        response._content = json.dumps(data or {}).encode()
+        return mock.patch.object(api_views, 'psgc_get', return_value=response)
+
+    def test_bundled_levels_are_served_locally(self):
+        region = self.index.places('region')[0]
+        with self.upstream(500) as psgc_get:
+            response = self.client.get('/api/regions/')
+            provinces = self.client.get('/api/provinces/', {'region_id': region['code']})
+            again = self.client.get('/api/regions/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertFalse(psgc_get.called)
+        self.assertEqual(response.json(), self.index.places('region'))
+        self.assertEqual(response['Cache-Control'], f'public, max-age={api_views.PSGC_CACHE_MAX_AGE}')
+        self.assertEqual(provinces.json(), self.index.places('province', 'region', region['code']))
+        self.assertEqual(again.status_code, 304)
+
+    def test_barangays_come_from_upstream_and_are_cached(self):
+        barangays = [{'code': '0128010001', 'name': 'Barangay 1'}]
+        with self.upstream(200, barangays) as psgc_get:
+            self.assertEqual(self.client.get('/api/barangays/', {'city_id': '0128010000'}).json(), barangays)
+            self.assertEqual(self.client.get('/api/barangays/', {'city_id': '0128010000'}).json(), barangays)
+        self.assertEqual(psgc_get.call_count, 1)
+
+    def test_unknown_code_is_not_cached(self):
+        with self.upstream(404) as psgc_get:
+            self.assertEqual(self.client.get('/api/barangays/', {'city_id': '012801000'}).status_code, 404)
+            self.assertEqual(self.client.get('/api/barangays/', {'city_id': '012801000'}).status_code, 404)
+        self.assertEqual(psgc_get.call_count, 2)
+
+    def test_upstream_outage_is_an_error(self):
+        with mock.patch.object(api_views, 'psgc_get', side_effect=upstream.CircuitOpenError('PSGC API')):
+            response = self.client.get('/api/barangays/', {'city_id': '0128010000'})
+        self.assertEqual(response.status_code, 500)
+
+
+class PlaceSuggestTests(SimpleTestCase):
+    """gazetteer.PSGCIndex.suggest: prefix matching and ranking"""
+
+    def setUp(self):
+        self.index = gazetteer.PSGCIndex()
+        self.index.add('region', {'regCode': '13', 'regDesc': 'NCR', 'psgcCode': '130000000'})
+        self.index.add('province', {'provCode': '1339', 'provDesc': 'Manila Bay', 'regCode': '13'})
+        for code, name in (('133901', 'City of Manila'), ('133902', 'San Juan'), ('133903', 'Dasmariñas')):
+            self.index.add('citymun', {'citymunCode': code, 'citymunDesc': name, 'provCode': '1339'})
+        self.index.add('barangay', {'brgyCode': '133901001', 'brgyDesc': 'Manila Heights', 'citymunCode': '133901'})
+        # More same-prefix barangays than any fixed scan window, sorting before the city
+        for n in range(300):
+            self.index.add('barangay', {'brgyCode': f'1339020{n:03}', 'brgyDesc': f'San Isidro {n}', 'citymunCode': '133902'})
+
+    def names(self, query, limit=10):
+        return [place['name'] for place in self.index.suggest(query, limit)]
+
+    def test_whole_names_rank_before_word_starts_then_by_level(self):
+        self.assertEqual(self.names('manila'), ['Manila Heights', 'Manila Bay', 'City of Manila'])
+
+    def test_common_prefix_still_finds_the_best_match(self):
+        self.assertEqual(self.names('san', limit=3), ['San Juan', 'San Isidro 0', 'San Isidro 1'])
+        self.assertEqual(self.names('san isidro 29', limit=2), ['San Isidro 29', 'San Isidro 290'])
+
+    def test_query_is_normalized_like_the_names(self):
+        self.assertEqual(self.names('  dasmarinas'), ['Dasmariñas'])
+        self.assertEqual(self.names('CITY  of'), ['City of Manila'])
+        self.assertEqual(self.names('!!'), [])
+
+    def test_places_carry_their_path(self):
+        heights = self.index.suggest('manila heights')[0]
+        self.assertEqual(heights['level'], 'barangay')
+        self.assertEqual(heights['label'], 'Manila Heights, City of Manila, Manila Bay, NCR')
+        self.assertEqual(heights['citymun']['name'], 'City of Manila')
+
+
+class SizeStockTests(TestCase):
+    """Per-size stock: variant rows, the product's own size, and adding sizes to the cart"""
+
+    def setUp(self):
+        self.shirt = models.Product.objects.create(
+            name='Shirt', price=100, description='Shirt', quantity=10, size='M', product_image='product_image/shirt.jpg',
+        )
+        models.ProductVariant.objects.create(product=self.shirt, size='S', quantity=4)
+        models.ProductVariant.objects.create(product=self.shirt, size='XL', quantity=0)
+
+    def test_own_size_keeps_what_the_variants_leave(self):
+        stock = models.ProductVariant.objects.stock_map([self.shirt.id])[self.shirt.id]
+        self.assertEqual(stock, {'S': 4, 'XS': 0, 'M': 6, 'L': 0, 'XL': 0})
+        self.assertEqual(sum(stock.values()), self.shirt.quantity)
+
+    def test_variant_never_exceeds_the_total(self):
+        models.Product.objects.filter(id=self.shirt.id).update(quantity=3)
+        stock = models.ProductVariant.objects.stock_map([self.shirt.id])[self.shirt.id]
+        self.assertEqual((stock['S'], stock['M']), (3, 0))
+
+    def test_in_stock_filter_matches_stock_map(self):
+        sold_out = models.Product.objects.create(
+            name='Cap', price=50, description='Cap', quantity=2, size='M', product_image='product_image/cap.jpg',
+        )
+        models.ProductVariant.objects.create(product=sold_out, size='M', quantity=0)
+        in_stock = models.ProductVariant.objects.in_stock(models.Product.objects.all())
+        self.assertEqual(list(in_stock), [self.shirt])
+        self.assertFalse(any(models.ProductVariant.objects.stock_map([sold_out.id])[sold_out.id].values()))
+
+    def test_available_stock_splits_sizes_and_subtracts_holds(self):
+        reservations.hold('session:other', self.shirt.id, 'M', 2)
+        free = reservations.available_stock([self.shirt.id], holder='session:me')
+        self.assertEqual(free[self.shirt.id, 'S'], 4)
+        self.assertEqual(free[self.shirt.id, 'M'], 4)
+        self.assertNotIn((self.shirt.id, 'L'), free)
+
+    def test_variant_size_can_be_added_to_cart(self):
+        response = self.client.post(f'/add-to-cart/{self.shirt.id}/', {'size': 'S', 'quantity': 2})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(cookie_cart(self.client), {(self.shirt.id, 'S'): 2})
+
+        response = self.client.post('/api/cart/items', {'product_id': self.shirt.id, 'size': 'S', 'quantity': 3})
+        self.assertEqual(response.status_code, 400)
+        # Its own 2 units do not count against the cart, but 5 is more than the 4 in size S
+        self.assertIn('only 4 pcs', response.json()['error'])
+
+    def test_unstocked_size_is_refused(self):
+        for size in ('L', 'XL'):
+            response = self.client.post('/api/cart/items', {'product_id': self.shirt.id, 'size': size})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('not available', response.json()['error'])
+        self.assertFalse(models.StockHold.objects.exists())
+
+    def test_inventory_copy_keeps_first_duplicate(self):
+        migration = importlib.import_module('ecom.migrations.0054_product_variants')
+        models.ProductVariant.objects.all().delete()
+        models.InventoryItem.objects.create(name='Shirt - L', quantity=7)
+        models.InventoryItem.objects.create(name='Shirt - L', quantity=1)
+        migration.copy_inventory_items(django_apps, None)
+        self.assertEqual(models.ProductVariant.objects.get(product=self.shirt, size='L').quantity, 7)
+
+
+class StockHoldTests(TestCase):
+    """ecom.reservations: holds against per-size and total stock, expiry, checkout and login"""
+
+    def setUp(self):
+        user = User.objects.create_user('buyer', password='pw')
+        self.customer = models.Customer.objects.create(
+            user=user, mobile='09170000000', region='NCR', postal_code='1000', street_address='1 Main St',
+        )
+        self.me = f'customer:{self.customer.id}'
+        # The variant rows add up to more than the 5 units the product has
+        self.shirt = models.Product.objects.create(
+            name='Shirt', price=100, description='Shirt', quantity=5, size='M', product_image='product_image/shirt.jpg',
+        )
+        models.ProductVariant.objects.create(product=self.shirt, size='S', quantity=4)
+        models.ProductVariant.objects.create(product=self.shirt, size='L', quantity=4)
+
+    def place(self, size, quantity):
+        quote = pricing.price_cart([SimpleNamespace(product=self.shirt, size=size, quantity=quantity)], delivery_fee=0)
+        return orders.place_order(self.customer, quote, holder=self.me)
+
+    def test_hold_takes_units_from_other_carts(self):
+        self.assertEqual(reservations.hold('session:other', self.shirt.id, 'S', 3), 4)
+        self.assertEqual(reservations.hold(self.me, self.shirt.id, 'S', 2), 1)
+        self.assertFalse(models.StockHold.objects.filter(holder=self.me).exists())
+        self.assertEqual(reservations.hold(self.me, self.shirt.id, 'S', 1), 1)
+
+    def test_holds_on_any_size_count_against_the_total(self):
+        reservations.hold('session:other', self.shirt.id, 'S', 4)
+        totals, free, variants = reservations.stock_levels([self.shirt.id], holder=self.me)
+        self.assertEqual(totals[self.shirt.id], 1)
+        self.assertEqual(free[self.shirt.id, 'L'], 1)
+        self.assertEqual(variants, {(self.shirt.id, 'S'), (self.shirt.id, 'L')})
+
+    def test_own_holds_on_other_sizes_share_the_total(self):
+        reservations.hold(self.me, self.shirt.id, 'S', 4)
+        self.assertEqual(reservations.hold(self.me, self.shirt.id, 'L', 2), 1)
+        # Replacing a line does not count the line against itself
+        self.assertEqual(reservations.hold(self.me, self.shirt.id, 'S', 5), 4)
+
+    def test_expired_holds_free_stock_and_are_swept(self):
+        reservations.hold('session:other', self.shirt.id, 'S', 4)
+        reservations.hold('session:gone', self.shirt.id, 'L', 1, ttl=-1)
+        self.assertEqual(reservations.stock_levels([self.shirt.id])[0][self.shirt.id], 1)
+        models.StockHold.objects.filter(holder='session:other').update(expires_at=timezone.now())
+        self.assertEqual(reservations.stock_levels([self.shirt.id])[0][self.shirt.id], 5)
+        self.assertEqual(reservations.expire_holds(), 2)
+        self.assertFalse(models.StockHold.objects.exists())
+
+    def test_checkout_respects_other_carts_holds(self):
+        reservations.hold('session:other', self.shirt.id, 'S', 3)
+        with self.assertRaises(orders.InsufficientStock) as raised:
+            self.place('L', 3)
+        self.assertEqual(raised.exception.available, 2)
+        self.place('L', 2)
+        self.assertEqual(models.Product.objects.get(id=self.shirt.id).quantity, 3)
+        self.assertTrue(models.StockHold.objects.filter(holder='session:other').exists())
+
+    def test_checkout_takes_own_holds_and_releases_them(self):
+        reservations.hold(self.me, self.shirt.id, 'S', 4)
+        reservations.hold(self.me, self.shirt.id, 'L', 1)
+        self.place('S', 4)
+        self.assertFalse(models.StockHold.objects.exists())
+        self.assertEqual(models.ProductVariant.objects.get(product=self.shirt, size='S').quantity, 0)
+
+    def test_transfer_adds_up_shared_lines(self):
+        reservations.hold(self.me, self.shirt.id, 'S', 1)
+        reservations.hold('session:visitor', self.shirt.id, 'S', 2)
+        reservations.hold('session:visitor', self.shirt.id, 'L', 1)
+        reservations.transfer('session:visitor', self.me)
+        self.assertEqual(
+            dict(models.StockHold.objects.values_list('size', 'quantity')), {'S': 3, 'L': 1},
+        )
+        self.assertFalse(models.StockHold.objects.exclude(holder=self.me).exists())
+
+    def test_login_moves_cart_and_holds_to_the_account(self):
+        models.CartItem.objects.create(customer=self.customer, product=self.shirt, size='S', quantity=1)
+        reservations.hold(self.me, self.shirt.id, 'S', 1)
+        self.client.post('/api/cart/items', {'product_id': self.shirt.id, 'size': 'S', 'quantity': 2})
+        self.client.post('/api/cart/items', {'product_id': self.shirt.id, 'size': 'L', 'quantity': 1})
+        self.assertEqual(models.StockHold.objects.exclude(holder=self.me).count(), 2)
+
+        response = self.client.post('/customerlogin', {'username': 'buyer', 'password': 'pw'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            dict(models.CartItem.objects.filter(customer=self.customer).values_list('size', 'quantity')),
+            {'S': 3, 'L': 1},
+        )
+        self.assertEqual(
+            dict(models.StockHold.objects.filter(holder=self.me).values_list('size', 'quantity')),
+            {'S': 3, 'L': 1},
+        )
+        self.assertEqual(models.StockHold.objects.count(), 2)
+        self.assertEqual(cookie_cart(self.client), {})
+
+
+class ProductCounterTests(TestCase):
+    """Rating and popularity columns kept on Product by ecom.signals"""
+
+    def setUp(self):
+        self.customer, self.other = [
+            models.Customer.objects.create(
+                user=User.objects.create_user(name, password='pw'),
+                mobile='09170000000', region='NCR', postal_code='1000', street_address='1 Main St',
+            )
+            for name in ('reviewer', 'other')
+        ]
+        self.shirt = self.product('Shirt')
+        self.hoodie = self.product('Hoodie')
+
+    def product(self, name):
+        return models.Product.objects.create(
+            name=name, price=100, description=name, quantity=10, size='M', product_image=f'product_image/{name}.jpg',
+        )
+
+    def counters(self, product, *fields):
+        return models.Product.objects.values_list(*fields).get(id=product.id)
+
+    def ratings(self, product):
+        return self.counters(product, 'rating_sum', 'rating_count', 'average_rating')
+
+    def popularity(self, product):
+        return self.counters(product, 'units_sold', 'order_count')
+
+    def test_reviews_update_the_rating(self):
+        first = models.ProductReview.objects.create(customer=self.customer, product=self.shirt, rating=5)
+        models.ProductReview.objects.create(customer=self.other, product=self.shirt, rating=2)
+        self.assertEqual(self.ratings(self.shirt), (7, 2, 3.5))
+
+        first.rating = 3
+        first.save()
+        self.assertEqual(self.ratings(self.shirt), (5, 2, 2.5))
+
+        first.product = self.hoodie
+        first.save()
+        self.assertEqual(self.ratings(self.shirt), (2, 1, 2.0))
+        self.assertEqual(self.ratings(self.hoodie), (3, 1, 3.0))
+
+        first.delete()
+        self.assertEqual(self.ratings(self.hoodie), (0, 0, 0.0))
+
+    def test_order_lines_update_popularity(self):
+        order = models.Orders.objects.create(status='Pending')
+        line = models.OrderItem.objects.create(order=order, product=self.shirt, quantity=2, price=100, size='M')
+        models.OrderItem.objects.create(order=order, product=self.hoodie, quantity=1, price=100, size='M')
+        self.assertEqual(self.popularity(self.shirt), (2, 1))
+
+        line.quantity = 3
+        line.save()
+        self.assertEqual(self.popularity(self.shirt), (3, 1))
+
+        line.delete()
+        self.assertEqual(self.popularity(self.shirt), (0, 0))
+        self.assertEqual(self.popularity(self.hoodie), (1, 1))
+
+    def test_cancelling_takes_the_order_back(self):
+        order = models.Orders.objects.create(status='Pending')
+        models.OrderItem.objects.create(order=order, product=self.shirt, quantity=2, price=100, size='M')
+        order.status = 'Cancelled'
+        order.save()
+        self.assertEqual(self.popularity(self.shirt), (0, 0))
+        # Lines of a cancelled order are not counted
+        line = models.OrderItem.objects.create(order=order, product=self.hoodie, quantity=1, price=100, size='M')
+        line.delete()
+        self.assertEqual(self.popularity(self.hoodie), (0, 0))
+
+        order.status = 'Pending'
+        order.save()
+        self.assertEqual(self.popularity(self.shirt), (2, 1))
+        order.delete()
+        self.assertEqual(self.popularity(self.shirt), (0, 0))
+
+    def test_product_form_keeps_counters_updated_since_it_loaded(self):
+        stale = models.Product.objects.get(id=self.shirt.id)
+        models.ProductReview.objects.create(customer=self.customer, product=self.shirt, rating=4)
+        form = forms.ProductForm(
+            {'name': 'Shirt', 'price': 120, 'description': 'Shirt', 'quantity': 10, 'size': 'M'},
+            instance=stale,
+        )
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        self.assertEqual(self.counters(self.shirt, 'price', 'rating_count'), (120, 1))
+
+    def test_deleted_product_can_be_saved_again(self):
+        self.shirt.delete()
+        self.shirt.save()
+        self.assertTrue(models.Product.objects.filter(id=self.shirt.id).exists())
+
+
+LOCMEM_CACHES = {
+    alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': f'test-{alias}'}
+    for alias in ('default', 'shared', 'local')
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class PageCacheTests(SimpleTestCase):
+    """ecom.page_cache: hits, misses, version bumps and stale-while-revalidate"""
+    databases = {'default'}
+
+    def setUp(self):
+        for alias in LOCMEM_CACHES:
+            caches[alias].clear()
+        self.params = page_cache.normalize(QueryDict('search=Shirt&sort=name'))
+        self.renders = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def render(self):
+        self.release.wait(5)
+        self.renders.append(time.time())
+        return f'<div>grid {len(self.renders)}</div>'
+
+    def get(self):
+        return page_cache.get_or_render(self.params, self.render)
+
+    def wait_for_renders(self, count):
+        deadline = time.time() + 5
+        while len(self.renders) < count and time.time() < deadline:
+            time.sleep(0.01)
+        # Let the refresh thread finish storing what it rendered
+        time.sleep(0.05)
+
+    def test_normalize_drops_noise(self):
+        self.assertEqual(
+            page_cache.normalize(QueryDict('utm_source=x&sort=name&search=%20 SHIRT%20')),
+            page_cache.normalize(QueryDict('search=shirt&sort=name')),
+        )
+        self.assertEqual(page_cache.normalize(QueryDict('sort=bogus')), [])
+
+    def test_miss_renders_once_then_hits(self):
+        self.assertEqual(self.get(), '<div>grid 1</div>')
+        self.assertEqual(self.get(), '<div>grid 1</div>')
+        self.assertEqual(len(self.renders), 1)
+
+    def test_version_is_read_from_the_local_copy(self):
+        self.get()
+        caches['shared'].set(page_cache.VERSION_KEY, 1, None)
+        # Another process bumped the shared version; this one notices after CATALOG_SHARED_REFRESH
+        self.assertNotEqual(page_cache.version(), 1)
+        caches['local'].delete(page_cache.VERSION_KEY)
+        self.assertEqual(page_cache.version(), 1)
+
+    def test_bump_serves_stale_copy_while_one_thread_rebuilds(self):
+        self.get()
+        page_cache.bump()
+        self.release.clear()
+        self.assertEqual(self.get(), '<div>grid 1</div>')
+        self.assertEqual(self.get(), '<div>grid 1</div>')
+        self.release.set()
+        self.wait_for_renders(2)
+        self.assertEqual(len(self.renders), 2)
+        self.assertEqual(self.get(), '<div>grid 2</div>')
+
+    def test_entry_past_stale_window_renders_inline(self):
+        self.get()
+        later = time.time() + page_cache.CATALOG_PAGE_TTL + page_cache.CATALOG_PAGE_STALE + 1
+        with mock.patch.object(page_cache.time, 'time', return_value=later):
+            self.assertEqual(self.get(), '<div>grid 2</div>')
+
+    def test_no_free_refresh_thread_keeps_stale_copy(self):
+        self.get()
+        page_cache.bump()
+        with mock.patch.object(page_cache, '_start_refresh', return_value=False) as start:
+            self.assertEqual(self.get(), '<div>grid 1</div>')
+            self.assertEqual(self.get(), '<div>grid 1</div>')
+        # The refresh flag was given back, so every request tried again
+        self.assertEqual(start.call_count, 2)
+        self.assertEqual(len(self.renders), 1)
+
+    def test_summary_is_shared_and_dropped_on_change(self):
+        with mock.patch.object(catalog, 'compute', side_effect=[{'total': 1}, {'total': 2}]):
+            self.assertEqual(catalog.summary(), {'total': 1})
+            caches['local'].clear()
+            self.assertEqual(catalog.summary(), {'total': 1})
+            catalog.invalidate()
+            self.assertEqual(catalog.summary(), {'total': 2})
@@ -0,0 +1,106 @@
+"""
+Guarded access to the PSGC API (psgc.gitlab.io).
+
+Every upstream call goes through one per-process circuit breaker: after a run
+of failures the circuit opens and calls fail immediately with
+:class:`CircuitOpenError`, so an outage costs callers nothing instead of a
+timeout per place. Once ``reset_timeout`` has passed a single probe call is let
+through (half-open); its outcome closes or re-opens the circuit.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+from . import http_client
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream that is known to be failing"""
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def before_call(self):
+        """Raise :class:`CircuitOpenError` unless a call may go through now"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                # Let exactly one probe through; everyone else keeps failing fast
+                self._state = self.HALF_OPEN
+                return
+            raise CircuitOpenError(f"{self.name} circuit is open")
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def reset(self):
+        self.record_success()
+
+    def call(self, func, *args, **kwargs):
+        """Run ``func`` through the breaker; any exception counts as a failure"""
+        self.before_call()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+
+psgc_breaker = CircuitBreaker(
+    'PSGC API',
+    failure_threshold=getattr(settings, 'PSGC_CIRCUIT_FAILURES', 5),
+    reset_timeout=getattr(settings, 'PSGC_CIRCUIT_RESET_TIMEOUT', 30),
+)
+
+
+def _get(url, timeout):
+    # No retries underneath the breaker: one slow call costs one timeout and counts as one failure
+    response = http_client.get(url, timeout=timeout, retries=0)
+    # A 404 is an answer (unknown code), not an outage
+    if response.status_code >= 500:
+        response.raise_for_status()
+    return response
+
+
+def psgc_get(path):
+    """
+    GET ``path`` from the PSGC API through the circuit breaker.
+
+    Returns the ``requests`` response; raises :class:`CircuitOpenError` while
+    the API is considered down and ``requests.RequestException`` on failure.
+    """
+    base_url = getattr(settings, 'PSGC_API_BASE_URL', 'https://psgc.gitlab.io/api')
+    timeout = getattr(settings, 'PSGC_API_TIMEOUT', 5)
+    return psgc_breaker.call(_get, f"{base_url}/{path.lstrip('/')}", timeout)
@@ -1,233 +1,158 @@
-import requests
-import json
-import os
+import logging
+
 from django.core.cache import cache
-from django.conf import settings
-
-def load_local_psgc_data():
-    """Load local PSGC data as fallback"""
-    try:
-        static_dir = getattr(settings, 'STATIC_ROOT', None) or os.path.join(settings.BASE_DIR, 'staticfiles')
-        
-        # Load regions
-        regions_file = os.path.join(static_dir, 'ecom', 'refregion.json')
-        if os.path.exists(regions_file):
-            with open(regions_file, 'r', encoding='utf-8') as f:
-                regions_data = json.load(f)
-        else:
-            regions_data = []
-            
-        # Load provinces
-        provinces_file = os.path.join(static_dir, 'ecom', 'refprovince.json')
-        if os.path.exists(provinces_file):
-            with open(provinces_file, 'r', encoding='utf-8') as f:
-                provinces_data = json.load(f)
-        else:
-            provinces_data = []
-            
-        # Load cities/municipalities
-        citymun_file = os.path.join(static_dir, 'ecom', 'refcitymun.json')
-        if os.path.exists(citymun_file):
-            with open(citymun_file, 'r', encoding='utf-8') as f:
-                citymun_data = json.load(f)
+
+from . import gazetteer, psgc_table
+from .http_client import fan_out
+from .upstream import CircuitOpenError, psgc_get
+
+logger = logging.getLogger(__name__)
+
+# level -> (PSGC API collection, label used for placeholders)
+PSGC_LEVELS = {
+    'region': ('regions', 'Region'),
+    'province': ('provinces', 'Province'),
+    'citymun': ('cities-municipalities', 'City/Municipality'),
+    'barangay': ('barangays', 'Barangay'),
+}
+
+PSGC_NAME_CACHE_TIMEOUT = 3600
+# Codes the API could not resolve are remembered briefly so each render
+# does not ask again
+PSGC_NEGATIVE_CACHE_TIMEOUT = 300
+
+def fetch_psgc_name(level, code):
+    """Fetch a single place name from the PSGC API, or None if it does not know the code"""
+    collection, _ = PSGC_LEVELS[level]
+    response = psgc_get(f"{collection}/{code}")
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    data = response.json()
+
+    if isinstance(data, dict) and 'name' in data:
+        return data['name']
+    if isinstance(data, list) and len(data) > 0 and 'name' in data[0]:
+        return data[0]['name']
+    return None
+
+def local_psgc_name(level, code):
+    """Name from the bundled PSGC data: the shared mmap table when built, else the in-process index"""
+    table = psgc_table.get_table()
+    if table is not None:
+        return table.lookup(level, code)
+    return gazetteer.lookup(level, code)
+
+def resolve_psgc_names(pairs):
+    """
+    Resolve many ``(level, code)`` pairs in one pass.
+
+    Codes found in the bundled data cost nothing. The rest are read with a single
+    ``cache.get_many``, misses are fetched from the PSGC API concurrently, and the results are
+    written back with ``cache.set_many``; codes the API could not resolve are
+    cached as ``''`` for a short while. While the API circuit is open no fetch is
+    attempted. Returns ``{(level, code): name}``.
+    """
+    names = {}
+    pending = {}
+    for level, code in set(pairs):
+        _, label = PSGC_LEVELS[level]
+        if not code:
+            names[(level, code)] = f"Unknown {label}"
+            continue
+        name = local_psgc_name(level, code)
+        if name:
+            names[(level, code)] = name
+        elif not str(code).strip().isdigit():
+            # Older rows store the resolved name instead of the code
+            names[(level, code)] = code
         else:
-            citymun_data = []
-            
-        # Load barangays
-        barangay_file = os.path.join(static_dir, 'ecom', 'refbrgy.json')
-        if os.path.exists(barangay_file):
-            with open(barangay_file, 'r', encoding='utf-8') as f:
-                barangay_data = json.load(f)
+            pending[f"{level}_{code}"] = (level, code)
+
+    if pending:
+        cached = cache.get_many(list(pending))
+        misses = [cache_key for cache_key in pending if cache_key not in cached]
+        # Fetch the misses in parallel over the shared connection pool
+        results = dict(zip(misses, fan_out(lambda key: fetch_psgc_name(*pending[key]), misses)))
+        fetched = {}
+        missing = {}
+        for cache_key, (level, code) in pending.items():
+            name = cached.get(cache_key)
+            if cache_key in results:
+                name = results[cache_key]
+                if isinstance(name, CircuitOpenError):
+                    name = None
+                elif isinstance(name, Exception):
+                    logger.warning("PSGC API error for %s %s: %s", level, code, name)
+                    name = None
+                    missing[cache_key] = ''
+                elif name:
+                    fetched[cache_key] = name
+                else:
+                    missing[cache_key] = ''
+            _, label = PSGC_LEVELS[level]
+            names[(level, code)] = name or f"{label} {code}"
+        if fetched:
+            cache.set_many(fetched, PSGC_NAME_CACHE_TIMEOUT)
+        if missing:
+            cache.set_many(missing, PSGC_NEGATIVE_CACHE_TIMEOUT)
+
+    return names
+
+def resolve_psgc_name(level, code):
+    """Resolve a single PSGC code to its name"""
+    return resolve_psgc_names([(level, code)])[(level, code)]
+
+def resolve_addresses(addresses, missing_only=False):
+    """
+    Resolve the PSGC codes of many addresses at once.
+
+    ``addresses`` may hold Customer/SavedAddress/Orders instances, whose name columns
+    are filled in memory (the caller saves them), or dicts of codes, which get
+    ``region_name``, ``province_name``, ... keys. With ``missing_only``,
+    instances that already have names are left alone: list pages pass it so
+    rows not yet backfilled cost one pass for the page instead of lookups per
+    row. Returns all the addresses as a list.
+    """
+    addresses = list(addresses)
+    pending = [
+        address for address in addresses
+        if not (missing_only and not isinstance(address, dict) and address.formatted_address)
+    ]
+
+    def code_of(address, level):
+        if isinstance(address, dict):
+            return address.get(level)
+        return getattr(address, level, None)
+
+    names = resolve_psgc_names(
+        (level, code_of(address, level))
+        for address in pending
+        for level in PSGC_LEVELS
+        if code_of(address, level)
+    )
+
+    for address in pending:
+        if isinstance(address, dict):
+            for level in PSGC_LEVELS:
+                code = code_of(address, level)
+                address[f"{level}_name"] = names[(level, code)] if code else code
         else:
-            barangay_data = []
-            
-        return {
-            'regions': regions_data,
-            'provinces': provinces_data,
-            'citymun': citymun_data,
-            'barangays': barangay_data
-        }
-    except Exception as e:
-        print(f"Error loading local PSGC data: {e}")
-        return {
-            'regions': [],
-            'provinces': [],
-            'citymun': [],
-            'barangays': []
-        }
+            address.resolve_address_names(names)
+    return addresses
 
 def get_region_name(region_code):
-    """Get region name from PSGC API or local data"""
-    if not region_code:
-        return "Unknown Region"
-        
-    # Check cache first
-    cache_key = f"region_{region_code}"
-    cached_name = cache.get(cache_key)
-    if cached_name:
-        return cached_name
-    
-    try:
-        # Try API first
-        base_url = getattr(settings, 'PSGC_API_BASE_URL', 'https://psgc.gitlab.io/api')
-        url = f"{base_url}/regions/{region_code}"
-        response = requests.get(url, timeout=5)
-        response.raise_for_status()
-        data = response.json()
-        
-        name = None
-        if isinstance(data, dict) and 'name' in data:
-            name = data['name']
-        elif isinstance(data, list) and len(data) > 0 and 'name' in data[0]:
-            name = data[0]['name']
-            
-        if name:
-            cache.set(cache_key, name, 3600)  # Cache for 1 hour
-            return name
-    except Exception as e:
-        print(f"API error for region {region_code}: {e}")
-    
-    # Fallback to local data
-    try:
-        local_data = load_local_psgc_data()
-        for region in local_data['regions']:
-            if str(region.get('regCode')) == str(region_code):
-                name = region.get('regDesc', f"Region {region_code}")
-                cache.set(cache_key, name, 3600)
-                return name
-    except Exception as e:
-        print(f"Local data error for region {region_code}: {e}")
-    
-    return f"Region {region_code}"
+    """Get region name from local PSGC data or the PSGC API"""
+    return resolve_psgc_name('region', region_code)
 
 def get_province_name(province_code):
-    """Get province name from PSGC API or local data"""
-    if not province_code:
-        return "Unknown Province"
-        
-    # Check cache first
-    cache_key = f"province_{province_code}"
-    cached_name = cache.get(cache_key)
-    if cached_name:
-        return cached_name
-    
-    try:
-        # Try API first
-        base_url = getattr(settings, 'PSGC_API_BASE_URL', 'https://psgc.gitlab.io/api')
-        url = f"{base_url}/provinces/{province_code}"
-        response = requests.get(url, timeout=5)
-        response.raise_for_status()
-        data = response.json()
-        
-        name = None
-        if isinstance(data, dict) and 'name' in data:
-            name = data['name']
-        elif isinstance(data, list) and len(data) > 0 and 'name' in data[0]:
-            name = data[0]['name']
-            
-        if name:
-            cache.set(cache_key, name, 3600)
-            return name
-    except Exception as e:
-        print(f"API error for province {province_code}: {e}")
-    
-    # Fallback to local data
-    try:
-        local_data = load_local_psgc_data()
-        for province in local_data['provinces']:
-            if str(province.get('provCode')) == str(province_code):
-                name = province.get('provDesc', f"Province {province_code}")
-                cache.set(cache_key, name, 3600)
-                return name
-    except Exception as e:
-        print(f"Local data error for province {province_code}: {e}")
-    
-    return f"Province {province_code}"
+    """Get province name from local PSGC data or the PSGC API"""
+    return resolve_psgc_name('province', province_code)
 
 def get_citymun_name(citymun_code):
-    """Get city/municipality name from PSGC API or local data"""
-    if not citymun_code:
-        return "Unknown City/Municipality"
-        
-    # Check cache first
-    cache_key = f"citymun_{citymun_code}"
-    cached_name = cache.get(cache_key)
-    if cached_name:
-        return cached_name
-    
-    try:
-        # Try API first
-        base_url = getattr(settings, 'PSGC_API_BASE_URL', 'https://psgc.gitlab.io/api')
-        url = f"{base_url}/cities-municipalities/{citymun_code}"
-        response = requests.get(url, timeout=5)
-        response.raise_for_status()
-        data = response.json()
-        
-        name = None
-        if isinstance(data, dict) and 'name' in data:
-            name = data['name']
-        elif isinstance(data, list) and len(data) > 0 and 'name' in data[0]:
-            name = data[0]['name']
-            
-        if name:
-            cache.set(cache_key, name, 3600)
-            return name
-    except Exception as e:
-        print(f"API error for citymun {citymun_code}: {e}")
-    
-    # Fallback to local data
-    try:
-        local_data = load_local_psgc_data()
-        for citymun in local_data['citymun']:
-            if str(citymun.get('citymunCode')) == str(citymun_code):
-                name = citymun.get('citymunDesc', f"City/Municipality {citymun_code}")
-                cache.set(cache_key, name, 3600)
-                return name
-    except Exception as e:
-        print(f"Local data error for citymun {citymun_code}: {e}")
-    
-    return f"City/Municipality {citymun_code}"
+    """Get city/municipality name from local PSGC data or the PSGC API"""
+    return resolve_psgc_name('citymun', citymun_code)
 
 def get_barangay_name(barangay_code):
-    """Get barangay name from PSGC API or local data"""
-    if not barangay_code:
-        return "Unknown Barangay"
-        
-    # Check cache first
-    cache_key = f"barangay_{barangay_code}"
-    cached_name = cache.get(cache_key)
-    if cached_name:
-        return cached_name
-    
-    try:
-        # Try API first
-        base_url = getattr(settings, 'PSGC_API_BASE_URL', 'https://psgc.gitlab.io/api')
-        url = f"{base_url}/barangays/{barangay_code}"
-        response = requests.get(url, timeout=5)
-        response.raise_for_status()
-        data = response.json()
-        
-        name = None
-        if isinstance(data, dict) and 'name' in data:
-            name = data['name']
-        elif isinstance(data, list) and len(data) > 0 and 'name' in data[0]:
-            name = data[0]['name']
-            
-        if name:
-            cache.set(cache_key, name, 3600)
-            return name
-    except Exception as e:
-        print(f"API error for barangay {barangay_code}: {e}")
-    
-    # Fallback to local data
-    try:
-        local_data = load_local_psgc_data()
-        for barangay in local_data['barangays']:
-            if str(barangay.get('brgyCode')) == str(barangay_code):
-                name = barangay.get('brgyDesc', f"Barangay {barangay_code}")
-                cache.set(cache_key, name, 3600)
-                return name
-    except Exception as e:
-        print(f"Local data error for barangay {barangay_code}: {e}")
-    
-    return f"Barangay {barangay_code}"
+    """Get barangay name from local PSGC data or the PSGC API"""
+    return resolve_psgc_name('barangay', barangay_code)
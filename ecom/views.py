@@ -1,25 +1,30 @@
 from django.shortcuts import render,redirect,reverse,get_object_or_404
-import decimal
 from . import forms,models
-from django.http import HttpResponseRedirect,HttpResponse, JsonResponse
-from django.core.mail import send_mail
+from django.http import HttpResponseRedirect,HttpResponse, JsonResponse, QueryDict
 from django.contrib.auth.models import Group
 from django.contrib.auth.decorators import login_required,user_passes_test
 from django.contrib import messages
 from django.contrib.auth import authenticate, login
 from django.conf import settings
 from django.utils import timezone
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils.http import url_has_allowed_host_and_scheme, urlencode
 from .models import Customer, SavedAddress
 from django.urls import reverse
 from .forms import InventoryForm
 from .forms import CustomerLoginForm
 from .models import Product
-from .models import InventoryItem
 from .models import Orders
+from .cart import get_cart
+from . import catalog, page_cache, pagination, popularity, pricing, reservations, search
+from . import orders as order_service
 from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from . import http_client, jobs, tasks
 import requests
 import json
 import base64
+import uuid
 from django.core.files.base import ContentFile
 from django.http import HttpResponse
 from django.http import JsonResponse
@@ -27,7 +32,6 @@ from django.shortcuts import redirect
 from django.views.decorators.http import require_GET
 from django.core.serializers.json import DjangoJSONEncoder
 from datetime import datetime
-from decimal import Decimal
 
 @login_required(login_url='adminlogin')
 def user_profile_page(request, user_id):
@@ -121,40 +125,19 @@ def order_counts(request):
     return {}
 
 
-def home_view(request):
+def render_catalog_grid(params):
+    """The anonymous product grid for a normalized query (see ecom.page_cache)"""
     products = models.Product.objects.all()
     
-    # Cart count logic
-    if 'product_ids' in request.COOKIES:
-        product_ids = request.COOKIES['product_ids']
-        counter = product_ids.split('|')
-        product_count_in_cart = len(set(counter))
-    else:
-        product_count_in_cart = 0
-    
-    # If user is authenticated, redirect to appropriate dashboard
-    if request.user.is_authenticated:
-        return HttpResponseRedirect('afterlogin')
-    
     # Enhanced search functionality
-    search_query = request.GET.get('search')
+    search_query = params.get('search')
     if search_query:
-        from django.db.models import Q
-        # Split search query into words for better matching
-        search_words = search_query.split()
-        query = Q()
-        
-        for word in search_words:
-            query |= (
-                Q(name__icontains=word) | 
-                Q(description__icontains=word)
-            )
-        
-        products = products.filter(query).distinct()
+        # Ranked full-text match on name and description
+        products = search.search_products(products, search_query)
     
     # Price range filter
-    min_price = request.GET.get('min_price')
-    max_price = request.GET.get('max_price')
+    min_price = params.get('min_price')
+    max_price = params.get('max_price')
     if min_price:
         try:
             products = products.filter(price__gte=float(min_price))
@@ -167,21 +150,12 @@ def home_view(request):
             pass
     
     # Availability filter
-    in_stock_only = request.GET.get('in_stock')
+    in_stock_only = params.get('in_stock')
     if in_stock_only:
-        # Get products that have inventory items with quantity > 0
-        available_products = models.InventoryItem.objects.filter(quantity__gt=0).values_list('product_id', flat=True)
-        products = products.filter(id__in=available_products)
-    
-    # Add product ratings and review counts
-    from django.db.models import Avg, Count
-    products = products.annotate(
-        average_rating=Avg('productreview__rating'),
-        review_count=Count('productreview', distinct=True)
-    )
+        products = models.ProductVariant.objects.in_stock(products)
     
     # Sort functionality
-    sort_by = request.GET.get('sort')
+    sort_by = params.get('sort')
     if sort_by == 'price_low':
         products = products.order_by('price')
     elif sort_by == 'price_high':
@@ -191,36 +165,46 @@ def home_view(request):
     elif sort_by == 'newest':
         products = products.order_by('-id')
     elif sort_by == 'popular':
-        # Sort by number of orders (most popular first)
-        products = products.annotate(
-            order_count=Count('orderitem')
-        ).order_by('-order_count')
+        # Most ordered first; a stored, indexed column that skips cancelled orders
+        products = products.order_by('-order_count', '-units_sold', 'id')
     elif sort_by == 'rating':
-        # Sort by highest rating first
-        products = products.order_by('-average_rating')
+        # Sort by highest rating first; a stored, indexed column
+        products = products.order_by('-average_rating', '-rating_count', 'id')
     
-    # Pagination
-    from django.core.paginator import Paginator
-    paginator = Paginator(products, 12)  # Show 12 products per page
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    
-    # Get price range for filters
-    from django.db.models import Min, Max
-    price_range = models.Product.objects.aggregate(
-        min_price=Min('price'),
-        max_price=Max('price')
-    )
+    # Pagination: the 12 products after the cursor by sort key and id, with
+    # no COUNT or OFFSET; the total is only counted (and cached) if shown
+    page_obj = pagination.paginate(products, params.get('cursor'), per_page=12)
     
     context = {
         'products': page_obj,
-        'search_query': search_query,
-        'min_price': min_price,
-        'max_price': max_price,
-        'sort_by': sort_by,
-        'in_stock_only': in_stock_only,
-        'price_range': price_range,
-        'total_products': paginator.count,
+        'page_query': pagination.page_query(params),
+    }
+    return render_to_string('ecom/catalog_grid.html', context)
+
+def home_view(request):
+    # Cart count logic
+    product_count_in_cart = get_cart(request).count()
+    
+    # If user is authenticated, redirect to appropriate dashboard
+    if request.user.is_authenticated:
+        return HttpResponseRedirect('afterlogin')
+    
+    # Every visitor asking for the same filters shares one cached grid
+    params = QueryDict(urlencode(page_cache.normalize(request.GET)))
+    catalog_grid = page_cache.get_or_render(params, lambda: render_catalog_grid(params))
+    
+    # Price range and facet counts for the filters, cached between catalog changes
+    catalog_summary = catalog.summary()
+    
+    context = {
+        'catalog_grid': catalog_grid,
+        'search_query': params.get('search'),
+        'min_price': params.get('min_price'),
+        'max_price': params.get('max_price'),
+        'sort_by': params.get('sort'),
+        'in_stock_only': params.get('in_stock'),
+        'price_range': catalog_summary['price_range'],
+        'catalog_summary': catalog_summary,
         'product_count_in_cart': product_count_in_cart,
     }
     
@@ -228,7 +212,7 @@ def home_view(request):
 
 @login_required(login_url='adminlogin')
 def manage_inventory(request):
-    inventory_items = InventoryItem.objects.all()
+    inventory_items = models.ProductVariant.objects.select_related('product').order_by('product__name', 'size')
     if request.method == "POST":
         form = InventoryForm(request.POST)
         if form.is_valid():
@@ -239,8 +223,9 @@ def manage_inventory(request):
 
     return render(request, 'ecom/manage_inventory.html', {'form': form, 'inventory_items': inventory_items})
 
+@login_required(login_url='adminlogin')
 def update_stock(request, item_id):
-    item = get_object_or_404(InventoryItem, id=item_id)
+    item = get_object_or_404(models.ProductVariant, id=item_id)
     if request.method == "POST":
         form = InventoryForm(request.POST, instance=item)
         if form.is_valid():
@@ -286,15 +271,9 @@ def customer_signup_view(request):
             customer.save()
             my_customer_group = Group.objects.get_or_create(name='CUSTOMER')
             my_customer_group[0].user_set.add(user)
-            login(request, user)  # Log the user in after registration
-            # Clear cart cookies after registration
-            response = redirect('customer-home')
-            response.delete_cookie('product_ids')
-            # Remove all product_*_details cookies
-            for key in request.COOKIES.keys():
-                if key.startswith('product_') and key.endswith('_details'):
-                    response.delete_cookie(key)
-            return response
+            # Logging in moves the guest cart into the new account
+            login(request, user)
+            return redirect('customer-home')
         else:
             # Show errors in the template
             mydict = {'userForm': userForm, 'customerForm': customerForm}
@@ -308,14 +287,9 @@ def customer_login(request):
       password = form.cleaned_data['password']
       user = authenticate(request, username=username, password=password)
       if user is not None:
+        # Logging in moves the guest cart into the account
         login(request, user)
-        # Clear cart cookies after login
-        response = redirect('home')
-        response.delete_cookie('product_ids')
-        for key in request.COOKIES.keys():
-            if key.startswith('product_') and key.endswith('_details'):
-                response.delete_cookie(key)
-        return response
+        return redirect('home')
       else:
         form.add_error(None, 'Account not found, please register')
   else:
@@ -387,7 +361,7 @@ def admin_dashboard_view(request):
     pending_ordercount = models.Orders.objects.filter(status='Pending').count()
 
     # Prepare users data for Users section
-    customers = models.Customer.objects.select_related('user').all()
+    customers = utils.resolve_addresses(models.Customer.objects.select_related('user').all(), missing_only=True)
     users = []
     for c in customers:
         users.append({
@@ -509,10 +483,9 @@ def admin_view_users(request):
     import csv
     from django.http import HttpResponse
 
-    customers = models.Customer.objects.select_related('user').all()
+    customers = utils.resolve_addresses(models.Customer.objects.select_related('user').all(), missing_only=True)
     users = []
     for c in customers:
-        print(f"DEBUG: Customer ID: {c.id}, User ID: {c.user.id if c.user else 'None'}, Name: {c.user.first_name if c.user else 'N/A'} {c.user.last_name if c.user else ''}")
         users.append({
             'id': c.id,
             'user_id': c.user.id if c.user else None,
@@ -700,11 +673,14 @@ def update_product_view(request, pk):
                     existing_product.quantity = productForm.cleaned_data.get('quantity')
                     if 'product_image' in request.FILES:
                         existing_product.product_image = request.FILES['product_image']
-                    existing_product.save()
+                    existing_product.save(update_fields=['description', 'price', 'quantity', 'product_image'])
                 except models.Product.DoesNotExist:
                     # Create new product with new size
                     new_product = productForm.save(commit=False)
                     new_product.id = None  # Ensure new object
+                    # Ratings and sales stay with the product they belong to
+                    for name in models.Product.DERIVED_FIELDS:
+                        setattr(new_product, name, models.Product._meta.get_field(name).get_default())
                     new_product.save()
             else:
                 # Size same, update current product
@@ -797,7 +773,9 @@ def admin_view_cancelled_orders(request):
 
 def prepare_admin_order_view(request, orders, status, template, extra_context=None):
     # Order the orders by created_at descending to show new orders first
-    orders = orders.order_by('-created_at')
+    orders = list(orders.order_by('-created_at').select_related('customer__user'))
+    # Customers not yet backfilled are resolved for the whole page at once
+    utils.resolve_addresses((order.customer for order in orders if order.customer), missing_only=True)
     
     # Prepare a list of orders with their customer, shipping address, and order items
     orders_data = []
@@ -907,22 +885,6 @@ def update_order_view(request,pk):
                     elif updated_order.status == 'Out for Delivery':
                         updated_order.estimated_delivery_date = timezone.now().date() + timezone.timedelta(days=1)
                 
-                # Reduce inventory when order is marked as delivered
-                if updated_order.status == 'Delivered':
-                    order_items = updated_order.orderitem_set.all()
-                    for order_item in order_items:
-                        try:
-                            inventory_item = models.InventoryItem.objects.get(product=order_item.product)
-                            if inventory_item.quantity >= order_item.quantity:
-                                inventory_item.quantity -= order_item.quantity
-                                inventory_item.save()
-                                messages.success(request, f'Inventory updated: {inventory_item.product.name} quantity reduced by {order_item.quantity}')
-                            else:
-                                messages.error(request, f'Insufficient inventory for {inventory_item.product.name}')
-                                return render(request, 'ecom/update_order.html', {'orderForm': orderForm, 'order': order})
-                        except models.InventoryItem.DoesNotExist:
-                            messages.warning(request, f'No inventory item found for {order_item.product.name}')
-            
             updated_order.save()
             messages.success(request, f'Order status updated to {updated_order.get_status_display()}')
             return redirect('admin-view-booking')
@@ -937,7 +899,7 @@ def update_order_view(request,pk):
 
 @login_required(login_url='adminlogin')
 def delete_inventory(request, item_id):
-    item = get_object_or_404(InventoryItem, id=item_id)
+    item = get_object_or_404(models.ProductVariant, id=item_id)
     item.delete()
     return redirect('manage-inventory')
 
@@ -960,47 +922,15 @@ def bulk_update_orders(request):
             elif new_status == 'Out for Delivery':
                 delivery_date = current_time.date() + timezone.timedelta(days=1)
             
-            # If marking as delivered, check and update inventory first
-            if new_status == 'Delivered':
-                inventory_updates = {}
-                
-                # First pass: Calculate total quantities needed for each product
-                for order in orders:
-                    order_items = order.orderitem_set.all()
-                    for order_item in order_items:
-                        product = order_item.product
-                        if product is None:
-                            continue
-                        if product.id in inventory_updates:
-                            inventory_updates[product.id]['quantity_needed'] += order_item.quantity
-                        else:
-                            inventory_updates[product.id] = {
-                                'quantity_needed': order_item.quantity,
-                                'orders': [],
-                                'product': product
-                            }
-                        inventory_updates[product.id]['orders'].append(order)
-                
-                # Second pass: Check inventory availability
-                for product_id, update_info in inventory_updates.items():
-                    try:
-                        inventory_item = models.InventoryItem.objects.get(product=update_info['product'])
-                        if inventory_item.quantity >= update_info['quantity_needed']:
-                            inventory_item.quantity -= update_info['quantity_needed']
-                            inventory_item.save()
-                            messages.success(request, f'Inventory updated: {update_info["product"].name} quantity reduced by {update_info["quantity_needed"]}')
-                        else:
-                            messages.error(request, f'Insufficient inventory for {update_info["product"].name}')
-                            return redirect('admin-view-booking')
-                    except models.InventoryItem.DoesNotExist:
-                        messages.warning(request, f'No inventory item found for {update_info["product"].name}')
-            
-            # Update all selected orders
-            orders.update(
-                status=new_status,
-                status_updated_at=current_time,
-                estimated_delivery_date=delivery_date
-            )
+            # Update all selected orders, moving their lines into or out of
+            # the products' popularity counters in the same transaction
+            with transaction.atomic():
+                popularity.move_orders(orders, new_status)
+                orders.update(
+                    status=new_status,
+                    status_updated_at=current_time,
+                    estimated_delivery_date=delivery_date
+                )
             
             messages.success(request, f'Successfully updated {len(order_ids)} orders to {new_status}')
         else:
@@ -1010,7 +940,7 @@ def bulk_update_orders(request):
 
 @login_required(login_url='adminlogin')
 def edit_inventory(request, item_id):
-    item = get_object_or_404(InventoryItem, id=item_id)
+    item = get_object_or_404(models.ProductVariant, id=item_id)
     
     if request.method == "POST":
         form = InventoryForm(request.POST, instance=item)
@@ -1034,49 +964,35 @@ def view_feedback_view(request):
 #---------------------------------------------------------------------------------
 #------------------------ PUBLIC CUSTOMER RELATED VIEWS START ---------------------
 #---------------------------------------------------------------------------------
+def order_status_rows(orders):
+    """Orders with their items and priced totals; all items load in one query"""
+    orders = orders.prefetch_related(
+        Prefetch('orderitem_set', queryset=models.OrderItem.objects.select_related('product'))
+    )
+    rows = []
+    for order in orders:
+        quote = pricing.price_cart(order.orderitem_set.all(), delivery_fee=order.delivery_fee)
+        rows.append({
+            'order': order,
+            'products': quote.lines,
+            'total': quote.subtotal,
+            'net_subtotal': quote.net_subtotal,
+            'vat_amount': quote.vat_amount,
+            'delivery_fee': quote.delivery_fee,
+            'grand_total': quote.grand_total,
+        })
+    return rows
+
 @login_required(login_url='customerlogin')
 def pending_orders_view(request):
     try:
-        vat_rate = 12
         customer = models.Customer.objects.get(user=request.user)
     except models.Customer.DoesNotExist:
         messages.error(request, 'Customer profile not found. Please contact support.')
         return redirect('customer-home')
 
     orders = models.Orders.objects.filter(customer=customer, status='Pending').order_by('-order_date', '-created_at')
-    orders_with_items = []
-
-    for order in orders:
-        order_items = models.OrderItem.objects.filter(order=order)
-        products = []
-        total = Decimal('0.00')
-        for item in order_items:
-            # Use VAT-inclusive calculation (same as cart)
-            line_total = Decimal(item.price) * item.quantity
-            total += line_total
-            products.append({
-                'item': item,
-                'size': item.size,
-                'quantity': item.quantity,
-                'line_total': line_total,
-            })
-
-        # Calculate VAT using same method as cart (VAT-inclusive)
-        vat_amount = total * Decimal(12) / Decimal(112)
-        net_subtotal = total - vat_amount
-        # Use stored delivery fee from order
-        delivery_fee = order.delivery_fee
-        grand_total = total + Decimal(delivery_fee)
-
-        orders_with_items.append({
-            'order': order,
-            'products': products,
-            'total': total,
-            'net_subtotal': net_subtotal,
-            'vat_amount': vat_amount,
-            'delivery_fee': delivery_fee,
-            'grand_total': grand_total,
-        })
+    orders_with_items = order_status_rows(orders)
 
     return render(request, 'ecom/order_status_page.html', {
         'orders_with_items': orders_with_items,
@@ -1096,38 +1012,7 @@ def to_ship_orders_view(request):
         customer=customer,
         status__in=['Processing', 'Order Confirmed']
     ).order_by('-order_date')
-    orders_with_items = []
-    for order in orders:
-        order_items = models.OrderItem.objects.filter(order=order)
-        products = []
-        total = Decimal('0.00')
-        for item in order_items:
-            # Use VAT-inclusive calculation (same as cart)
-            line_total = Decimal(item.price) * item.quantity
-            total += line_total
-            products.append({
-                'item': item,
-                'size': item.size,
-                'quantity': item.quantity,
-                'line_total': line_total,
-            })
-        
-        # Calculate VAT using same method as cart (VAT-inclusive)
-        vat_amount = total * Decimal(12) / Decimal(112)
-        net_subtotal = total - vat_amount
-        # Use stored delivery fee from order
-        delivery_fee = order.delivery_fee
-        grand_total = total + Decimal(delivery_fee)
-        
-        orders_with_items.append({
-            'order': order,
-            'products': products,
-            'total': total,
-            'net_subtotal': net_subtotal,
-            'vat_amount': vat_amount,
-            'delivery_fee': delivery_fee,
-            'grand_total': grand_total,
-        })
+    orders_with_items = order_status_rows(orders)
     return render(request, 'ecom/order_status_page.html', {'orders_with_items': orders_with_items, 'status': 'To Ship', 'title': 'Orders To Ship'})
 
 @login_required(login_url='customerlogin')
@@ -1139,38 +1024,7 @@ def to_receive_orders_view(request):
         return redirect('customer-home')
     
     orders = models.Orders.objects.filter(customer=customer, status='Out for Delivery').order_by('-order_date')
-    orders_with_items = []
-    for order in orders:
-        order_items = models.OrderItem.objects.filter(order=order)
-        products = []
-        total = Decimal('0.00')
-        for item in order_items:
-            # Use VAT-inclusive calculation (same as cart)
-            line_total = Decimal(item.price) * item.quantity
-            total += line_total
-            products.append({
-                'item': item,
-                'size': item.size,
-                'quantity': item.quantity,
-                'line_total': line_total,
-            })
-        
-        # Calculate VAT using same method as cart (VAT-inclusive)
-        vat_amount = total * Decimal(12) / Decimal(112)
-        net_subtotal = total - vat_amount
-        # Use stored delivery fee from order
-        delivery_fee = order.delivery_fee
-        grand_total = total + Decimal(delivery_fee)
-        
-        orders_with_items.append({
-            'order': order,
-            'products': products,
-            'total': total,
-            'net_subtotal': net_subtotal,
-            'vat_amount': vat_amount,
-            'delivery_fee': delivery_fee,
-            'grand_total': grand_total,
-        })
+    orders_with_items = order_status_rows(orders)
     return render(request, 'ecom/order_status_page.html', {'orders_with_items': orders_with_items, 'status': 'To Receive', 'title': 'Orders To Receive'})
 
 @login_required(login_url='customerlogin')
@@ -1182,38 +1036,7 @@ def delivered_orders_view(request):
         return redirect('customer-home')
     
     orders = models.Orders.objects.filter(customer=customer, status='Delivered').order_by('-order_date')
-    orders_with_items = []
-    for order in orders:
-        order_items = models.OrderItem.objects.filter(order=order)
-        products = []
-        total = Decimal('0.00')
-        for item in order_items:
-            # Use VAT-inclusive calculation (same as cart)
-            line_total = Decimal(item.price) * item.quantity
-            total += line_total
-            products.append({
-                'item': item,
-                'size': item.size,
-                'quantity': item.quantity,
-                'line_total': line_total,
-            })
-        
-        # Calculate VAT using same method as cart (VAT-inclusive)
-        vat_amount = total * Decimal(12) / Decimal(112)
-        net_subtotal = total - vat_amount
-        # Use stored delivery fee from order
-        delivery_fee = order.delivery_fee
-        grand_total = total + Decimal(delivery_fee)
-        
-        orders_with_items.append({
-            'order': order,
-            'products': products,
-            'total': total,
-            'net_subtotal': net_subtotal,
-            'vat_amount': vat_amount,
-            'delivery_fee': delivery_fee,
-            'grand_total': grand_total,
-        })
+    orders_with_items = order_status_rows(orders)
     return render(request, 'ecom/order_status_page.html', {'orders_with_items': orders_with_items, 'status': 'Delivered', 'title': 'Delivered Orders'})
 
 @login_required(login_url='customerlogin')
@@ -1225,38 +1048,7 @@ def cancelled_orders_view(request):
         return redirect('customer-home')
     
     orders = models.Orders.objects.filter(customer=customer, status='Cancelled').order_by('-status_updated_at')
-    orders_with_items = []
-    for order in orders:
-        order_items = models.OrderItem.objects.filter(order=order)
-        products = []
-        total = Decimal('0.00')
-        for item in order_items:
-            # Use VAT-inclusive calculation (same as cart)
-            line_total = Decimal(item.price) * item.quantity
-            total += line_total
-            products.append({
-                'item': item,
-                'size': item.size,
-                'quantity': item.quantity,
-                'line_total': line_total,
-            })
-        
-        # Calculate VAT using same method as cart (VAT-inclusive)
-        vat_amount = total * Decimal(12) / Decimal(112)
-        net_subtotal = total - vat_amount
-        # Use stored delivery fee from order
-        delivery_fee = order.delivery_fee
-        grand_total = total + Decimal(delivery_fee)
-        
-        orders_with_items.append({
-            'order': order,
-            'products': products,
-            'total': total,
-            'net_subtotal': net_subtotal,
-            'vat_amount': vat_amount,
-            'delivery_fee': delivery_fee,
-            'grand_total': grand_total,
-        })
+    orders_with_items = order_status_rows(orders)
     return render(request, 'ecom/order_status_page.html', {'orders_with_items': orders_with_items, 'status': 'Cancelled', 'title': 'Cancelled Orders'})
 
 def cart_page(request):
@@ -1299,270 +1091,117 @@ def cart_page(request):
 def search_view(request):
     query = request.GET.get('query')
     if query is not None and query != '':
-        products = models.Product.objects.all().filter(name__icontains=query)
+        products = search.search_products(models.Product.objects.all(), query)
     else:
         products = models.Product.objects.all()
 
     word = "Search Results for: " + query if query else ("Welcome, Guest" if not request.user.is_authenticated else "Welcome, " + request.user.username)
 
-    if 'product_ids' in request.COOKIES:
-        product_ids = request.COOKIES['product_ids']
-        counter=product_ids.split('|')
-        product_count_in_cart=len(set(counter))
-    else:
-        product_count_in_cart=0
+    product_count_in_cart = get_cart(request).count()
 
+    products = models.ProductVariant.objects.attach_stock(products)
     return render(request,'ecom/customer_home.html',{'products':products,'word':word,'product_count_in_cart':product_count_in_cart, 'search_text': query})
 
 
 # any one can add product to cart, no need of signin
 def add_to_cart_view(request, pk):
-    products = models.Product.objects.all()
-    
     # Get size and quantity from form if available
     size = request.POST.get('size', 'M')  # Default to M if not provided
     quantity = int(request.POST.get('quantity', 1))  # Default to 1 if not provided
     
-    # Check if product with given id and size exists
-    try:
-        product = models.Product.objects.get(id=pk, size=size)
-    except models.Product.DoesNotExist:
+    # The product's own size or any of its variants, while it has stock
+    product = models.Product.objects.filter(id=pk).only('name').first()
+    if product is None or not models.ProductVariant.objects.stock_map([pk]).get(pk, {}).get(size):
         messages.error(request, f'Sorry, size {size} is not available for this product.')
         return redirect('customer-home')
     
-    # Check if product quantity is sufficient
-    if product.quantity < quantity:
-        messages.error(request, f'Sorry, only {product.quantity} pcs available for {product.name} (Size: {size}).')
+    # Hold the whole line for this cart; units other carts hold are not available
+    cart = get_cart(request)
+    wanted = cart.quantity(pk, size) + quantity
+    available = reservations.hold(cart.holder(), pk, size, wanted)
+    if available < wanted:
+        messages.error(request, f'Sorry, only {available} pcs available for {product.name} (Size: {size}).')
         return redirect('customer-home')
     
-    # For cart counter, fetching products ids added by customer from cookies
-    if 'product_ids' in request.COOKIES:
-        product_ids = request.COOKIES['product_ids']
-        product_keys = product_ids.split('|')
-        product_count_in_cart = len(set(product_keys))
-    else:
-        product_count_in_cart = 0
-    
+    cart.add(pk, size, quantity)
+
     # Get next_page from POST or GET with a fallback to home page
     next_page = request.POST.get('next_page') or request.GET.get('next_page', '/')
-
-    # Use consistent cookie key with size
-    cookie_key = f'product_{pk}_{size}_details'
-    existing_quantity = 0
-    if cookie_key in request.COOKIES:
-        details = request.COOKIES[cookie_key].split(':')
-        if len(details) == 2:
-            existing_quantity = int(details[1])
-
-    new_quantity = existing_quantity + quantity
-
-    response = render(request, 'ecom/index.html', {
-        'products': products,
-        'product_count_in_cart': product_count_in_cart,
-        'redirect_to': next_page
-    })
-    response.set_cookie(cookie_key, f"{size}:{new_quantity}")
-
-    # Update product_ids cookie to include product_{pk}_{size}
-    product_key = f'product_{pk}_{size}'
-    if 'product_ids' in request.COOKIES:
-        product_ids = request.COOKIES['product_ids']
-        product_keys = product_ids.split('|')
-        if product_key not in product_keys:
-            product_keys.append(product_key)
-        updated_product_ids = '|'.join(product_keys)
-    else:
-        updated_product_ids = product_key
-    response.set_cookie('product_ids', updated_product_ids)
+    if not url_has_allowed_host_and_scheme(next_page, allowed_hosts={request.get_host()}):
+        next_page = '/'
 
     messages.info(request, product.name + f' (Size: {size}) added to cart successfully!')
 
-    return response
+    # Send the shopper straight back instead of rendering the catalog page
+    return redirect(next_page)
 
 def cart_view(request):
     region_choices = Customer.REGION_CHOICES
 
-    # For cart counter
-    if 'product_ids' in request.COOKIES:
-        product_ids = request.COOKIES['product_ids']
-        product_keys = product_ids.split('|')
-        product_count_in_cart = len(set(product_keys))
-    else:
-        product_count_in_cart = 0
-
-    products = []
-    total = 0
-    delivery_fee = 0
-    region = None
-    customer = None
-    if request.user.is_authenticated:
-        try:
-            customer = models.Customer.objects.get(user=request.user)
-            region = customer.region
-        except models.Customer.DoesNotExist:
-            region = None
+    cart = get_cart(request)
+    customer = cart.customer
+    region = customer.region if customer else None
     # Use dynamic shipping fee lookup
-    origin_region = "NCR"
-    destination_region = region if region else "NCR"
-    delivery_fee = get_shipping_fee(origin_region, destination_region, weight_kg=0.5)
-    # ...existing code for products, VAT, etc...
-    vat_rate = 12
-    vat_multiplier = 1 + (vat_rate / 100)
-    if 'product_ids' in request.COOKIES:
-        product_ids = request.COOKIES['product_ids']
-        product_keys = product_ids.split('|')
-        product_ids_only = set()
-        for key in product_keys:
-            parts = key.split('_')
-            if len(parts) >= 3:
-                product_id = parts[1]
-                size = '_'.join(parts[2:])
-                product_ids_only.add(product_id)
-            else:
-                product_id = parts[1]
-                size = 'M'
-                product_ids_only.add(product_id)
-        db_products = models.Product.objects.filter(id__in=product_ids_only)
-        for p in db_products:
-            for key in product_keys:
-                if key.startswith(f'product_{p.id}_'):
-                    size = key[len(f'product_{p.id}_'):]
-
-                    cookie_key = f'{key}_details'
-                    if cookie_key in request.COOKIES:
-                        details = request.COOKIES[cookie_key].split(':')
-                        if len(details) == 2:
-                            size = details[0]
-                            quantity = int(details[1])
-                            total += p.price * quantity
-                            products.append({
-                                'product': p,
-                                'size': size,
-                                'quantity': quantity
-                            })
-    # Use VAT-inclusive calculation like orders
-    vat_amount = total * 12 / 112
-    net_subtotal = total - vat_amount
-    grand_total = total + delivery_fee
+    quote = pricing.price_cart(cart.lines(), destination=region)
+    product_count_in_cart = len(quote.lines)
     
     # Get saved addresses for the current user
     saved_addresses = []
     if request.user.is_authenticated and customer:
-        saved_addresses = SavedAddress.objects.filter(customer=customer).order_by('-is_default', '-updated_at')
+        saved_addresses = utils.resolve_addresses(
+            SavedAddress.objects.filter(customer=customer).order_by('-is_default', '-updated_at'), missing_only=True
+        )
     
     response = render(request, 'ecom/cart.html', {
-        'products': products,
-        'total': total,
-        'delivery_fee': delivery_fee,
-        'vat_rate': vat_rate,
-        'vat_amount': vat_amount,
-        'net_subtotal': net_subtotal,
-        'grand_total': grand_total,
+        'products': quote.lines,
+        'total': quote.subtotal,
+        'delivery_fee': quote.delivery_fee,
+        'vat_rate': quote.vat_rate,
+        'vat_amount': quote.vat_amount,
+        'net_subtotal': quote.net_subtotal,
+        'grand_total': quote.grand_total,
         'product_count_in_cart': product_count_in_cart,
         'user_address': customer,
         'region_choices': region_choices,
         'saved_addresses': saved_addresses,
+        # One token per checkout page, so a replayed payment-success is recognised
+        'checkout_key': uuid.uuid4().hex,
     })
     return response
 
 
 def remove_from_cart_view(request, pk):
     size = request.GET.get('size', 'M')  # Get size from request, default to M
-    
-    # For counter in cart
-    if 'product_ids' in request.COOKIES:
-        product_ids = request.COOKIES['product_ids']
-        product_keys = product_ids.split('|')
-        product_count_in_cart = len(set(product_keys))
-    else:
-        product_count_in_cart = 0
 
     # Remove only the specific product with the matching size
-    specific_key = f'product_{pk}_{size}'
-    product_keys_remaining = [key for key in product_keys if key != specific_key]
-
-    products = []
-    total = 0
-
-    # Fetch remaining products
-    product_ids_only = set()
-    for key in product_keys_remaining:
-        parts = key.split('_')
-        if len(parts) >= 3:
-            product_id = parts[1]
-            product_ids_only.add(product_id)
-        elif len(parts) == 2:
-            product_id = parts[1]
-            product_ids_only.add(product_id)
-
-    db_products = models.Product.objects.filter(id__in=product_ids_only)
-
-    for p in db_products:
-        for key in product_keys_remaining:
-            if key.startswith(f'product_{p.id}_'):
-                size = key[len(f'product_{p.id}_'):]
-                cookie_key = f'{key}_details'
-                if cookie_key in request.COOKIES:
-                    details = request.COOKIES[cookie_key].split(':')
-                    if len(details) == 2:
-                        size = details[0]
-                        quantity = int(details[1])
-                        total += p.price * quantity
-                        products.append({
-                            'product': p,
-                            'size': size,
-                            'quantity': quantity
-                        })
+    cart = get_cart(request)
+    cart.remove(pk, size)
 
     # Get next_page from GET with a fallback
     next_page = request.GET.get('next_page', '/')
 
     # Get customer and region choices
     region_choices = models.Customer.REGION_CHOICES
-    customer = None
-    region = None
-    if request.user.is_authenticated:
-        try:
-            customer = models.Customer.objects.get(user=request.user)
-            region = customer.region
-        except models.Customer.DoesNotExist:
-            customer = None
-            region = None
+    customer = cart.customer
+    region = customer.region if customer else None
 
     # Use dynamic shipping fee lookup (same as orders)
-    origin_region = "NCR"
-    destination_region = region if region else "NCR"
-    delivery_fee = get_shipping_fee(origin_region, destination_region, weight_kg=0.5)
-
-    # Calculate VAT using same method as orders (VAT-inclusive)
-    vat_rate = 12
-    vat_amount = total * Decimal(vat_rate) / Decimal(112)
-    net_subtotal = total - vat_amount
-    grand_total = total + Decimal(delivery_fee)
+    quote = pricing.price_cart(cart.lines(), destination=region)
 
     response = render(request, 'ecom/cart.html', {
-        'products': products,
-        'total': total,
-        'net_subtotal': net_subtotal,
-        'delivery_fee': delivery_fee,
-        'vat_rate': vat_rate,
-        'vat_amount': vat_amount,
-        'grand_total': grand_total,
-        'product_count_in_cart': product_count_in_cart,
+        'products': quote.lines,
+        'total': quote.subtotal,
+        'net_subtotal': quote.net_subtotal,
+        'delivery_fee': quote.delivery_fee,
+        'vat_rate': quote.vat_rate,
+        'vat_amount': quote.vat_amount,
+        'grand_total': quote.grand_total,
+        'product_count_in_cart': len(quote.lines),
         'user_address': customer,  # Make sure this is passed!
         'region_choices': region_choices,
+        'checkout_key': uuid.uuid4().hex,
     })
 
-    # Remove cookie for the specific product-size combination
-    cookie_key = f'{specific_key}_details'
-    response.delete_cookie(cookie_key)
-
-    # Update product_ids cookie
-    if product_keys_remaining:
-        response.set_cookie('product_ids', '|'.join(product_keys_remaining))
-    else:
-        response.delete_cookie('product_ids')
-
     return response
 
 
@@ -1586,28 +1225,13 @@ def customer_home_view(request):
     products = models.Product.objects.all()
     
     # Cart count logic
-    if 'product_ids' in request.COOKIES:
-        product_ids = request.COOKIES['product_ids']
-        counter = product_ids.split('|')
-        product_count_in_cart = len(set(counter))
-    else:
-        product_count_in_cart = 0
+    product_count_in_cart = get_cart(request).count()
     
     # Enhanced search functionality
     search_query = request.GET.get('search')
     if search_query:
-        from django.db.models import Q
-        # Split search query into words for better matching
-        search_words = search_query.split()
-        query = Q()
-        
-        for word in search_words:
-            query |= (
-                Q(name__icontains=word) | 
-                Q(description__icontains=word)
-            )
-        
-        products = products.filter(query).distinct()
+        # Ranked full-text match on name and description
+        products = search.search_products(products, search_query)
     
     # Price range filter
     min_price = request.GET.get('min_price')
@@ -1626,9 +1250,7 @@ def customer_home_view(request):
     # Availability filter
     in_stock_only = request.GET.get('in_stock')
     if in_stock_only:
-        # Get products that have inventory items with quantity > 0
-        available_products = models.InventoryItem.objects.filter(quantity__gt=0).values_list('product_id', flat=True)
-        products = products.filter(id__in=available_products)
+        products = models.ProductVariant.objects.in_stock(products)
     
     # Sort functionality
     sort_by = request.GET.get('sort')
@@ -1641,24 +1263,17 @@ def customer_home_view(request):
     elif sort_by == 'newest':
         products = products.order_by('-id')
     elif sort_by == 'popular':
-        # Sort by number of orders (most popular first)
-        from django.db.models import Count
-        products = products.annotate(
-            order_count=Count('orderitem')
-        ).order_by('-order_count')
+        # Most ordered first; a stored, indexed column that skips cancelled orders
+        products = products.order_by('-order_count', '-units_sold', 'id')
     
-    # Pagination
-    from django.core.paginator import Paginator
-    paginator = Paginator(products, 12)  # Show 12 products per page
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Pagination: the 12 products after the cursor by sort key and id, with
+    # no COUNT or OFFSET; the total is only counted (and cached) if shown
+    page_obj = pagination.paginate(products, request.GET.get('cursor'), per_page=12)
+    # Per-size stock for the size picker, for the whole page in one query
+    models.ProductVariant.objects.attach_stock(page_obj)
     
-    # Get price range for filters
-    from django.db.models import Min, Max
-    price_range = models.Product.objects.aggregate(
-        min_price=Min('price'),
-        max_price=Max('price')
-    )
+    # Price range and facet counts for the filters, cached between catalog changes
+    catalog_summary = catalog.summary()
     
     # Get customer's recent orders for recommendations and wishlist items
     recent_orders = []
@@ -1687,8 +1302,9 @@ def customer_home_view(request):
         'max_price': max_price,
         'sort_by': sort_by,
         'in_stock_only': in_stock_only,
-        'price_range': price_range,
-        'total_products': paginator.count,
+        'price_range': catalog_summary['price_range'],
+        'catalog_summary': catalog_summary,
+        'page_query': pagination.page_query(request.GET),
         'product_count_in_cart': product_count_in_cart,
         'recent_orders': recent_orders,
         'wishlist_product_ids': wishlist_product_ids,
@@ -1702,31 +1318,11 @@ def customer_home_view(request):
 @login_required(login_url='customerlogin')
 def customer_address_view(request):
     # Check if product is present in cart
-    product_in_cart = False
-    product_count_in_cart = 0
-    total = 0
-
-    if 'product_ids' in request.COOKIES:
-        product_ids = request.COOKIES['product_ids']
-        if product_ids != "":
-            product_in_cart = True
-            counter = product_ids.split('|')
-            product_count_in_cart = len(set(counter))
-            
-            # Calculate total price
-            product_id_in_cart = product_ids.split('|')
-            products = models.Product.objects.all().filter(id__in=product_id_in_cart)
-            for p in products:
-                # Calculate quantity from cookies for each product
-                quantity = 1
-                for key in product_ids.split('|'):
-                    if key.startswith(f'product_{p.id}_'):
-                        cookie_key = f'{key}_details'
-                        if cookie_key in request.COOKIES:
-                            details = request.COOKIES[cookie_key].split(':')
-                            if len(details) == 2:
-                                quantity = int(details[1])
-                total += p.price * quantity
+    cart = get_cart(request)
+    quote = pricing.price_cart(cart.lines(), destination=cart.customer.region if cart.customer else None)
+    product_in_cart = bool(quote.lines)
+    product_count_in_cart = len(quote.lines)
+    total = quote.subtotal
 
     # Get payment method from query parameter
     payment_method = request.GET.get('method', 'cod')
@@ -1739,8 +1335,9 @@ def customer_address_view(request):
                 'product_count_in_cart': product_count_in_cart
             })
         
-        # Redirect directly to payment success for COD
-        return redirect(f'/payment-success?method=cod')
+        # Redirect directly to payment success for COD, keeping any checkout token
+        key = request.GET.get('key')
+        return redirect(f'/payment-success?method=cod&key={key}' if key else '/payment-success?method=cod')
 
     # For other payment methods, show address form
     addressForm = forms.AddressForm()
@@ -1766,27 +1363,21 @@ def customer_address_view(request):
 
 @login_required(login_url='customerlogin')
 def payment_success_view(request):
-    import uuid
     try:
         customer = models.Customer.objects.get(user_id=request.user.id)
     except models.Customer.DoesNotExist:
         messages.error(request, 'Customer profile not found. Please contact support.')
         return redirect('customer-home')
     
-    products = []
+    cart = get_cart(request)
     payment_method = request.GET.get('method', 'cod')  # Default to COD if not specified
 
-    if 'product_ids' in request.COOKIES:
-        product_ids = request.COOKIES['product_ids']
-        if product_ids != "":
-            product_keys = request.COOKIES['product_ids'].split('|')
-            product_ids_only = set()
-            for key in product_keys:
-                parts = key.split('_')
-                if len(parts) >= 3:
-                    product_id = parts[1]
-                    product_ids_only.add(product_id)
-            products = list(models.Product.objects.filter(id__in=product_ids_only))
+    # A refresh or redirect retry carries the same checkout token: show the
+    # order it already placed without touching the cart or stock again
+    token = request.GET.get('key') or request.META.get('HTTP_IDEMPOTENCY_KEY')
+    key = order_service.checkout_key(customer, token) if token else None
+    if order_service.find_order(key) is not None:
+        return render(request, 'ecom/payment_success.html')
 
     # For COD, use customer's profile information
     if payment_method == 'cod':
@@ -1798,79 +1389,34 @@ def payment_success_view(request):
         email = request.COOKIES.get('email', customer.user.email)
         mobile = request.COOKIES.get('mobile', str(customer.mobile))
         address = request.COOKIES.get('address', customer.get_full_address)
-
-    # Generate a unique short order reference ID
-    import random
-    import string
-    def generate_order_ref(length=12):
-        return ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
-
-    order_ref = generate_order_ref()
+    # The profile address keeps its PSGC codes on the order; a typed one has none
+    ship_to = customer if address == customer.get_full_address else None
 
     # Calculate delivery fee using same logic as cart
-    region = customer.region if hasattr(customer, 'region') else None
-    origin_region = "NCR"
-    destination_region = region if region else "NCR"
-    delivery_fee = get_shipping_fee(origin_region, destination_region, weight_kg=0.5)
-
-    # Create the parent order entry with order_ref and delivery_fee
-    initial_status = 'Processing' if payment_method == 'paypal' else 'Pending'
-    parent_order = models.Orders.objects.create(
-        customer=customer,
-        status=initial_status,
-        email=email,
-        mobile=mobile,
-        address=address,
-        payment_method=payment_method,
-        order_date=timezone.now(),
-        status_updated_at=timezone.now(),
-        notes=f"Order Group ID: {order_ref}",
-        order_ref=order_ref,
-        delivery_fee=delivery_fee
-    )
+    quote = pricing.price_cart(cart.lines(), destination=customer.region)
 
-    # Create order items linked to the parent order
-    for product in (products or []):
-        quantity = 1  # Default quantity to 1
-        size = 'M'  # Default size
-        for key in product_keys:
-            if key.startswith(f'product_{product.id}_'):
-                cookie_key = f'{key}_details'
-                if cookie_key in request.COOKIES:
-                    details = request.COOKIES[cookie_key].split(':')
-                    if len(details) == 2:
-                        size = details[0]
-                        quantity = int(details[1])
-
-                # Create order item linked to parent order with size
-                models.OrderItem.objects.create(
-                    order=parent_order,
-                    product=product,
-                    quantity=quantity,
-                    price=product.price,
-                    size=size
-                )
+    # Without a token, the same cart checked out again shortly is the replay
+    replay_window = None
+    if key is None:
+        key = order_service.checkout_key(customer, quote=quote, payment_method=payment_method)
+        replay_window = order_service.SNAPSHOT_REPLAY_WINDOW
 
-                # Decrease product quantity
-                product.quantity = max(0, product.quantity - quantity)
-                product.save()
-                print(f"Product {product.id} quantity decreased by {quantity}. New quantity: {product.quantity}")
+    # Create the order and its items and take the stock, all or nothing
+    try:
+        order_service.place_order(
+            customer, quote, payment_method, email=email, mobile=mobile, address=address,
+            idempotency_key=key, replay_window=replay_window, holder=cart.holder(create=False), ship_to=ship_to,
+        )
+    except order_service.EmptyCart:
+        messages.error(request, 'Your cart is empty.')
+        return redirect('cart')
+    except order_service.InsufficientStock as e:
+        messages.error(request, f'Sorry, only {e.available} pcs available for {e.product.name}.')
+        return redirect('cart')
 
-                # Update inventory item quantity
-                try:
-                    inventory_item = models.InventoryItem.objects.get(name=product.name)
-                    if inventory_item.quantity >= quantity:
-                        inventory_item.quantity = max(0, inventory_item.quantity - quantity)
-                        inventory_item.save()
-                        print(f"Inventory item {inventory_item.name} quantity decreased by {quantity}. New quantity: {inventory_item.quantity}")
-                    else:
-                        print(f"Warning: Insufficient inventory for {inventory_item.name}")
-                except models.InventoryItem.DoesNotExist:
-                    print(f"Warning: No inventory item found for product {product.name}")
-
-    # Clear cookies after order placement
+    # Clear the cart after order placement
+    cart.clear()
     response = render(request, 'ecom/payment_success.html')
-    response.delete_cookie('product_ids')
 
     # Only clear address cookies for non-COD payments
     if payment_method != 'cod':
@@ -1878,13 +1424,6 @@ def payment_success_view(request):
         response.delete_cookie('mobile')
         response.delete_cookie('address')
 
-    # Clear product-specific cookies
-    for product in (products or []):
-        for key in product_keys:
-            if key.startswith(f'product_{product.id}_'):
-                cookie_key = f'{key}_details'
-                response.delete_cookie(cookie_key)
-
     return response
 
 def place_order(request):
@@ -1924,17 +1463,17 @@ def place_order(request):
 def cancel_order_view(request, order_id):
     try:
         customer = models.Customer.objects.get(user_id=request.user.id)
-        order = models.Orders.objects.get(id=order_id, customer=customer)
-        if order.status == 'Pending':
-            # Restore stock for each item in the order
-            order_items = models.OrderItem.objects.filter(order=order)
-            for item in order_items:
-                product = item.product
-                product.quantity += item.quantity
-                product.save()
-            order.status = 'Cancelled'
-            order.status_updated_at = timezone.now()
-            order.save()
+        with transaction.atomic():
+            # Locked so a double submit cannot restock twice
+            order = models.Orders.objects.select_for_update().get(id=order_id, customer=customer)
+            cancelled = order.status == 'Pending'
+            if cancelled:
+                # Restore product and per-size stock for every item at once
+                order_service.restock(order)
+                order.status = 'Cancelled'
+                order.status_updated_at = timezone.now()
+                order.save()
+        if cancelled:
             messages.success(request, 'Order cancelled successfully!')
         else:
             messages.error(request, 'Order cannot be cancelled at this time.')
@@ -1955,14 +1494,13 @@ def my_order_view(request):
     except models.Customer.DoesNotExist:
         messages.error(request, 'Customer profile not found. Please contact support.')
         return redirect('customer-home')
-    orders = models.Orders.objects.filter(customer=customer).order_by('-order_date')
+    orders = models.Orders.objects.filter(customer=customer).order_by('-order_date').prefetch_related(
+        Prefetch('orderitem_set', queryset=models.OrderItem.objects.select_related('product'))
+    )
     orders_with_items = []
     for order in orders:
-        order_items = models.OrderItem.objects.filter(order=order)
-        total_price = 0
-        for item in order_items:
-            total_price += item.price * item.quantity
-        order.total = total_price
+        order_items = order.orderitem_set.all()
+        order.total = pricing.price_cart(order_items, delivery_fee=order.delivery_fee).subtotal
         orders_with_items.append({
             'order': order,
             'items': order_items
@@ -2004,41 +1542,21 @@ def render_to_pdf(template_src, context_dict):
 
 
 def download_invoice_view(request, order_id):
-    order = models.Orders.objects.get(id=order_id)
-    order_items = models.OrderItem.objects.filter(order=order)
+    order = models.Orders.objects.select_related('customer__user').get(id=order_id)
+    order_items = models.OrderItem.objects.filter(order=order).select_related('product')
     customer = order.customer
 
-    # Use dynamic shipping fee lookup (same as pending_orders_view)
-    region = customer.region if hasattr(customer, 'region') else None
-    origin_region = "NCR"
-    destination_region = region if region else "NCR"
-    delivery_fee = Decimal(str(get_shipping_fee(origin_region, destination_region, weight_kg=0.5)))
-
-    subtotal = Decimal('0.00')
-    products = []
-    for item in order_items:
-        line_total = Decimal(item.price) * item.quantity
-        subtotal += line_total
-        products.append({
-            'item': item,
-            'size': item.size,
-            'quantity': item.quantity,
-            'unit_price': Decimal(item.price),
-            'line_total': line_total,
-        })
-
-    net_subtotal = subtotal / Decimal('1.12')
-    vat_amount = subtotal - net_subtotal
-    grand_total = subtotal + delivery_fee
+    # Bill the delivery fee charged when the order was placed
+    quote = pricing.price_cart(order_items, delivery_fee=order.delivery_fee)
 
     context = {
         'order': order,
-        'products': products,
-        'net_subtotal': net_subtotal,
-        'vat_amount': vat_amount,
-        'subtotal': subtotal,
-        'delivery_fee': delivery_fee,
-        'grand_total': grand_total,
+        'products': quote.lines,
+        'net_subtotal': quote.net_subtotal,
+        'vat_amount': quote.vat_amount,
+        'subtotal': quote.subtotal,
+        'delivery_fee': quote.delivery_fee,
+        'grand_total': quote.grand_total,
         'customer': customer,
     }
 
@@ -2122,10 +1640,11 @@ def contactus_view(request):
     if request.method == 'POST':
         sub = forms.ContactusForm(request.POST)
         if sub.is_valid():
-            email = sub.cleaned_data['Email']
-            name=sub.cleaned_data['Name']
-            message = sub.cleaned_data['Message']
-            send_mail(str(name)+' || '+str(email),message, settings.EMAIL_HOST_USER, settings.EMAIL_RECEIVING_USER, fail_silently = False)
+            email = sub.cleaned_data['email']
+            name=sub.cleaned_data['name']
+            message = sub.cleaned_data['message']
+            # Sent by the worker, so the page does not wait on SMTP
+            jobs.enqueue(tasks.send_contact_email, name=str(name), email=str(email), message=message)
             return render(request, 'ecom/contactussuccess.html')
     return render(request, 'ecom/contactus.html', {'form':sub})
 
@@ -2162,51 +1681,32 @@ def interactive_jersey(request):
 #------------------------ PAYMONGO -------------------------
 #-----------------------------------------------------------
 
-# Replace with your own PayMongo test key
-PAYMONGO_SECRET_KEY = 'sk_test_FFfnvsMb2YQSctcZ3NY8wThb'
+PAYMONGO_CHECKOUT_URL = "https://api.paymongo.com/v1/checkout_sessions"
 
 def create_gcash_payment(request):
-    url = "https://api.paymongo.com/v1/checkout_sessions"
-    headers = {
-        "Authorization": f"Basic {PAYMONGO_SECRET_KEY}",
-        "Content-Type": "application/json"
-    }
+    # PayMongo may redirect to the success URL more than once; the token in it
+    # makes the order idempotent
+    checkout_token = request.GET.get('key') or uuid.uuid4().hex
 
-    # Extract product details from cookies or session (example using cookies)
-    product_ids = request.COOKIES.get('product_ids', '')
-    if not product_ids:
+    # The checkout session carries the items only, so skip the fee lookup
+    quote = pricing.price_cart(get_cart(request).lines(), delivery_fee=0)
+    if not quote.lines:
         return JsonResponse({"error": "No products in cart"}, status=400)
 
-    product_keys = product_ids.split('|')
     product_details = []
     total_amount = 0
 
     # Use a list to preserve order of products as in cart
-    for key in product_keys:
-        cookie_key = f"{key}_details"
-        if cookie_key in request.COOKIES:
-            details = request.COOKIES[cookie_key].split(':')
-            if len(details) == 2:
-                size = details[0]
-                quantity = int(details[1])
-                # Extract product id from key format: product_{id}_{size}
-                parts = key.split('_')
-                if len(parts) >= 2:
-                    product_id = parts[1]
-                    try:
-                        product = models.Product.objects.get(id=product_id)
-                        # Ensure product.price is decimal or float, convert to int cents properly
-                        unit_price_cents = int(round(float(product.price) * 100))
-                        total_amount += unit_price_cents * quantity
-                        print(f"DEBUG: Product: {product.name}, Unit Price: {product.price}, Quantity: {quantity}, Amount (cents): {unit_price_cents * quantity}")
-                        product_details.append({
-                            "currency": "PHP",
-                            "amount": unit_price_cents,
-                            "name": f"{product.name} (Size: {size})",
-                            "quantity": quantity
-                        })
-                    except models.Product.DoesNotExist:
-                        continue
+    for line in quote.lines:
+        product, size, quantity = line.product, line.size, line.quantity
+        unit_price_cents = int(line.unit_price * 100)
+        total_amount += unit_price_cents * quantity
+        product_details.append({
+            "currency": "PHP",
+            "amount": unit_price_cents,
+            "name": f"{product.name} (Size: {size})",
+            "quantity": quantity
+        })
 
     if not product_details:
         return JsonResponse({"error": "No valid products found"}, status=400)
@@ -2224,20 +1724,28 @@ def create_gcash_payment(request):
                 "line_items": product_details,
                 "payment_method_types": ["gcash"],
                 "description": f"GCash Payment for {len(product_details)} item(s)",
-                "success_url": "http://127.0.0.1:8000/payment-success/",
+                "success_url": f"http://127.0.0.1:8000/payment-success/?key={checkout_token}",
                 "cancel_url": "http://127.0.0.1:8000/payment-cancel/"
             }
         }
     }
 
-    response = requests.post(url, headers=headers, json=payload, auth=(PAYMONGO_SECRET_KEY, ''))
-    data = response.json()
-
+    # Opened while the shopper waits, since they are redirected to it. POSTs
+    # are never retried (see http_client), so no duplicate session is created;
+    # a slow or failed call ends in an error after PAYMONGO_TIMEOUT seconds
     try:
+        response = http_client.post(
+            PAYMONGO_CHECKOUT_URL,
+            headers={"Content-Type": "application/json"},
+            json=payload,
+            auth=(settings.PAYMONGO_SECRET_KEY, ''),
+            timeout=settings.PAYMONGO_TIMEOUT,
+        )
+        data = response.json()
         checkout_url = data['data']['attributes']['checkout_url']
-        return redirect(checkout_url)
-    except KeyError:
-        return JsonResponse({"error": "Payment creation failed", "details": data}, status=400)
+    except (requests.RequestException, ValueError, KeyError, TypeError):
+        return render(request, 'ecom/gcash_error.html', status=502)
+    return redirect(checkout_url)
 
 from django.views.decorators.http import require_GET
 from django.core.serializers.json import DjangoJSONEncoder
@@ -2319,13 +1827,10 @@ def admin_manage_inventory_view(request):
     else:
         form = InventoryForm()
 
-    inventory_items = models.InventoryItem.objects.all()
+    inventory_items = models.ProductVariant.objects.select_related('product').order_by('product__name', 'size')
 
     total_items = inventory_items.count()
-    from django.db.models import F
-    # The field is named 'low_stock_threshold' in the form, but in the model it seems to be 'description' or missing
-    # From error, low_stock_threshold is not a field in InventoryItem model
-    # So we will treat low_stock_threshold as a constant threshold, e.g., 10
+    # Variants have no threshold of their own, so one constant applies to all
     LOW_STOCK_THRESHOLD = 10
     low_stock_items = inventory_items.filter(quantity__lte=LOW_STOCK_THRESHOLD, quantity__gt=0).count()
     out_of_stock_items = inventory_items.filter(quantity=0).count()
@@ -2342,50 +1847,7 @@ def admin_manage_inventory_view(request):
     })
 
 def get_shipping_fee(origin_region, destination_region, weight_kg=0.5):
-    from .models import ShippingFee
-    
-    # Region mapping from customer format to shipping fee format
-    region_mapping = {
-        'Region R1': 'Region I',
-        'Region R2': 'Region II', 
-        'Region R3': 'Region III',
-        'Region R4A': 'Region IV-A',
-        'Region R4B': 'Region IV-B',
-        'Region R5': 'Region V',
-        'Region R6': 'Region VI',
-        'Region R7': 'Region VII',
-        'Region R8': 'Region VIII',
-        'Region R9': 'Region IX',
-        'Region R10': 'Region X',
-        'Region R11': 'Region XI',
-        'Region R12': 'Region XII',
-        'Region R13': 'Region XIII',
-        'NCR': 'NCR',
-        'CAR': 'CAR',
-        'BARMM': 'BARMM'
-    }
-    
-    # Map regions to proper format
-    mapped_origin = region_mapping.get(origin_region, origin_region)
-    mapped_destination = region_mapping.get(destination_region, destination_region)
-    
-    try:
-        # Find the shipping fee with weight greater than or equal to the requested weight
-        fee = ShippingFee.objects.filter(
-            courier="Standard",
-            origin_region=mapped_origin,
-            destination_region=mapped_destination,
-            weight_kg__gte=weight_kg
-        ).order_by('weight_kg').first()
-        
-        if fee:
-            return float(fee.price_php)
-        else:
-            # Default fee if no matching record found
-            return 50.0
-    except Exception as e:
-        print(f"Error getting shipping fee: {e}")
-        return 50.0
+    return float(pricing.shipping_fee(destination_region, weight_kg, origin_region))
 
 @login_required
 def save_new_address(request):
@@ -2492,7 +1954,9 @@ def delete_address(request, address_id):
 def manage_addresses_view(request):
     """View for managing customer addresses on a dedicated page"""
     customer = Customer.objects.get(user=request.user)
-    saved_addresses = SavedAddress.objects.filter(customer=customer).order_by('-is_default', '-updated_at')
+    saved_addresses = utils.resolve_addresses(
+        SavedAddress.objects.filter(customer=customer).order_by('-is_default', '-updated_at'), missing_only=True
+    )
     
     context = {
         'saved_addresses': saved_addresses,
@@ -5,8 +5,8 @@ from django.http import JsonResponse
 from django.contrib import messages
 from django.views.decorators.csrf import csrf_protect, csrf_exempt
 from django.views.decorators.http import require_GET
-from django.db.models import Q, Avg
-from . import models
+from . import catalog, models, pagination, recommendations, search
+from .cart import get_cart
 
 def is_customer(user):
     return user.groups.filter(name='CUSTOMER').exists()
@@ -68,12 +68,7 @@ def wishlist_view(request):
             })
         
         # Cart count logic
-        if 'product_ids' in request.COOKIES:
-            product_ids = request.COOKIES['product_ids']
-            counter = product_ids.split('|')
-            product_count_in_cart = len(set(counter))
-        else:
-            product_count_in_cart = 0
+        product_count_in_cart = get_cart(request).count()
         
         context = {
             'wishlist_items': wishlist_items,
@@ -135,10 +130,8 @@ def product_detail_view(request, product_id):
         # Get product reviews
         reviews = models.ProductReview.objects.filter(product=product).select_related('customer__user').order_by('-created_at')
         
-        # Calculate average rating
-        avg_rating = reviews.aggregate(avg_rating=Avg('rating'))['avg_rating']
-        if avg_rating:
-            avg_rating = round(avg_rating, 1)
+        # Stored on the product, kept in step with its reviews
+        avg_rating = round(product.average_rating, 1) if product.rating_count else None
         
         # Check if current user has this product in wishlist
         in_wishlist = False
@@ -159,21 +152,16 @@ def product_detail_view(request, product_id):
                 pass
         
         # Cart count logic
-        if 'product_ids' in request.COOKIES:
-            product_ids = request.COOKIES['product_ids']
-            counter = product_ids.split('|')
-            product_count_in_cart = len(set(counter))
-        else:
-            product_count_in_cart = 0
+        product_count_in_cart = get_cart(request).count()
         
-        # Get related products (random selection)
-        related_products = models.Product.objects.exclude(id=product.id).order_by('?')[:4]
+        # Frequently bought together, precomputed (ecom.recommendations)
+        related_products = recommendations.for_product(product, limit=4)
         
         context = {
             'product': product,
             'reviews': reviews,
             'avg_rating': avg_rating,
-            'review_count': reviews.count(),
+            'review_count': product.rating_count,
             'in_wishlist': in_wishlist,
             'user_review': user_review,
             'product_count_in_cart': product_count_in_cart,
@@ -212,16 +200,7 @@ def search_products_api(request):
     products = models.Product.objects.all()
     
     if query:
-        search_words = query.split()
-        search_query = Q()
-        
-        for word in search_words:
-            search_query |= (
-                Q(name__icontains=word) | 
-                Q(description__icontains=word)
-            )
-        
-        products = products.filter(search_query).distinct()
+        products = search.search_products(products, query)
     
 
     
@@ -237,11 +216,11 @@ def search_products_api(request):
         except ValueError:
             pass
     
-    # Limit results for API
-    products = products[:20]
+    # 20 results per request; next_cursor fetches the following ones
+    page = pagination.paginate(products, request.GET.get('cursor'), per_page=20)
     
     products_data = []
-    for product in products:
+    for product in page:
         products_data.append({
             'id': product.id,
             'name': product.name,
@@ -250,4 +229,14 @@ def search_products_api(request):
             'image_url': product.product_image.url if product.product_image else None,
         })
     
-    return JsonResponse({'products': products_data})
\ No newline at end of file
+    data = {'products': products_data, 'next_cursor': page.next_cursor, 'has_more': page.has_next()}
+    if request.GET.get('count'):
+        # Optional and cached, so scrolling through results never counts them
+        data['total'] = page.total
+    return JsonResponse(data)
+
+
+@require_GET
+def catalog_summary_api(request):
+    """Price range, price buckets and size/stock counts for filter sidebars"""
+    return JsonResponse(catalog.summary())
@@ -52,6 +52,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'ecom.middleware.CartMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 
@@ -161,8 +162,69 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 PAYPAL_CLIENT_ID = config('PAYPAL_CLIENT_ID', default='AbktyGNl4UcmLDfE0d0Wm_YMY_bdcDmRO5dc3TEl7zR2XXACyUanC5vQr6lC4M4umP12sagxFbh1MP6J')
 PAYPAL_SECRET_KEY = config('PAYPAL_SECRET_KEY', default='ELWqmuYmOjP4ssKV-II1KQuudeNpk4dngnQc_bpZD4L9Am9UFNrXTUgDl2GPq6OYa2YiSoFZSsLYygst')
 
+# PayMongo API Credentials (GCash checkout); replace with your own test key
+PAYMONGO_SECRET_KEY = config('PAYMONGO_SECRET_KEY', default='sk_test_FFfnvsMb2YQSctcZ3NY8wThb')
+# Seconds the GCash checkout waits for PayMongo to open a session before showing an error
+PAYMONGO_TIMEOUT = config('PAYMONGO_TIMEOUT', default=10, cast=int)
+
 # PSGC API Configuration
 PSGC_API_BASE_URL = config('PSGC_API_BASE_URL', default='https://psgc.gitlab.io/api')
+PSGC_API_TIMEOUT = config('PSGC_API_TIMEOUT', default=5, cast=float)
+# Stop calling the API after this many consecutive failures, then probe again after the reset timeout (seconds)
+PSGC_CIRCUIT_FAILURES = config('PSGC_CIRCUIT_FAILURES', default=5, cast=int)
+PSGC_CIRCUIT_RESET_TIMEOUT = config('PSGC_CIRCUIT_RESET_TIMEOUT', default=30, cast=int)
+
+# Outbound HTTP client (ecom.http_client): connections kept per host, default timeout (seconds), retries
+HTTP_CLIENT_POOL_SIZE = config('HTTP_CLIENT_POOL_SIZE', default=10, cast=int)
+HTTP_CLIENT_TIMEOUT = config('HTTP_CLIENT_TIMEOUT', default=10, cast=float)
+HTTP_CLIENT_RETRIES = config('HTTP_CLIENT_RETRIES', default=2, cast=int)
+
+# A checkout without a client token is keyed on its cart; the same cart checked
+# out again within this many seconds is treated as a replay (ecom.orders)
+CHECKOUT_SNAPSHOT_REPLAY_WINDOW = config('CHECKOUT_SNAPSHOT_REPLAY_WINDOW', default=600, cast=int)
+
+# Seconds a cart line holds its stock after the last change (ecom.reservations), and
+# how often the job worker deletes lapsed holds
+STOCK_HOLD_TTL = config('STOCK_HOLD_TTL', default=15 * 60, cast=int)
+STOCK_HOLD_EXPIRY_INTERVAL = config('STOCK_HOLD_EXPIRY_INTERVAL', default=5 * 60, cast=int)
+
+# Background jobs (ecom.jobs, python manage.py run_worker): first retry delay and
+# its cap (seconds), how long a running job may go before it is requeued, and how
+# often workers queue periodic tasks that are due
+JOB_RETRY_BACKOFF = config('JOB_RETRY_BACKOFF', default=10, cast=int)
+JOB_RETRY_BACKOFF_MAX = config('JOB_RETRY_BACKOFF_MAX', default=60 * 60, cast=int)
+JOB_LOCK_TIMEOUT = config('JOB_LOCK_TIMEOUT', default=10 * 60, cast=int)
+JOB_SCHEDULE_INTERVAL = config('JOB_SCHEDULE_INTERVAL', default=60, cast=int)
+
+# Product search (ecom.search) returns at most this many matches, best first
+SEARCH_MAX_RESULTS = config('SEARCH_MAX_RESULTS', default=1000, cast=int)
+
+# Catalog listings (ecom.pagination) cache their total product count for this many seconds
+CATALOG_COUNT_TIMEOUT = config('CATALOG_COUNT_TIMEOUT', default=5 * 60, cast=int)
+
+# Catalog filter summary (ecom.catalog): cache lifetime as a bound on staleness after
+# writes that send no signals, and the number of price histogram buckets
+CATALOG_SUMMARY_TIMEOUT = config('CATALOG_SUMMARY_TIMEOUT', default=60 * 60, cast=int)
+CATALOG_PRICE_BUCKETS = config('CATALOG_PRICE_BUCKETS', default=5, cast=int)
+
+# Anonymous catalog grid cache (ecom.page_cache): seconds an entry is fresh, then how
+# much longer it is served while one request rebuilds it in the background
+CATALOG_PAGE_TTL = config('CATALOG_PAGE_TTL', default=5 * 60, cast=int)
+CATALOG_PAGE_STALE = config('CATALOG_PAGE_STALE', default=60, cast=int)
+# Background threads rebuilding grids at once, per process
+CATALOG_PAGE_REFRESH_THREADS = config('CATALOG_PAGE_REFRESH_THREADS', default=4, cast=int)
+# Seconds a process reuses the catalog version and summary before asking the shared cache
+# again; other processes see a change after at most this long
+CATALOG_SHARED_REFRESH = config('CATALOG_SHARED_REFRESH', default=5, cast=int)
+
+# "Frequently bought together" (ecom.recommendations): partners kept per product, how
+# many orders a pair needs in common to count, and seconds between full rebuilds by the job worker
+RECOMMENDATIONS_TOP_K = config('RECOMMENDATIONS_TOP_K', default=8, cast=int)
+RECOMMENDATIONS_MIN_CO_ORDERS = config('RECOMMENDATIONS_MIN_CO_ORDERS', default=1, cast=int)
+RECOMMENDATIONS_REBUILD_INTERVAL = config('RECOMMENDATIONS_REBUILD_INTERVAL', default=24 * 60 * 60, cast=int)
+
+# Compiled PSGC name table shared by all workers (python manage.py build_psgc_table)
+PSGC_TABLE_PATH = config('PSGC_TABLE_PATH', default=os.path.join(BASE_DIR, 'psgc_table.bin'))
 
 # Cache Configuration
 CACHES = {
@@ -173,5 +235,20 @@ CACHES = {
         'OPTIONS': {
             'MAX_ENTRIES': 1000,
         }
-    }
+    },
+    # Keys every process must agree on: the catalog page version stamp and the
+    # catalog summary (ecom.page_cache, ecom.catalog). Invalidating them in a
+    # per-process cache would leave the other workers serving stale data.
+    # Create its table with python manage.py createcachetable on deploy.
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'ecom_shared_cache',
+        'TIMEOUT': None,
+    },
+    # Per-process copies of those keys, kept for CATALOG_SHARED_REFRESH seconds
+    # so a catalog request does not have to ask the shared cache every time
+    'local': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ecom-local',
+    },
 }
@@ -12,6 +12,7 @@ from django.conf.urls.static import static
 from ecom.views import admin_manage_inventory_view
 from ecom import api_views
 from ecom import chatbot_views
+from ecom import cart_views
 
 
 
@@ -85,6 +86,8 @@ urlpatterns = [
     path('add-to-cart/<int:pk>/', views.add_to_cart_view,name='add-to-cart'),
     path('cart', views.cart_view,name='cart'),
     path('remove-from-cart/<int:pk>', views.remove_from_cart_view,name='remove-from-cart'),
+    path('api/cart/items', cart_views.cart_add_item, name='api-cart-add-item'),
+    path('api/cart/items/<int:product_id>/<str:size>', cart_views.cart_remove_item, name='api-cart-remove-item'),
     path('customer-address', views.customer_address_view,name='customer-address'),
     path('payment-success/', views.payment_success_view,name='payment-success'),
     path('customizer/', views.jersey_customizer, name='customizer'),
@@ -119,6 +122,7 @@ urlpatterns = [
     path('api/provinces/', api_views.get_provinces, name='api-provinces'),
     path('api/cities/', api_views.get_cities, name='api-cities'),
     path('api/barangays/', api_views.get_barangays, name='api-barangays'),
+    path('api/places/suggest/', api_views.suggest_places, name='api-places-suggest'),
     
     # AI Design Generation API
     path('api/generate-ai-design/', api_views.generate_ai_design, name='api-generate-ai-design'),
@@ -141,6 +145,7 @@ urlpatterns = [
     
     # Enhanced search API
     path('api/search/', wishlist_views.search_products_api, name='search-api'),
+    path('api/catalog-summary/', wishlist_views.catalog_summary_api, name='catalog-summary-api'),
     
     # Chatbot URLs
     path('chatbot/', chatbot_views.chatbot_widget, name='chatbot-widget'),